@@ -8,12 +8,99 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME", "whatsapp_inbox")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "messages")
+# One client per worker process: connections open <= MONGO_MAX_POOL_SIZE x API_WORKERS.
+# 0 leaves a timeout unset (wait indefinitely)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "120000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))  # for a free pooled connection
+# Create missing indexes (storage/mongo.py INDEXES) on startup; redundant ones are only reported
+MONGO_MANAGE_INDEXES = os.getenv("MONGO_MANAGE_INDEXES", "true").lower() == "true"
+
+# Storage backend: mongo (default) | sqlite (embedded, single node) | memory (tests)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "inbox.db")
+SQLITE_READ_THREADS = int(os.getenv("SQLITE_READ_THREADS", "4"))  # each with its own read-only connection
 
 # WhatsApp Configuration
 WHATSAPP_ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
 WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
 WEBHOOK_VERIFY_TOKEN = os.getenv("WEBHOOK_VERIFY_TOKEN", "your_verify_token")
+WHATSAPP_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com")  # fake: benchmarks/fake_graph.py
+WHATSAPP_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v22.0")
+WHATSAPP_TIMEOUT_SECONDS = float(os.getenv("WHATSAPP_TIMEOUT_SECONDS", "10"))
+WHATSAPP_MAX_CONNECTIONS = int(os.getenv("WHATSAPP_MAX_CONNECTIONS", "20"))
+WHATSAPP_MAX_CONCURRENCY = int(os.getenv("WHATSAPP_MAX_CONCURRENCY", "20"))
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE") or None  # e.g. 91: for numbers written with a trunk 0
+
+# Webhook ingestion (background batch writer)
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+WEBHOOK_FLUSH_INTERVAL = float(os.getenv("WEBHOOK_FLUSH_INTERVAL", "0.2"))
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "10000"))
+
+# Outbound queue (/api/send): delivered by a worker pool, retried with backoff
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_RATE_PER_SECOND = float(os.getenv("OUTBOX_RATE_PER_SECOND", "20"))  # across all workers and API_WORKERS
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "2"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "300"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))  # renewed right before a send; > one send's timeout
+
+# Bulk campaigns (/api/campaigns): uploaded contact files, sent in the background
+CAMPAIGN_DIR = os.getenv("CAMPAIGN_DIR", "campaigns")  # uploaded files, removed when a campaign ends
+CAMPAIGN_WORKERS = int(os.getenv("CAMPAIGN_WORKERS", "8"))  # per campaign; rate is shared with the outbox
+CAMPAIGN_MAX_ATTEMPTS = int(os.getenv("CAMPAIGN_MAX_ATTEMPTS", "4"))
+CAMPAIGN_MAX_UPLOAD_BYTES = int(os.getenv("CAMPAIGN_MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+CAMPAIGN_KEEP_FINISHED = int(os.getenv("CAMPAIGN_KEEP_FINISHED", "100"))
+CAMPAIGN_DEDUPE_IN_MEMORY = int(os.getenv("CAMPAIGN_DEDUPE_IN_MEMORY", "1000000"))  # numbers; more spill to a temp file
+CAMPAIGN_SAVE_SECONDS = float(os.getenv("CAMPAIGN_SAVE_SECONDS", "1"))  # progress saved to the store (and cancels seen)
+
+# Inbound media (image/video/audio/document): downloaded once in the background,
+# stored by content hash, served from /api/media/{media_id}
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))  # least recently used go first
+MEDIA_MAX_FILE_BYTES = int(os.getenv("MEDIA_MAX_FILE_BYTES", str(100 * 1024 ** 2)))  # Cloud API's largest document
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "4"))
+MEDIA_QUEUE_MAX = int(os.getenv("MEDIA_QUEUE_MAX", "1000"))  # past this, media is fetched on first request
+MEDIA_DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("MEDIA_DOWNLOAD_TIMEOUT_SECONDS", "120"))
+
+# Duplicate suppression for webhook retries
+DEDUP_MAX_IDS = int(os.getenv("DEDUP_MAX_IDS", "50000"))
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+
+# Search: queries too short for the full-text index scan message bodies
+SEARCH_PREFIX_WINDOW_DAYS = float(os.getenv("SEARCH_PREFIX_WINDOW_DAYS", "30"))  # scanned when no `since` is given
+
+# Read cache for conversation list and thread heads
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "5"))
+
+# Realtime event stream (Server-Sent Events)
+EVENTS_QUEUE_MAX = int(os.getenv("EVENTS_QUEUE_MAX", "1000"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
 
 # API Configuration
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
-API_PORT = int(os.getenv("API_PORT", "8000"))
\ No newline at end of file
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # processes started by serve.py
+# Set by serve.py: workers share /metrics and stats numbers through files here
+WORKER_STATS_DIR = os.getenv("WORKER_STATS_DIR", "")
+WORKER_STATS_INTERVAL_SECONDS = float(os.getenv("WORKER_STATS_INTERVAL_SECONDS", "5"))
+# With more than one worker, how often each follows the others' writes (services/changes.py)
+CHANGE_FEED_POLL_SECONDS = float(os.getenv("CHANGE_FEED_POLL_SECONDS", "0.5"))
+
+# Prometheus metrics at /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+# Logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json (one object per line)
+LOG_FILE = os.getenv("LOG_FILE", "inbox_%Y%m%d.log")  # strftime pattern; empty disables
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() == "true"  # write logs from a background thread
+LOG_PAYLOADS = os.getenv("LOG_PAYLOADS", "truncate")  # off | truncate | sample
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "1000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
@@ -1,9 +1,19 @@
 # inbox/app/main.py
-from fastapi import FastAPI
+import os
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import webhook, messages
+from app.routes import webhook, messages, events, campaigns, media
 from app.utils.logger import logger
-from app.config import API_HOST, API_PORT
+from app.config import API_HOST, API_PORT, METRICS_ENABLED
+from services.whatsapp import whatsapp_service
+from services.inbox import store, incoming_writer, status_writer
+from services.events import event_broker
+from services.changes import change_feed
+from services.outbox import outbound_queue
+from services.campaigns import campaign_manager
+from services.media import media_cache
+from services.workers import worker_stats
+from utils.metrics import MetricsMiddleware, CONTENT_TYPE
 
 app = FastAPI(
     title="WhatsApp Inbox API",
@@ -20,18 +30,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency for /metrics; added last so it's outermost and times CORS too
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(webhook.router, tags=["webhook"])
 app.include_router(messages.router, tags=["messages"])
+app.include_router(events.router, tags=["events"])
+app.include_router(campaigns.router, tags=["campaigns"])
+app.include_router(media.router, tags=["media"])
 
 @app.on_event("startup")
 async def startup_event():
-    logger.info("WhatsApp Inbox API starting up...")
-    logger.info(f"API running on http://{API_HOST}:{API_PORT}")
+    logger.info("WhatsApp Inbox API starting up (pid %d)...", os.getpid())
+    logger.info("API running on http://%s:%d", API_HOST, API_PORT)
+    await store.start()
+    await change_feed.start()
+    await whatsapp_service.start()
+    await media_cache.start()
+    await incoming_writer.start()
+    await status_writer.start()
+    await outbound_queue.start()
+    await campaign_manager.start()
+    await worker_stats.start()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("WhatsApp Inbox API shutting down...")
+    event_broker.close()
+    await worker_stats.stop()
+    await campaign_manager.stop()
+    await outbound_queue.stop()
+    await incoming_writer.stop()
+    await status_writer.stop()
+    await media_cache.stop()
+    await whatsapp_service.close()
+    await change_feed.stop()
+    await store.close()
 
 @app.get("/")
 async def root():
@@ -42,10 +78,20 @@ async def root():
             "webhook": "/webhook",
             "conversations": "/api/conversations",
             "send": "/api/send",
-            "health": "/api/health"
+            "campaigns": "/api/campaigns",
+            "media": "/api/media/{media_id}",
+            "events": "/api/events",
+            "health": "/api/health",
+            "metrics": "/metrics"
         }
     }
 
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        """Prometheus scrape endpoint; with serve.py, the totals of every worker"""
+        return Response(await worker_stats.render_metrics(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
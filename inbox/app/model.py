@@ -16,8 +16,8 @@ class PyObjectId(ObjectId):
         return ObjectId(v)
 
     @classmethod
-    def __modify_schema__(cls, field_schema):
-        field_schema.update(type="string")
+    def __get_pydantic_json_schema__(cls, core_schema, handler):
+        return {"type": "string"}
 
 class Message(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
@@ -0,0 +1,23 @@
+# inbox/app/rebuild_conversations.py
+"""
+One-shot backfill of the conversation summaries from the stored messages.
+
+Run once after deploying the summary collection (and any time it drifts):
+    cd inbox/app && python rebuild_conversations.py
+
+Stop webhook ingestion while it runs; writes made during the rebuild are
+overwritten by the aggregation result.
+"""
+import asyncio
+from services.inbox import store, rebuild_conversations
+
+async def main() -> int:
+    await store.start()
+    try:
+        return await rebuild_conversations()
+    finally:
+        await store.close()
+
+if __name__ == "__main__":
+    total = asyncio.run(main())
+    print(f"✓ Rebuilt {total} conversation summaries")
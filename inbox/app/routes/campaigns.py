@@ -0,0 +1,57 @@
+# inbox/app/routes/campaigns.py
+from fastapi import APIRouter, File, Form, HTTPException, UploadFile
+from typing import List, Optional
+from schemas import CampaignOut
+from services.campaigns import campaign_manager, UploadTooLarge
+from utils.logger import logger
+
+router = APIRouter(prefix="/api", tags=["campaigns"])
+
+@router.post("/campaigns", response_model=CampaignOut, status_code=202)
+async def create_campaign(
+    file: UploadFile = File(..., description="CSV with a `phone` column plus any template fields"),
+    template: str = Form(..., description="Message template, e.g. 'Hi {name}'"),
+    name: Optional[str] = Form(None),
+    rate: Optional[float] = Form(None, gt=0, description="Messages per second cap for this campaign"),
+    dry_run: bool = Form(False, description="Only run the preflight check and return its report")
+):
+    """
+    Upload a contact list and start sending it in the background
+    
+    The file is preflighted first (phones, duplicates, template placeholders);
+    the report comes back in `preflight`, and a file with bad placeholders or
+    nothing to send is rejected before any message goes out.
+    """
+    try:
+        campaign = await campaign_manager.create(file, template, name=name, rate=rate, dry_run=dry_run)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception:
+        logger.exception("Error starting campaign")
+        raise HTTPException(status_code=500, detail="Failed to start campaign")
+    finally:
+        await file.close()
+    return campaign.progress()
+
+@router.get("/campaigns", response_model=List[CampaignOut])
+async def list_campaigns():
+    """Running and recently finished campaigns, newest first"""
+    return await campaign_manager.list()
+
+@router.get("/campaigns/{campaign_id}", response_model=CampaignOut)
+async def get_campaign(campaign_id: str):
+    """Live progress: queued, in flight, sent, failed and the current send rate"""
+    campaign = await campaign_manager.get(campaign_id)
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign
+
+@router.delete("/campaigns/{campaign_id}", response_model=CampaignOut)
+async def cancel_campaign(campaign_id: str):
+    """Stop a running campaign; sends already in flight still complete"""
+    campaign = await campaign_manager.cancel(campaign_id)
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return campaign
@@ -0,0 +1,52 @@
+# inbox/app/routes/events.py
+import asyncio
+from fastapi import APIRouter, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from services.events import event_broker
+from config import EVENTS_HEARTBEAT_SECONDS
+
+router = APIRouter(prefix="/api", tags=["events"])
+
+@router.get("/events")
+async def stream_events(request: Request, user_id: Optional[List[str]] = Query(None)):
+    """
+    Stream new messages and status changes as Server-Sent Events
+    
+    Pass `user_id` (repeatable) to follow specific conversations; without it
+    the stream carries every conversation. A `resync` event means the client
+    fell behind and should refetch what it is showing.
+    
+    Under serve.py with several workers, events come from the shared change
+    sequence instead (services/changes.py): every change is a `message` event
+    with the message as it now is, status included.
+    """
+    subscriber = event_broker.subscribe(user_id)
+    
+    async def stream():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    break
+                yield event
+        finally:
+            event_broker.unsubscribe(subscriber)
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/events/stats")
+async def event_stats():
+    """Connected subscribers and events published"""
+    return event_broker.stats()
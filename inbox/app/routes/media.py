@@ -0,0 +1,99 @@
+# inbox/app/routes/media.py
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import BinaryIO, Iterator, Optional, Tuple
+from services.media import media_cache, CHUNK_BYTES
+from utils.logger import logger
+
+router = APIRouter(prefix="/api", tags=["media"])
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    First and last byte of a single `bytes=` range, or None to serve the whole file
+    
+    Malformed and multi-range headers are ignored (RFC 9110 allows that);
+    a range that starts past the end raises ValueError (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        # Suffix range: the last N bytes
+        if not last.isdigit():
+            return None
+        if int(last) == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - int(last)), size - 1
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+def iter_file(f: BinaryIO, start: int, length: int) -> Iterator[bytes]:
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_BYTES, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+@router.get("/media/{media_id}")
+async def get_media(media_id: str, request: Request):
+    """
+    An inbound attachment, by the Graph media id in a message's `media_url`
+    
+    Served from the local cache (downloaded first on a miss), with
+    Range requests for seeking in audio and video.
+    """
+    try:
+        media = await media_cache.get(media_id)
+    except Exception:
+        logger.exception("Error fetching media %s", media_id)
+        raise HTTPException(status_code=500, detail="Failed to fetch media")
+    if media is None:
+        raise HTTPException(status_code=404, detail="Media not available")
+    
+    # Content-addressed, so the hash is a strong ETag and the bytes never change
+    etag = f'"{media.sha256}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable"
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    start, end, status_code = 0, media.size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            requested = parse_range(range_header, media.size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{media.size}"})
+        if requested is not None:
+            start, end = requested
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{media.size}"
+    
+    try:
+        # Opened before responding: eviction can unlink it but not take it away
+        f = open(media.path, "rb")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Media not available")
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file(f, start, end - start + 1),
+        status_code=status_code,
+        media_type=media.mime_type,
+        headers=headers
+    )
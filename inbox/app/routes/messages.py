@@ -1,16 +1,37 @@
 # inbox/app/routes/messages.py
-from fastapi import APIRouter, HTTPException, Query
-from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from typing import List, Literal, Optional
+from datetime import datetime
+from config import DEFAULT_COUNTRY_CODE
 from model import SendMessageRequest, MessageResponse, ConversationResponse
-from schemas import MessageOut, ConversationOut, SendMessageResponse
+from schemas import (
+    MessageOut,
+    MessagePage,
+    ConversationOut,
+    SendMessageResponse,
+    OutboundMessageOut,
+    MarkReadResponse,
+    SyncResponse
+)
 from services.inbox import (
     get_messages_by_user,
+    decode_cursor,
     get_all_conversations,
     search_messages,
-    save_outgoing_message
+    get_outgoing_message,
+    mark_conversation_read,
+    get_changes_since,
+    read_cache
 )
+from services.outbox import outbound_queue
 from services.whatsapp import whatsapp_service
+from services.events import event_broker
+from services.workers import worker_stats
+from storage import SearchTimeout
+from utils.contacts import normalize_phone
 from utils.logger import logger
+from utils.serialize import messages_out
 
 router = APIRouter(prefix="/api", tags=["messages"])
 
@@ -20,84 +41,144 @@ async def list_conversations(limit: int = Query(50, ge=1, le=100)):
     try:
         conversations = await get_all_conversations(limit)
         return conversations
-    except Exception as e:
-        logger.error(f"Error fetching conversations: {str(e)}")
+    except Exception:
+        logger.exception("Error fetching conversations")
         raise HTTPException(status_code=500, detail="Failed to fetch conversations")
 
-@router.get("/conversations/{user_id}", response_model=List[MessageOut])
-async def get_conversation(user_id: str, limit: int = Query(100, ge=1, le=500)):
-    """Get all messages for a specific user"""
+@router.get("/conversations/{user_id}", response_model=MessagePage)
+async def get_conversation(
+    user_id: str,
+    limit: int = Query(100, ge=1, le=500),
+    before: Optional[str] = Query(None, description="Cursor: page of older messages"),
+    after: Optional[str] = Query(None, description="Cursor: page of newer messages")
+):
+    """Get a page of messages for a specific user (newest page by default)"""
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
     try:
-        messages = await get_messages_by_user(user_id, limit)
-        
-        # Convert MongoDB documents to response format
-        result = []
-        for msg in messages:
-            result.append({
-                "user_id": msg.get("user_id"),
-                "direction": msg.get("direction"),
-                "body": msg.get("body"),
-                "timestamp": msg.get("timestamp"),
-                "status": msg.get("status"),
-                "message_id": msg.get("message_id")
-            })
+        before_position = decode_cursor(before) if before else None
+        after_position = decode_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        page = await get_messages_by_user(user_id, limit, before=before_position, after=after_position)
         
-        return result
-    except Exception as e:
-        logger.error(f"Error fetching conversation for {user_id}: {str(e)}")
+        # Documents are already projected to MessageOut's fields, so encode them
+        # directly instead of re-validating through response_model
+        return ORJSONResponse({"messages": messages_out(page["messages"]), "next_cursor": page["next_cursor"]})
+    except Exception:
+        logger.exception("Error fetching conversation for %s", user_id)
         raise HTTPException(status_code=500, detail="Failed to fetch conversation")
 
-@router.post("/send", response_model=SendMessageResponse)
+@router.post("/conversations/{user_id}/read", response_model=MarkReadResponse)
+async def mark_read(user_id: str, background_tasks: BackgroundTasks):
+    """Mark a whole conversation as read"""
+    try:
+        result = await mark_conversation_read(user_id)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Failed to mark conversation read")
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    
+    # One read receipt for the newest inbound message covers everything before it
+    if result["marked_read"] and result["message_id"]:
+        background_tasks.add_task(whatsapp_service.mark_as_read, result["message_id"])
+    
+    return result
+
+@router.post("/send", response_model=SendMessageResponse, status_code=202)
 async def send_message(request: SendMessageRequest):
-    """Send a message to a user"""
+    """
+    Queue a message to a user
+    
+    The message is stored as `queued` and delivered by the outbound workers;
+    follow it with GET /api/send/{id} or `status` events.
+    """
+    to = normalize_phone(request.to, DEFAULT_COUNTRY_CODE)
+    if to is None:
+        raise HTTPException(status_code=400, detail=f"Invalid phone number: {request.to}")
     try:
-        # Send via WhatsApp API
-        result = whatsapp_service.send_text_message(request.to, request.message)
-        
-        # Save to database if successful
-        if result["success"]:
-            await save_outgoing_message(
-                to=request.to,
-                message=request.message,
-                message_id=result["message_id"],
-                status="sent"
-            )
-        
-        return {
-            "success": result["success"],
-            "message_id": result["message_id"],
-            "error": result["error"]
-        }
+        doc = await outbound_queue.enqueue(to, request.message)
+    except Exception:
+        logger.exception("Error queueing message")
+        raise HTTPException(status_code=500, detail="Failed to queue message")
+    
+    event_broker.publish("message", doc["user_id"], doc)
+    return {"id": str(doc["_id"]), "status": doc["status"]}
+
+@router.get("/send/{id}", response_model=OutboundMessageOut)
+async def get_sent_message(id: str):
+    """Delivery state of a message queued through /api/send"""
+    try:
+        doc = await get_outgoing_message(id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Message not found")
+    except Exception:
+        logger.exception("Error fetching outgoing message %s", id)
+        raise HTTPException(status_code=500, detail="Failed to fetch message")
     
-    except Exception as e:
-        logger.error(f"Error sending message: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    if doc is None or doc.get("direction") != "outbound":
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {**doc, "id": str(doc["_id"]), "attempts": doc.get("attempts") or 0}
 
 @router.get("/search", response_model=List[MessageOut])
 async def search_conversation(
     q: str = Query(..., min_length=1),
-    limit: int = Query(50, ge=1, le=100)
+    limit: int = Query(50, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    user_id: Optional[str] = None,
+    direction: Optional[Literal["inbound", "outbound"]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
 ):
-    """Search messages by content"""
+    """
+    Search messages by content, most relevant first
+    
+    Queries shorter than SEARCH_MIN_TEXT_LENGTH match word prefixes, newest
+    first, and without `since` only over the last SEARCH_PREFIX_WINDOW_DAYS.
+    A 504 means the search took too long and should be narrowed (`since`,
+    `until`, `user_id`).
+    """
     try:
-        messages = await search_messages(q, limit)
-        
-        result = []
-        for msg in messages:
-            result.append({
-                "user_id": msg.get("user_id"),
-                "direction": msg.get("direction"),
-                "body": msg.get("body"),
-                "timestamp": msg.get("timestamp"),
-                "status": msg.get("status"),
-                "message_id": msg.get("message_id")
-            })
+        messages = await search_messages(
+            q, limit, offset=offset, user_id=user_id,
+            direction=direction, since=since, until=until
+        )
         
-        return result
-    except Exception as e:
-        logger.error(f"Error searching messages: {str(e)}")
+        return ORJSONResponse(messages_out(messages))
+    except SearchTimeout as e:
+        raise HTTPException(status_code=504, detail=f"{e}; narrow it with since, until or user_id")
+    except Exception:
+        logger.exception("Error searching messages")
         raise HTTPException(status_code=500, detail="Failed to search messages")
 
+@router.get("/sync", response_model=SyncResponse)
+async def sync_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=1000)
+):
+    """Messages and conversations changed after sequence `since`; pass back `next_since`"""
+    try:
+        return await get_changes_since(since, limit)
+    except Exception:
+        logger.exception("Error syncing changes since %d", since)
+        raise HTTPException(status_code=500, detail="Failed to sync changes")
+
+worker_stats.add_stats("cache", read_cache.stats)
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the conversation read cache, summed over serve.py's workers"""
+    peers = await worker_stats.peers()
+    stats = worker_stats.combine(
+        peers, "cache", read_cache.stats(), ("entries", "hits", "misses", "evictions", "invalidations")
+    )
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    return stats
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
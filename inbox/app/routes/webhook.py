@@ -1,12 +1,39 @@
 # inbox/app/routes/webhook.py
 from fastapi import APIRouter, Request
 from datetime import datetime
-from services.inbox import save_incoming_message, update_message_status
-from config import WEBHOOK_VERIFY_TOKEN
-from utils.logger import logger
+from services.inbox import incoming_writer, status_writer
+from services.events import event_broker
+from services.media import media_cache
+from services.workers import worker_stats
+from config import WEBHOOK_VERIFY_TOKEN, DEDUP_MAX_IDS, DEDUP_TTL_SECONDS
+from utils.dedup import RecentIds
+from utils.logger import logger, log_payload
 
 router = APIRouter()
 
+# Meta redelivers webhooks it thinks weren't acknowledged; repeats are dropped
+# here before any queue, DB or event work. An id is recorded when it is
+# queued and forgotten again if it never gets stored, so a redelivery of
+# something whose write failed goes through
+recent_ids = RecentIds(max_size=DEDUP_MAX_IDS, ttl=DEDUP_TTL_SECONDS)
+
+def message_key(message: dict) -> tuple:
+    return ("message", message["message_id"])
+
+def status_key(status: dict) -> tuple:
+    return ("status", status["message_id"], status["status"])
+
+def forget_messages(batch: list):
+    for message in batch:
+        recent_ids.forget(message_key(message))
+
+def forget_statuses(batch: list):
+    for status in batch:
+        recent_ids.forget(status_key(status))
+
+incoming_writer.on_failure(forget_messages)
+status_writer.on_failure(forget_statuses)
+
 @router.get("/webhook")
 async def verify_webhook(request: Request):
     """Verify webhook for WhatsApp Business API"""
@@ -16,7 +43,7 @@ async def verify_webhook(request: Request):
     token = params.get("hub.verify_token")
     challenge = params.get("hub.challenge")
     
-    logger.info(f"Webhook verification attempt - Mode: {mode}, Token matches: {token == WEBHOOK_VERIFY_TOKEN}")
+    logger.info("Webhook verification attempt - Mode: %s, Token matches: %s", mode, token == WEBHOOK_VERIFY_TOKEN)
     
     if mode == "subscribe" and token == WEBHOOK_VERIFY_TOKEN:
         logger.info("Webhook verified successfully")
@@ -25,74 +52,129 @@ async def verify_webhook(request: Request):
     logger.warning("Webhook verification failed")
     return {"status": "verification failed"}, 403
 
+def parse_incoming_message(msg: dict) -> dict:
+    """Normalize one webhook message object into an inbox document"""
+    message_type = msg.get("type", "text")
+    
+    message_data = {
+        "user_id": msg["from"],
+        "direction": "inbound",
+        "body": "",
+        "timestamp": datetime.fromtimestamp(int(msg["timestamp"])),
+        "status": "received",
+        "message_id": msg["id"]
+    }
+    
+    # Extract message body based on type
+    if message_type == "text":
+        message_data["body"] = msg.get("text", {}).get("body", "")
+    elif message_type == "image":
+        message_data["body"] = "[Image]"
+        message_data["media_url"] = msg.get("image", {}).get("id")
+        message_data["media_type"] = "image"
+    elif message_type == "video":
+        message_data["body"] = "[Video]"
+        message_data["media_url"] = msg.get("video", {}).get("id")
+        message_data["media_type"] = "video"
+    elif message_type == "audio":
+        message_data["body"] = "[Audio]"
+        message_data["media_url"] = msg.get("audio", {}).get("id")
+        message_data["media_type"] = "audio"
+    elif message_type == "document":
+        message_data["body"] = "[Document]"
+        message_data["media_url"] = msg.get("document", {}).get("id")
+        message_data["media_type"] = "document"
+    else:
+        message_data["body"] = f"[{message_type}]"
+    
+    return message_data
+
+def iter_change_values(body: dict):
+    """Yield the `value` of every change in every entry of a webhook payload"""
+    for entry in body.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value")
+            if value:
+                yield value
+
+def queue_depths() -> dict:
+    return {
+        "incoming_queue": incoming_writer.qsize(),
+        "status_queue": status_writer.qsize(),
+        "media_queue": media_cache.qsize()
+    }
+
+worker_stats.add_stats("dedup", recent_ids.stats)
+worker_stats.add_stats("queues", queue_depths)
+
+@router.get("/webhook/stats")
+async def webhook_stats():
+    """Duplicate suppression counters and ingestion queue depths, summed over serve.py's workers"""
+    peers = await worker_stats.peers()
+    queues = worker_stats.combine(peers, "queues", queue_depths(), ("incoming_queue", "status_queue", "media_queue"))
+    return {
+        "dedup": worker_stats.combine(peers, "dedup", recent_ids.stats(), ("tracked", "checked", "suppressed")),
+        **queues
+    }
+
 @router.post("/webhook")
 async def receive_webhook(request: Request):
     """Receive incoming messages and status updates from WhatsApp"""
     try:
         body = await request.json()
-        logger.info(f"Received webhook: {body}")
-        
-        # Extract entry data
-        entry = body.get("entry", [])
-        if not entry:
-            return {"status": "ok"}
+        log_payload(logger, "Received webhook", body)
         
-        changes = entry[0].get("changes", [])
-        if not changes:
-            return {"status": "ok"}
-        
-        value = changes[0].get("value", {})
-        
-        # Handle incoming messages
-        messages = value.get("messages", [])
-        for msg in messages:
-            message_type = msg.get("type", "text")
-            
-            message_data = {
-                "user_id": msg["from"],
-                "direction": "inbound",
-                "body": "",
-                "timestamp": datetime.fromtimestamp(int(msg["timestamp"])),
-                "status": "received",
-                "message_id": msg["id"]
-            }
+        for value in iter_change_values(body):
+            # Handle incoming messages: queued for the background batch writer
+            for msg in value.get("messages", []):
+                try:
+                    message_data = parse_incoming_message(msg)
+                except (KeyError, ValueError) as e:
+                    logger.warning("Skipping malformed message: %s", e)
+                    continue
+                
+                if recent_ids.seen(message_key(message_data)):
+                    logger.info("Dropped duplicate message %s", message_data["message_id"])
+                    continue
+                
+                try:
+                    await incoming_writer.put(message_data)
+                except BaseException:
+                    recent_ids.forget(message_key(message_data))
+                    raise
+                if message_data.get("media_url"):
+                    # Downloaded in the background; Graph's hash spots forwarded copies
+                    media = msg.get(message_data["media_type"], {})
+                    media_cache.enqueue(message_data["media_url"], media.get("sha256"))
+                event_broker.publish("message", message_data["user_id"], message_data)
+                logger.debug("Queued incoming message from %s", message_data["user_id"])
             
-            # Extract message body based on type
-            if message_type == "text":
-                message_data["body"] = msg.get("text", {}).get("body", "")
-            elif message_type == "image":
-                message_data["body"] = "[Image]"
-                message_data["media_url"] = msg.get("image", {}).get("id")
-                message_data["media_type"] = "image"
-            elif message_type == "video":
-                message_data["body"] = "[Video]"
-                message_data["media_url"] = msg.get("video", {}).get("id")
-                message_data["media_type"] = "video"
-            elif message_type == "audio":
-                message_data["body"] = "[Audio]"
-                message_data["media_url"] = msg.get("audio", {}).get("id")
-                message_data["media_type"] = "audio"
-            elif message_type == "document":
-                message_data["body"] = "[Document]"
-                message_data["media_url"] = msg.get("document", {}).get("id")
-                message_data["media_type"] = "document"
-            else:
-                message_data["body"] = f"[{message_type}]"
-            
-            await save_incoming_message(message_data)
-            logger.info(f"Processed incoming message from {msg['from']}")
-        
-        # Handle status updates (delivered, read, etc.)
-        statuses = value.get("statuses", [])
-        for status in statuses:
-            message_id = status.get("id")
-            new_status = status.get("status")
-            
-            if message_id and new_status:
-                await update_message_status(message_id, new_status)
-                logger.info(f"Updated message {message_id} status to {new_status}")
-        
+            # Handle status updates (delivered, read, etc.): coalesced and bulk-applied
+            for status in value.get("statuses", []):
+                message_id = status.get("id")
+                new_status = status.get("status")
+                
+                if message_id and new_status:
+                    timestamp = status.get("timestamp")
+                    status_update = {
+                        "message_id": message_id,
+                        "status": new_status,
+                        "timestamp": datetime.fromtimestamp(int(timestamp)) if timestamp else None,
+                        "user_id": status.get("recipient_id")
+                    }
+                    if recent_ids.seen(status_key(status_update)):
+                        logger.info("Dropped duplicate status %s for message %s", new_status, message_id)
+                        continue
+                    
+                    try:
+                        await status_writer.put(status_update)
+                    except BaseException:
+                        recent_ids.forget(status_key(status_update))
+                        raise
+                    event_broker.publish("status", status_update["user_id"], status_update)
+                    logger.debug("Queued status %s for message %s", new_status, message_id)
+    
     except Exception as e:
-        logger.error(f"Webhook error: {str(e)}", exc_info=True)
+        logger.error("Webhook error: %s", e, exc_info=True)
     
     return {"status": "ok"}
\ No newline at end of file
@@ -1,6 +1,6 @@
 # inbox/app/schemas.py
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 
 class MessageOut(BaseModel):
@@ -10,18 +10,76 @@ class MessageOut(BaseModel):
     timestamp: datetime
     status: Optional[str]
     message_id: Optional[str] = None
+    media_url: Optional[str] = None  # Graph media id; the file is at /api/media/{media_url}
+    media_type: Optional[str] = None
 
     class Config:
         from_attributes = True
 
+class MessagePage(BaseModel):
+    messages: List[MessageOut]
+    next_cursor: Optional[str] = None
+
 class ConversationOut(BaseModel):
     user_id: str
     last_message: str
     last_timestamp: datetime
+    last_direction: Optional[str] = None
     unread_count: int = 0
     total_messages: int
 
 class SendMessageResponse(BaseModel):
-    success: bool
+    id: str
+    status: str
+
+class OutboundMessageOut(BaseModel):
+    id: str
+    user_id: str
+    body: str
+    timestamp: datetime
+    status: Optional[str]
+    message_id: Optional[str] = None
+    attempts: int = 0
+    last_error: Optional[str] = None
+    next_attempt_at: Optional[datetime] = None
+
+class MarkReadResponse(BaseModel):
+    user_id: str
+    marked_read: int
     message_id: Optional[str] = None
-    error: Optional[str] = None
\ No newline at end of file
+
+class SyncMessageOut(MessageOut):
+    seq: int
+    media_type: Optional[str] = None
+
+class SyncConversationOut(ConversationOut):
+    seq: int
+
+class SyncResponse(BaseModel):
+    messages: List[SyncMessageOut]
+    conversations: List[SyncConversationOut]
+    next_since: int
+    has_more: bool
+
+class CampaignError(BaseModel):
+    row: int
+    phone: Optional[str] = None
+    error: str
+
+class CampaignOut(BaseModel):
+    id: str
+    name: str
+    status: str
+    total: int
+    queued: int
+    in_flight: int
+    sent: int
+    failed: int
+    skipped: int
+    retries: int
+    rate: float
+    rate_limit: Optional[float] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    recent_errors: List[CampaignError] = []
+    preflight: Dict[str, Any]
@@ -0,0 +1,79 @@
+# inbox/app/serve.py
+"""
+Production server: the API in N worker processes behind one port
+
+    cd inbox && python app/serve.py --workers 4
+
+main.py's uvicorn.run(..., reload=True) stays the single-process
+development server. Each worker is a separate interpreter with its own
+event loop and runs the app's startup and shutdown hooks, so it opens one
+MongoDB client (pool sized by MONGO_MAX_POOL_SIZE) when it starts and
+closes it when it stops; plan for MONGO_MAX_POOL_SIZE x workers
+connections at most.
+
+Workers share state through the database:
+- the outbound queue claims work through the store, and each worker sends
+  at OUTBOX_RATE_PER_SECOND / workers
+- each worker follows the store's change sequence every
+  CHANGE_FEED_POLL_SECONDS (services/changes.py): that drops its cached
+  reads of what another worker changed and feeds its /api/events streams,
+  so every client sees every worker's changes
+- a campaign runs in the worker that accepted its upload, which saves its
+  progress to the store every CAMPAIGN_SAVE_SECONDS; any worker answers
+  for it, and a cancel sent to another worker reaches it through the store
+
+Metrics are counted per worker too, but /metrics, /api/cache/stats and
+/webhook/stats add up every worker's numbers: workers publish them every
+WORKER_STATS_INTERVAL_SECONDS to a temporary directory this process
+creates (services/workers.py), so the other workers' share of an answer
+is up to that old.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def main():
+    # The app imports both `app.x` and bare `x`; workers inherit this path
+    sys.path[:0] = [os.path.dirname(APP_DIR), APP_DIR]
+    from config import API_HOST, API_PORT, API_WORKERS, STORAGE_BACKEND, LOG_LEVEL
+    
+    parser = argparse.ArgumentParser(description="Run the WhatsApp Inbox API with several worker processes")
+    parser.add_argument("--workers", type=int, default=API_WORKERS,
+                        help="worker processes (default API_WORKERS; 0 = one per CPU)")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--graceful-timeout", type=float, default=30,
+                        help="seconds a stopping worker waits for open requests and streams")
+    args = parser.parse_args()
+    
+    workers = args.workers or os.cpu_count() or 1
+    if workers > 1 and STORAGE_BACKEND == "memory":
+        parser.error("the memory backend lives in one process; use mongo or sqlite with more than one worker")
+    # Read by each worker's config (the outbox divides its rate by it)
+    os.environ["API_WORKERS"] = str(workers)
+    stats_dir = tempfile.mkdtemp(prefix="inbox-workers-")
+    os.environ["WORKER_STATS_DIR"] = stats_dir
+    
+    import uvicorn
+    try:
+        uvicorn.run(
+            "app.main:app",
+            host=args.host,
+            port=args.port,
+            workers=workers,
+            log_level=LOG_LEVEL.lower(),
+            # Per-route counts and latencies are in /metrics; an access log line
+            # per request is a cost every worker pays
+            access_log=False,
+            proxy_headers=True,
+            timeout_graceful_shutdown=args.graceful_timeout
+        )
+    finally:
+        shutil.rmtree(stats_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# inbox/app/services/batch.py
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+from utils.logger import logger
+from utils.metrics import WEBHOOK_QUEUE_DEPTH, WEBHOOK_BATCH_SIZE, WEBHOOK_FLUSH_SECONDS
+
+_STOP = object()
+
+class BatchWriter:
+    """
+    Buffer items in a bounded in-process queue and hand them to `flush` in batches
+    
+    A batch is flushed when it reaches `batch_size` items or `flush_interval`
+    seconds after its first item arrived, whichever comes first. `put` waits
+    when the queue is full, so memory stays bounded under a burst. A batch
+    whose flush raises is logged and passed to the `on_failure` handlers.
+    """
+    
+    def __init__(self, name: str, flush: Callable[[List[Any]], Awaitable[None]],
+                 batch_size: int = 100, flush_interval: float = 0.2, max_queue: int = 10000):
+        self.name = name
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.failure_handlers: List[Callable[[List[Any]], None]] = []
+        self.batch_sizes = WEBHOOK_BATCH_SIZE.labels(name)
+        self.flush_seconds = WEBHOOK_FLUSH_SECONDS.labels(name)
+        WEBHOOK_QUEUE_DEPTH.set_function(self.qsize, name)
+    
+    async def start(self):
+        """Start the background flush task (called on app startup)"""
+        if self.task is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.task = asyncio.create_task(self._run())
+        logger.info("%s writer started (batch=%d, interval=%ss)", self.name, self.batch_size, self.flush_interval)
+    
+    async def stop(self):
+        """Flush everything already queued, then stop (called on app shutdown)"""
+        if self.task is None:
+            return
+        await self.queue.put(_STOP)
+        await self.task
+        self.task = None
+        logger.info("%s writer drained and stopped", self.name)
+    
+    def on_failure(self, handler: Callable[[List[Any]], None]):
+        """Call `handler(batch)` with every batch that failed to flush"""
+        self.failure_handlers.append(handler)
+    
+    async def put(self, item: Any):
+        """Queue an item for the next batch, flushing inline if the writer isn't running"""
+        if self.task is None:
+            await self._flush([item])
+            return
+        await self.queue.put(item)
+    
+    def qsize(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            await self._flush(batch)
+    
+    async def _flush(self, batch: List[Any]):
+        self.batch_sizes.observe(len(batch))
+        try:
+            with self.flush_seconds.time():
+                await self.flush(batch)
+        except Exception as e:
+            logger.error("%s writer failed to flush %d items: %s", self.name, len(batch), e, exc_info=True)
+            for handler in self.failure_handlers:
+                handler(batch)
@@ -0,0 +1,457 @@
+# inbox/app/services/campaigns.py
+import asyncio
+import csv
+import itertools
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import (
+    CAMPAIGN_DIR,
+    CAMPAIGN_WORKERS,
+    CAMPAIGN_MAX_ATTEMPTS,
+    CAMPAIGN_MAX_UPLOAD_BYTES,
+    CAMPAIGN_KEEP_FINISHED,
+    CAMPAIGN_DEDUPE_IN_MEMORY,
+    CAMPAIGN_SAVE_SECONDS,
+    DEFAULT_COUNTRY_CODE,
+    WEBHOOK_BATCH_SIZE,
+    WEBHOOK_FLUSH_INTERVAL,
+    WEBHOOK_QUEUE_MAX
+)
+from services.batch import BatchWriter
+from services.inbox import (
+    save_outgoing_messages,
+    store_campaign,
+    load_campaign,
+    load_campaigns,
+    request_campaign_cancel
+)
+from services.outbox import outbound_queue
+from services.whatsapp import whatsapp_service
+from utils.contacts import Preflight
+from utils.logger import logger
+from utils.ratelimit import TokenBucket
+
+# Window for the live send rate
+RATE_WINDOW_SECONDS = 10.0
+# Most recent failures kept per campaign
+ERROR_SAMPLE = 50
+# Preflight problems that mean "nothing to send" rather than a failed send
+SKIPPED_PROBLEMS = {"missing_phone", "duplicate"}
+# Rows read and checked per trip to a running campaign's thread
+CHECK_CHUNK_ROWS = 500
+# Saves a running campaign can miss before readers take its worker for dead
+MISSED_SAVES = 5
+
+class UploadTooLarge(ValueError):
+    pass
+
+def read_header(path: str) -> List[str]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+def stream_rows(path: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """(row number from 1, row) for each data row; one row in memory at a time"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from enumerate(csv.DictReader(f), 1)
+
+class Campaign:
+    """One bulk send: its contact file, template and live counters"""
+    
+    def __init__(self, campaign_id: str, name: str, path: str, template: str,
+                 preflight: dict, rate: Optional[float] = None):
+        self.id = campaign_id
+        self.name = name
+        self.path = path
+        self.template = template
+        self.preflight = preflight
+        self.total = preflight["rows"]
+        self.limiter = TokenBucket(rate) if rate else None
+        self.rate_limit = rate
+        self.status = "running"
+        self.stopping = False
+        self.cancel_requested = False
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.in_flight = 0
+        self.retries = 0
+        self.sent_times: deque = deque()
+        self.errors: deque = deque(maxlen=ERROR_SAMPLE)
+        self.created_at = datetime.utcnow()
+        self.started = time.monotonic()
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+    
+    def record_sent(self):
+        self.sent += 1
+        self.sent_times.append(time.monotonic())
+    
+    def record_failure(self, row: int, phone: Optional[str], error: str):
+        self.failed += 1
+        self.errors.append({"row": row, "phone": phone, "error": error})
+    
+    def rate(self) -> float:
+        """Messages sent per second over the last RATE_WINDOW_SECONDS"""
+        now = time.monotonic()
+        while self.sent_times and self.sent_times[0] < now - RATE_WINDOW_SECONDS:
+            self.sent_times.popleft()
+        if not self.sent_times:
+            return 0.0
+        window = min(RATE_WINDOW_SECONDS, now - self.started)
+        return round(len(self.sent_times) / window, 2) if window > 0 else 0.0
+    
+    def progress(self) -> dict:
+        done = self.sent + self.failed + self.skipped
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "total": self.total,
+            "queued": max(0, self.total - done - self.in_flight),
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "retries": self.retries,
+            "rate": self.rate(),
+            "rate_limit": self.rate_limit,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "recent_errors": list(self.errors),
+            "preflight": self.preflight
+        }
+
+def interrupted_if_stale(campaign: dict, stale_before: datetime) -> dict:
+    """A saved campaign, shown as "interrupted" if it claims to run but its worker stopped saving"""
+    if campaign["status"] == "running" and campaign["updated_at"] < stale_before:
+        return {**campaign, "status": "interrupted"}
+    return campaign
+
+class CampaignManager:
+    """
+    Runs bulk campaigns inside the app process
+    
+    Each campaign's uploaded CSV is preflighted in full first (utils.contacts),
+    then streamed through `workers` tasks that send with the app's pooled
+    WhatsAppService client. Every send also takes a token from the outbound
+    queue's bucket, so OUTBOX_RATE_PER_SECOND stays the one Graph rate for
+    /api/send and campaigns together; a campaign can add its own lower cap.
+    Throttling, 5xx and network errors are retried with the outbound
+    queue's backoff.
+    
+    Sent messages go to the inbox store through a BatchWriter, one insert
+    per batch. A campaign runs in the process that accepted it, which saves
+    its progress to the store every `save_interval` seconds; any process
+    (serve.py's other workers too) answers for it from there, and a cancel
+    is a flag in the store that the running process sees at its next save.
+    A restart ends running campaigns rather than resuming them: one whose
+    saves stop is reported as "interrupted".
+    """
+    
+    def __init__(self, directory: str = "campaigns", workers: int = 8, max_attempts: int = 4,
+                 max_upload_bytes: int = 100 * 1024 * 1024, keep_finished: int = 100,
+                 default_country: Optional[str] = None, dedupe_in_memory: int = 1_000_000,
+                 save_interval: float = 1.0):
+        self.directory = directory
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.max_upload_bytes = max_upload_bytes
+        self.keep_finished = keep_finished
+        self.default_country = default_country
+        self.dedupe_in_memory = dedupe_in_memory
+        self.save_interval = save_interval
+        self.campaigns: "OrderedDict[str, Campaign]" = OrderedDict()
+        self.recorder = BatchWriter(
+            "campaign",
+            save_outgoing_messages,
+            batch_size=WEBHOOK_BATCH_SIZE,
+            flush_interval=WEBHOOK_FLUSH_INTERVAL,
+            max_queue=WEBHOOK_QUEUE_MAX
+        )
+        self.recorder.on_failure(self._unrecorded)
+    
+    async def start(self):
+        """Start the batch recorder (called on app startup)"""
+        os.makedirs(self.directory, exist_ok=True)
+        await self.recorder.start()
+    
+    async def stop(self):
+        """Stop running campaigns and flush what they sent (called on app shutdown)"""
+        running = [campaign for campaign in self.campaigns.values() if campaign.task is not None]
+        for campaign in running:
+            campaign.stopping = True
+        await asyncio.gather(*(campaign.task for campaign in running), return_exceptions=True)
+        await self.recorder.stop()
+    
+    def _unrecorded(self, batch: List[dict]):
+        # Sent, so nothing to retry; the Graph ids are enough to backfill the inbox
+        per_campaign: Dict[str, List[str]] = {}
+        for record in batch:
+            per_campaign.setdefault(record["campaign_id"], []).append(record["message_id"])
+        for campaign_id, message_ids in per_campaign.items():
+            logger.error("Campaign %s: %d sent messages were not saved to the inbox: %s",
+                         campaign_id, len(message_ids), ", ".join(map(str, message_ids)))
+    
+    def preflight(self, template: str, path: str) -> Preflight:
+        return Preflight(template, read_header(path), self.default_country, self.dedupe_in_memory)
+    
+    def check_file(self, template: str, path: str) -> dict:
+        """Preflight every row of a contacts file without sending anything; returns the report"""
+        preflight = self.preflight(template, path)
+        try:
+            for row_number, row in stream_rows(path):
+                preflight.check(row_number, row)
+            return preflight.report()
+        finally:
+            preflight.close()
+    
+    async def create(self, upload, template: str, name: Optional[str] = None,
+                     rate: Optional[float] = None, dry_run: bool = False) -> Campaign:
+        """
+        Save an uploaded contacts file, preflight it and start sending it
+        
+        `upload` is anything with an async read(size), like FastAPI's UploadFile.
+        The whole file is checked before the first send (see Preflight):
+        ValueError for a missing `phone` column, a placeholder with no
+        column or a file with nothing to send; UploadTooLarge past
+        `max_upload_bytes`. A dry run stops after the check.
+        """
+        campaign_id = uuid.uuid4().hex[:12]
+        path = os.path.join(self.directory, f"{campaign_id}.csv")
+        try:
+            size = 0
+            # Disk writes go to a thread, a chunk at a time, so a slow disk
+            # doesn't stall the event loop
+            f = await asyncio.to_thread(open, path, "wb")
+            try:
+                while True:
+                    chunk = await upload.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_upload_bytes:
+                        raise UploadTooLarge(f"Contact file is larger than {self.max_upload_bytes} bytes")
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            
+            report = await asyncio.to_thread(self.check_file, template, path)
+            if not report["sendable"] and not dry_run:
+                raise ValueError(
+                    f"Nothing to send: {report['rows']} rows, {report['missing_phone']} without a phone, "
+                    f"{report['invalid_phone']} invalid, {report['duplicate']} duplicates, "
+                    f"{report['template_error']} template errors"
+                )
+        except Exception:
+            os.remove(path)
+            raise
+        
+        campaign = Campaign(campaign_id, name or campaign_id, path, template, report, rate)
+        logger.info("Campaign %s preflight: %d rows, %d to send (%.2fs)",
+                    campaign_id, report["rows"], report["sendable"], report["seconds"])
+        if dry_run:
+            os.remove(path)
+            campaign.status = "checked"
+            campaign.finished_at = datetime.utcnow()
+        try:
+            await self._save(campaign)
+        except Exception:
+            if not dry_run:
+                os.remove(path)
+            raise
+        
+        self.campaigns[campaign_id] = campaign
+        self._forget_finished()
+        if not dry_run:
+            campaign.task = asyncio.create_task(self._run(campaign))
+        return campaign
+    
+    async def get(self, campaign_id: str) -> Optional[dict]:
+        """A campaign's progress: live if it runs here, else as its process last saved it"""
+        campaign = self.campaigns.get(campaign_id)
+        if campaign is not None:
+            return campaign.progress()
+        saved = await load_campaign(campaign_id)
+        return interrupted_if_stale(saved, self._stale_before()) if saved is not None else None
+    
+    async def list(self) -> List[dict]:
+        """Running and recently finished campaigns of every process, newest first"""
+        stale_before = self._stale_before()
+        return [
+            self.campaigns[saved["id"]].progress() if saved["id"] in self.campaigns
+            else interrupted_if_stale(saved, stale_before)
+            for saved in await load_campaigns(self.keep_finished)
+        ]
+    
+    async def cancel(self, campaign_id: str) -> Optional[dict]:
+        """
+        Stop dispatching; sends already in flight finish and are recorded
+        
+        A campaign running in another process is flagged in the store, and
+        this waits (a few saves at most) for that process to stop it.
+        """
+        campaign = self.campaigns.get(campaign_id)
+        if campaign is not None:
+            if campaign.task is not None:
+                campaign.cancel_requested = campaign.stopping = True
+                await campaign.task
+            return campaign.progress()
+        
+        saved = await request_campaign_cancel(campaign_id)
+        for _ in range(MISSED_SAVES):
+            if saved is None or saved["status"] != "running":
+                return saved
+            await asyncio.sleep(self.save_interval)
+            saved = await load_campaign(campaign_id)
+        return interrupted_if_stale(saved, self._stale_before())
+    
+    def _stale_before(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=self.save_interval * MISSED_SAVES)
+    
+    async def _save(self, campaign: Campaign):
+        """Save a campaign's progress; a cancel asked for through another process stops it"""
+        if await store_campaign({**campaign.progress(), "updated_at": datetime.utcnow()}):
+            if campaign.task is not None and not campaign.stopping:
+                logger.info("Campaign %s cancelled", campaign.id)
+                campaign.cancel_requested = campaign.stopping = True
+    
+    async def _report(self, campaign: Campaign):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self._save(campaign)
+            except Exception as e:
+                logger.error("Could not save campaign %s progress: %s", campaign.id, e)
+    
+    def _forget_finished(self):
+        finished = [cid for cid, campaign in self.campaigns.items() if campaign.task is None]
+        for campaign_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.campaigns[campaign_id]
+    
+    async def _run(self, campaign: Campaign):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        workers = [asyncio.create_task(self._work(campaign, queue)) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._report(campaign))
+        loop = asyncio.get_running_loop()
+        # Reading the file and checking rows (which can spill to SQLite) stays
+        # off the event loop, all on one thread: a spilled Preflight's
+        # connection belongs to the thread that opened it
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"campaign-{campaign.id}")
+        preflight = None
+        rows = stream_rows(campaign.path)
+        
+        def check_chunk() -> list:
+            return [(row_number, *preflight.check(row_number, row))
+                    for row_number, row in itertools.islice(rows, CHECK_CHUNK_ROWS)]
+        
+        try:
+            # Same checks as the preflight pass, so the same rows go out
+            preflight = await loop.run_in_executor(executor, self.preflight, campaign.template, campaign.path)
+            while not campaign.stopping:
+                chunk = await loop.run_in_executor(executor, check_chunk)
+                if not chunk:
+                    break
+                for row_number, phone, body, problem in chunk:
+                    if campaign.stopping:
+                        break
+                    if problem in SKIPPED_PROBLEMS:
+                        campaign.skipped += 1
+                    elif problem:
+                        campaign.record_failure(row_number, phone, problem)
+                    else:
+                        await queue.put((row_number, phone, body))
+        except Exception as e:
+            logger.error("Campaign %s failed: %s", campaign.id, e, exc_info=True)
+            campaign.status = "failed"
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+            if campaign.status == "running":
+                if campaign.cancel_requested:
+                    campaign.status = "cancelled"
+                else:
+                    campaign.status = "interrupted" if campaign.stopping else "completed"
+            campaign.finished_at = datetime.utcnow()
+            campaign.task = None
+            await loop.run_in_executor(executor, rows.close)
+            if preflight is not None:
+                await loop.run_in_executor(executor, preflight.close)
+            executor.shutdown()
+            try:
+                os.remove(campaign.path)
+            except OSError:
+                pass
+            logger.info("Campaign %s %s: %d sent, %d failed, %d skipped", campaign.id, campaign.status,
+                        campaign.sent, campaign.failed, campaign.skipped)
+            try:
+                await self._save(campaign)
+            except Exception as e:
+                logger.error("Could not save campaign %s progress: %s", campaign.id, e)
+    
+    async def _work(self, campaign: Campaign, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            if campaign.stopping:
+                continue
+            row_number, phone, body = job
+            campaign.in_flight += 1
+            try:
+                result = await self._send(campaign, phone, body)
+            finally:
+                campaign.in_flight -= 1
+            
+            if result["success"]:
+                campaign.record_sent()
+                await self.recorder.put({
+                    "user_id": phone,
+                    "direction": "outbound",
+                    "body": body,
+                    "timestamp": datetime.utcnow(),
+                    "status": "sent",
+                    "message_id": result["message_id"],
+                    "campaign_id": campaign.id
+                })
+            else:
+                campaign.record_failure(row_number, phone, result["error"])
+    
+    async def _send(self, campaign: Campaign, phone: str, body: str) -> dict:
+        global_limiter = outbound_queue.limiter
+        for attempt in range(1, self.max_attempts + 1):
+            if campaign.limiter is not None:
+                await campaign.limiter.acquire()
+            await global_limiter.acquire()
+            result = await whatsapp_service.send_text_message(phone, body)
+            if result["success"]:
+                global_limiter.recover()
+                return result
+            if not result["retryable"] or attempt == self.max_attempts or campaign.stopping:
+                return result
+            
+            delay = outbound_queue.backoff(attempt)
+            if result["throttled"]:
+                global_limiter.throttle(delay)
+            campaign.retries += 1
+            await asyncio.sleep(delay)
+        return result
+
+# Started/stopped with the app
+campaign_manager = CampaignManager(
+    directory=CAMPAIGN_DIR,
+    workers=CAMPAIGN_WORKERS,
+    max_attempts=CAMPAIGN_MAX_ATTEMPTS,
+    max_upload_bytes=CAMPAIGN_MAX_UPLOAD_BYTES,
+    keep_finished=CAMPAIGN_KEEP_FINISHED,
+    default_country=DEFAULT_COUNTRY_CODE,
+    dedupe_in_memory=CAMPAIGN_DEDUPE_IN_MEMORY,
+    save_interval=CAMPAIGN_SAVE_SECONDS
+)
@@ -0,0 +1,72 @@
+# inbox/app/services/changes.py
+import asyncio
+from typing import Optional
+from config import API_WORKERS, CHANGE_FEED_POLL_SECONDS
+from services.events import EventBroker, event_broker
+from services.inbox import get_changes_since, get_current_sequence, invalidate_users, read_cache
+from utils.logger import logger
+
+class ChangeFeed:
+    """
+    Follows the store's change sequence, so a worker hears of the other workers' writes
+    
+    Under serve.py a message saved by one worker process is news to the
+    rest: their read caches still hold the old thread and their /api/events
+    clients never see it. Each worker's feed reads get_changes_since from
+    where it stopped every `interval` seconds, drops the cached reads the
+    changes touch and publishes each changed message as a "message" event
+    (a status change sends the message again with its new status). The
+    broker then takes events from the feed alone, so every stream gets a
+    change once, whichever worker made it, up to `interval` seconds later.
+    
+    A single process (`enabled` off) has no other writers and doesn't run it.
+    """
+    
+    def __init__(self, broker: EventBroker, interval: float = 0.5, batch: int = 500, enabled: bool = False):
+        self.broker = broker
+        self.interval = interval
+        self.batch = batch
+        self.enabled = enabled
+        self.since = 0
+        self.task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        """Start following from the current end of the sequence (called on app startup, after the store)"""
+        if not self.enabled or self.task is not None:
+            return
+        self.since = await get_current_sequence()
+        self.broker.from_feed = True
+        self.task = asyncio.create_task(self._follow())
+        logger.info("Following the change sequence from %d every %.2fs", self.since, self.interval)
+    
+    async def stop(self):
+        """Stop following (called on app shutdown)"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+    
+    def apply(self, changes: dict):
+        """Invalidate and publish one get_changes_since batch"""
+        if changes["conversations"]:
+            read_cache.invalidate("conversations")
+        if changes["messages"]:
+            invalidate_users(msg["user_id"] for msg in changes["messages"])
+        for msg in changes["messages"]:
+            self.broker.publish_change("message", msg["user_id"], msg)
+    
+    async def _follow(self):
+        while True:
+            try:
+                changes = await get_changes_since(self.since, self.batch)
+                self.apply(changes)
+                self.since = changes["next_since"]
+                if changes["has_more"]:
+                    continue
+            except Exception as e:
+                logger.error("Could not read changes after %d: %s", self.since, e)
+            await asyncio.sleep(self.interval)
+
+# Started/stopped with the app
+change_feed = ChangeFeed(event_broker, interval=CHANGE_FEED_POLL_SECONDS, enabled=API_WORKERS > 1)
@@ -0,0 +1,121 @@
+# inbox/app/services/events.py
+import asyncio
+import json
+import itertools
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set
+from bson import ObjectId
+from config import EVENTS_QUEUE_MAX
+from utils.logger import logger
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+class Subscriber:
+    """One connected client: a bounded queue of encoded events"""
+    
+    def __init__(self, user_ids: Optional[Set[str]], max_queue: int):
+        self.user_ids = user_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+    
+    def offer(self, event: str):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client: rather than block publishers or grow without bound,
+            # throw away its backlog and tell it to refetch
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(EventBroker.encode("resync", {"dropped": self.dropped}))
+    
+    def close(self):
+        """Discard any backlog and end the stream"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class EventBroker:
+    """
+    In-process fan-out of inbox events to streaming clients
+    
+    Subscribers either follow specific user_ids or everything. Events are
+    encoded once per publish, and each subscriber has its own bounded queue so
+    one slow client can't hold up the webhook or other clients.
+    
+    With several worker processes, a ChangeFeed (services/changes.py) sets
+    `from_feed`: publish() then drops what this worker's code reports, and
+    only the feed's publish_change() calls, which cover every worker's
+    writes, reach the clients.
+    """
+    
+    def __init__(self, max_queue: int = 1000):
+        self.max_queue = max_queue
+        self.from_feed = False
+        self.by_user: Dict[str, Set[Subscriber]] = {}
+        self.everything: Set[Subscriber] = set()
+        self.ids = itertools.count(1)
+        self.published = 0
+    
+    @staticmethod
+    def encode(event_type: str, data: dict, event_id: Optional[int] = None) -> str:
+        """Server-Sent Events wire format"""
+        lines = []
+        if event_id is not None:
+            lines.append(f"id: {event_id}")
+        lines.append(f"event: {event_type}")
+        lines.append(f"data: {json.dumps(data, default=_json_default)}")
+        return "\n".join(lines) + "\n\n"
+    
+    def subscribe(self, user_ids: Optional[Iterable[str]] = None) -> Subscriber:
+        subscriber = Subscriber(set(user_ids) if user_ids else None, self.max_queue)
+        if subscriber.user_ids is None:
+            self.everything.add(subscriber)
+        else:
+            for user_id in subscriber.user_ids:
+                self.by_user.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber: Subscriber):
+        self.everything.discard(subscriber)
+        for user_id in subscriber.user_ids or ():
+            subscribers = self.by_user.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.by_user[user_id]
+    
+    def publish(self, event_type: str, user_id: Optional[str], data: dict):
+        """Deliver an event to everyone following `user_id` (never blocks)"""
+        if not self.from_feed:
+            self.publish_change(event_type, user_id, data)
+    
+    def publish_change(self, event_type: str, user_id: Optional[str], data: dict):
+        """Deliver an event read from the change feed"""
+        targets = self.everything | self.by_user.get(user_id, set())
+        if not targets:
+            return
+        event = self.encode(event_type, data, next(self.ids))
+        for subscriber in targets:
+            subscriber.offer(event)
+        self.published += 1
+    
+    def close(self):
+        """End every open stream (called on app shutdown)"""
+        for subscriber in self.everything | set().union(*self.by_user.values()):
+            subscriber.close()
+        logger.info("Event broker closed")
+    
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.everything | set().union(*self.by_user.values())),
+            "published": self.published
+        }
+
+# Create singleton instance
+event_broker = EventBroker(max_queue=EVENTS_QUEUE_MAX)
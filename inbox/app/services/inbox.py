@@ -1,19 +1,56 @@
 # inbox/app/services/inbox.py
-from datetime import datetime
-from typing import List, Optional
-from db import db 
+import base64
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from config import (
+    WEBHOOK_BATCH_SIZE,
+    WEBHOOK_FLUSH_INTERVAL,
+    WEBHOOK_QUEUE_MAX,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL_SECONDS,
+    SEARCH_PREFIX_WINDOW_DAYS
+)
+from services.batch import BatchWriter
+from storage import create_store, SearchTimeout, SEARCH_MIN_TEXT_LENGTH, STATUS_RANK
+from utils.cache import LRUCache
 from utils.logger import logger
+from utils.metrics import DB_OPERATION_SECONDS
+
+# The configured backend (STORAGE_BACKEND); started and closed with the app
+store = create_store()
+
+# Read-through cache for the conversation list and thread heads (newest page).
+# Tags: "conversations" for list entries, ("thread", user_id) and "threads" for
+# thread heads; every write path below invalidates the tags it touches.
+read_cache = LRUCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS)
+
+def invalidate_users(user_ids: Iterable[str]):
+    """Drop cached reads affected by new or changed messages for these users"""
+    read_cache.invalidate("conversations", *(("thread", user_id) for user_id in set(user_ids)))
 
 async def save_incoming_message(message: dict):
-    """Save an incoming message to MongoDB"""
+    """Save an incoming message"""
+    await save_incoming_messages([message])
+
+async def save_incoming_messages(messages: List[dict]):
+    """
+    Save a batch of incoming messages in one round trip, skipping duplicates
+    
+    Raises on failure: the webhook's batch writer logs it and lets Meta's
+    redelivery of these messages through again.
+    """
+    if not messages:
+        return
     try:
-        await db.messages.insert_one(message)
-        logger.info(f"Saved incoming message from {message.get('user_id')}")
-    except Exception as e:
-        logger.error(f"Error saving message: {str(e)}")
+        with DB_OPERATION_SECONDS.time("save_incoming_messages"):
+            stored = await store.insert_messages(messages)
+        logger.info("Saved %d incoming messages, skipped %d duplicates",
+                    len(stored), len(messages) - len(stored))
+    finally:
+        invalidate_users(msg["user_id"] for msg in messages)
 
-async def save_outgoing_message(to: str, message: str, message_id: str, status: str = "sent"):
-    """Save an outgoing message to MongoDB"""
+async def save_outgoing_message(to: str, message: str, message_id: str, status: str = "sent") -> Optional[dict]:
+    """Save an outgoing message, returning the stored document"""
     try:
         doc = {
             "user_id": to,
@@ -23,84 +60,357 @@ async def save_outgoing_message(to: str, message: str, message_id: str, status:
             "status": status,
             "message_id": message_id
         }
-        await db.messages.insert_one(doc)
-        logger.info(f"Saved outgoing message to {to}")
+        with DB_OPERATION_SECONDS.time("save_outgoing_message"):
+            stored = await store.insert_messages([doc])
+        logger.info("Saved outgoing message to %s", to)
+        return stored[0] if stored else None
     except Exception as e:
-        logger.error(f"Error saving outgoing message: {str(e)}")
+        logger.error("Error saving outgoing message: %s", e)
+    finally:
+        invalidate_users([to])
+
+async def save_outgoing_messages(messages: List[dict]):
+    """
+    Save a batch of already-sent outgoing messages in one round trip
+    
+    Raises on failure, like save_incoming_messages: the campaign recorder's
+    batch writer logs it and reports the batch to its failure handlers.
+    """
+    if not messages:
+        return
+    try:
+        with DB_OPERATION_SECONDS.time("save_outgoing_messages"):
+            stored = await store.insert_messages(messages)
+        logger.info("Saved %d outgoing messages", len(stored))
+    finally:
+        invalidate_users(msg["user_id"] for msg in messages)
+
+async def enqueue_outgoing_message(to: str, message: str) -> dict:
+    """
+    Store an outgoing message as `queued` for the outbound workers
+    
+    Returns the stored document (its `_id` identifies the send). Unlike the
+    other saves this raises on failure: a caller must not report a message as
+    accepted that was never stored.
+    """
+    now = datetime.utcnow()
+    doc = {
+        "user_id": to,
+        "direction": "outbound",
+        "body": message,
+        "timestamp": now,
+        "status": "queued",
+        "next_attempt_at": now,
+        "attempts": 0
+    }
+    try:
+        with DB_OPERATION_SECONDS.time("enqueue_outgoing_message"):
+            stored = await store.insert_messages([doc])
+    finally:
+        invalidate_users([to])
+    if not stored:
+        raise RuntimeError(f"Outgoing message to {to} was not stored")
+    return stored[0]
+
+def lease_end(now: datetime, lease_seconds: float) -> datetime:
+    # Leases are matched for equality later, and MongoDB keeps milliseconds
+    end = now + timedelta(seconds=lease_seconds)
+    return end.replace(microsecond=end.microsecond // 1000 * 1000)
+
+async def claim_outgoing_messages(limit: int, lease_seconds: float) -> List[dict]:
+    """Lease up to `limit` due queued messages for delivery (see MessageStore.claim_outbound)"""
+    now = datetime.utcnow()
+    with DB_OPERATION_SECONDS.time("claim_outgoing_messages"):
+        return await store.claim_outbound(limit, now, lease_end(now, lease_seconds))
 
-async def get_messages_by_user(user_id: str, limit: int = 100) -> List[dict]:
-    """Get all messages for a specific user"""
+async def renew_send_lease(message: dict, lease_seconds: float) -> bool:
+    """
+    Extend a claimed message's lease to `lease_seconds` from now, right before sending it
+    
+    False if the lease already ran out and the message was claimed again
+    (or recorded) elsewhere: this claimant must not send it.
+    """
+    lease_until = lease_end(datetime.utcnow(), lease_seconds)
+    with DB_OPERATION_SECONDS.time("renew_send_lease"):
+        renewed = await store.renew_lease(message["_id"], message["next_attempt_at"], lease_until)
+    if renewed:
+        message["next_attempt_at"] = lease_until
+    return renewed
+
+async def record_send_attempt(message: dict, status: str, message_id: Optional[str] = None,
+                              error: Optional[str] = None, retry_at: Optional[datetime] = None) -> bool:
+    """
+    Record one delivery attempt of a claimed message: queued (retry at `retry_at`), sent or failed
+    
+    False, recording nothing, if the message's lease has passed to another claimant.
+    """
+    try:
+        with DB_OPERATION_SECONDS.time("record_send_attempt"):
+            return await store.record_attempt(
+                message["_id"], message["next_attempt_at"], status, datetime.utcnow(),
+                message_id=message_id, error=error, retry_at=retry_at
+            )
+    finally:
+        if status != "queued":
+            invalidate_users([message["user_id"]])
+
+async def get_outgoing_message(message_key: str) -> Optional[dict]:
+    """An outgoing message by the id /api/send returned; raises ValueError for a malformed id"""
+    with DB_OPERATION_SECONDS.time("get_outgoing_message"):
+        return await store.get_message(store.parse_id(message_key))
+
+def encode_cursor(message: dict) -> str:
+    """Opaque page cursor for a message's position in its thread: (timestamp, _id)"""
+    raw = f"{message['timestamp'].isoformat()}|{message['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Any]:
+    """Inverse of encode_cursor; raises ValueError for anything it didn't produce"""
     try:
-        cursor = db.messages.find({"user_id": user_id}).sort("timestamp", 1).limit(limit)
-        messages = await cursor.to_list(length=limit)
-        return messages
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_key = raw.split("|")
+        return datetime.fromisoformat(timestamp), store.parse_id(message_key)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+async def get_messages_by_user(user_id: str, limit: int = 100,
+                               before: Optional[Tuple[datetime, Any]] = None,
+                               after: Optional[Tuple[datetime, Any]] = None) -> dict:
+    """
+    Get one page of a user's thread, oldest first within the page
+    
+    Without cursors this is the newest page. `before` pages back in time and
+    `after` pages forward; `next_cursor` continues in the same direction and is
+    None once there is nothing more. Every page is a range scan on the
+    (user_id, timestamp, _id) index, so cost doesn't grow with thread length.
+    """
+    forward = after is not None
+    position = after if forward else before
+    
+    async def load() -> dict:
+        # Fetch one extra row to learn whether another page exists
+        with DB_OPERATION_SECONDS.time("get_messages_by_user"):
+            messages = await store.get_thread(user_id, limit + 1, position, forward)
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        next_cursor = encode_cursor(messages[-1]) if has_more else None
+        if not forward:
+            messages.reverse()
+        return {"messages": messages, "next_cursor": next_cursor}
+    
+    try:
+        if position is None:
+            # Thread head: what polling clients ask for, so it's cached
+            return await read_cache.get_or_load(
+                ("thread", user_id, limit), (("thread", user_id), "threads"), load
+            )
+        return await load()
     except Exception as e:
-        logger.error(f"Error fetching messages for {user_id}: {str(e)}")
-        return []
+        logger.error("Error fetching messages for %s: %s", user_id, e)
+        return {"messages": [], "next_cursor": None}
+
+def format_conversation(conv: dict) -> dict:
+    last = conv.get("last") or {}
+    return {
+        "user_id": conv["_id"],
+        "last_message": last.get("body", ""),
+        "last_timestamp": last.get("timestamp"),
+        "last_direction": last.get("direction"),
+        "total_messages": conv.get("total_messages", 0),
+        "unread_count": conv.get("unread_count", 0)
+    }
 
 async def get_all_conversations(limit: int = 50) -> List[dict]:
     """Get list of all users with their last message"""
+    async def load() -> List[dict]:
+        with DB_OPERATION_SECONDS.time("get_all_conversations"):
+            conversations = await store.list_conversations(limit)
+        return [format_conversation(conv) for conv in conversations]
+    
     try:
-        pipeline = [
-            {
-                "$sort": {"timestamp": -1}
-            },
-            {
-                "$group": {
-                    "_id": "$user_id",
-                    "last_message": {"$first": "$body"},
-                    "last_timestamp": {"$first": "$timestamp"},
-                    "total_messages": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"last_timestamp": -1}
-            },
-            {
-                "$limit": limit
-            }
-        ]
-        
-        cursor = db.messages.aggregate(pipeline)
-        conversations = await cursor.to_list(length=limit)
-        
-        # Format response
-        result = []
-        for conv in conversations:
-            result.append({
-                "user_id": conv["_id"],
-                "last_message": conv["last_message"],
-                "last_timestamp": conv["last_timestamp"],
-                "total_messages": conv["total_messages"],
-                "unread_count": 0  # You can implement unread logic later
-            })
-        
-        return result
+        return await read_cache.get_or_load(("conversations", limit), ("conversations",), load)
     except Exception as e:
-        logger.error(f"Error fetching conversations: {str(e)}")
+        logger.error("Error fetching conversations: %s", e)
         return []
 
-async def search_messages(query: str, limit: int = 50) -> List[dict]:
-    """Search messages by content"""
+async def mark_conversation_read(user_id: str) -> Optional[dict]:
+    """
+    Reset a conversation's unread counter
+    
+    Returns the unread count that was cleared and the newest inbound message_id
+    (the one read receipt to send), or None if the conversation doesn't exist.
+    """
     try:
-        cursor = db.messages.find(
-            {"body": {"$regex": query, "$options": "i"}}
-        ).sort("timestamp", -1).limit(limit)
-        
-        messages = await cursor.to_list(length=limit)
-        return messages
+        with DB_OPERATION_SECONDS.time("mark_conversation_read"):
+            conv = await store.mark_read(user_id)
+        read_cache.invalidate("conversations")
+        if conv is None:
+            return None
+        return {
+            "user_id": user_id,
+            "marked_read": conv.get("unread_count", 0),
+            "message_id": (conv.get("last_inbound") or {}).get("message_id")
+        }
     except Exception as e:
-        logger.error(f"Error searching messages: {str(e)}")
-        return []
+        logger.error("Error marking conversation %s read: %s", user_id, e)
+        raise
 
-async def update_message_status(message_id: str, status: str):
-    """Update the status of a message"""
+async def get_changes_since(since: int, limit: int = 500) -> dict:
+    """
+    Messages and conversation summaries changed after sequence `since`
+    
+    Both are read in `seq` order. If either side has more than `limit` changes,
+    the batch is cut at the lower of the two last sequence numbers so
+    `next_since` never skips anything.
+    """
+    with DB_OPERATION_SECONDS.time("get_changes_since"):
+        messages, conversations = await store.changes_since(since, limit + 1)
+    
+    cut_points = [
+        batch[limit - 1]["seq"]
+        for batch in (messages, conversations)
+        if len(batch) > limit
+    ]
+    has_more = bool(cut_points)
+    if has_more:
+        cutoff = min(cut_points)
+        messages = [msg for msg in messages if msg["seq"] <= cutoff]
+        conversations = [conv for conv in conversations if conv["seq"] <= cutoff]
+        next_since = cutoff
+    else:
+        next_since = max([since] + [doc["seq"] for doc in messages + conversations])
+    
+    return {
+        "messages": messages,
+        "conversations": [{**format_conversation(conv), "seq": conv["seq"]} for conv in conversations],
+        "next_since": next_since,
+        "has_more": has_more
+    }
+
+async def get_current_sequence() -> int:
+    """The newest change get_changes_since can return right now"""
+    with DB_OPERATION_SECONDS.time("get_current_sequence"):
+        return await store.current_sequence()
+
+async def rebuild_conversations():
+    """Recompute every conversation summary from the messages (one-shot backfill)"""
+    with DB_OPERATION_SECONDS.time("rebuild_conversations"):
+        total = await store.rebuild_conversations()
+    read_cache.clear()
+    logger.info("Rebuilt %d conversation summaries", total)
+    return total
+
+async def search_messages(query: str, limit: int = 50, offset: int = 0,
+                          user_id: Optional[str] = None, direction: Optional[str] = None,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[dict]:
+    """
+    Search messages by content
+    
+    Full-text matching with relevance ranking; queries shorter than
+    SEARCH_MIN_TEXT_LENGTH use a case-insensitive word-prefix match instead,
+    newest first. That match scans message bodies, so without `since` it
+    only looks at the last SEARCH_PREFIX_WINDOW_DAYS. Raises SearchTimeout
+    if the store gave up before finishing.
+    """
+    query = query.strip()
+    if len(query) < SEARCH_MIN_TEXT_LENGTH and since is None:
+        since = datetime.utcnow() - timedelta(days=SEARCH_PREFIX_WINDOW_DAYS)
     try:
-        result = await db.messages.update_one(
-            {"message_id": message_id},
-            {"$set": {"status": status}}
-        )
-        if result.modified_count > 0:
-            logger.info(f"Updated message {message_id} status to {status}")
+        with DB_OPERATION_SECONDS.time("search_messages"):
+            return await store.search(
+                query, limit, offset,
+                user_id=user_id, direction=direction, since=since, until=until
+            )
+    except SearchTimeout:
+        raise
     except Exception as e:
-        logger.error(f"Error updating message status: {str(e)}")
\ No newline at end of file
+        logger.error("Error searching messages: %s", e)
+        return []
+
+def coalesce_status_updates(updates: List[dict]) -> Dict[str, dict]:
+    """
+    Collapse a window of status callbacks to one entry per message_id
+    
+    Keeps the highest-ranked status and every status timestamp seen, so a late
+    "delivered" in the same window can't win over "read".
+    """
+    latest: Dict[str, dict] = {}
+    for update in updates:
+        message_id = update["message_id"]
+        status = update["status"]
+        entry = latest.setdefault(message_id, {"status": None, "timestamps": {}})
+        entry["timestamps"][status] = update.get("timestamp") or datetime.utcnow()
+        
+        if status in STATUS_RANK and (
+            entry["status"] is None or STATUS_RANK[status] >= STATUS_RANK[entry["status"]]
+        ):
+            entry["status"] = status
+    return latest
+
+async def update_message_statuses(updates: List[dict]):
+    """
+    Apply a batch of status updates ({message_id, status, timestamp, user_id}) in one write
+    
+    Raises on failure, like save_incoming_messages.
+    """
+    coalesced = coalesce_status_updates(updates)
+    if not coalesced:
+        return
+    
+    try:
+        with DB_OPERATION_SECONDS.time("update_message_statuses"):
+            modified = await store.apply_statuses(coalesced)
+        logger.info("Applied %d status updates (%d documents modified)", len(updates), modified)
+    finally:
+        # Callbacks carry the recipient, so only their threads are dropped;
+        # without one we can't tell whose thread changed
+        user_ids = {update.get("user_id") for update in updates}
+        if None in user_ids:
+            read_cache.invalidate("threads")
+        read_cache.invalidate(*(("thread", user_id) for user_id in user_ids if user_id))
+
+async def update_message_status(message_id: str, status: str, timestamp: Optional[datetime] = None,
+                                user_id: Optional[str] = None):
+    """Update the status of a message"""
+    await update_message_statuses([
+        {"message_id": message_id, "status": status, "timestamp": timestamp, "user_id": user_id}
+    ])
+
+# Background writer for webhook ingestion, started/stopped with the app
+incoming_writer = BatchWriter(
+    "incoming",
+    save_incoming_messages,
+    batch_size=WEBHOOK_BATCH_SIZE,
+    flush_interval=WEBHOOK_FLUSH_INTERVAL,
+    max_queue=WEBHOOK_QUEUE_MAX
+)
+
+# Status callbacks are coalesced per flush window before hitting the store
+status_writer = BatchWriter(
+    "status",
+    update_message_statuses,
+    batch_size=WEBHOOK_BATCH_SIZE,
+    flush_interval=WEBHOOK_FLUSH_INTERVAL,
+    max_queue=WEBHOOK_QUEUE_MAX
+)
+
+async def store_campaign(campaign: dict) -> bool:
+    """Save a campaign's progress document; True once someone asked for it to be cancelled"""
+    with DB_OPERATION_SECONDS.time("store_campaign"):
+        return await store.save_campaign(campaign)
+
+async def load_campaign(campaign_id: str) -> Optional[dict]:
+    """A campaign's last saved progress, or None"""
+    with DB_OPERATION_SECONDS.time("load_campaign"):
+        return await store.get_campaign(campaign_id)
+
+async def load_campaigns(limit: int) -> List[dict]:
+    """The newest `limit` campaigns' last saved progress"""
+    with DB_OPERATION_SECONDS.time("load_campaigns"):
+        return await store.list_campaigns(limit)
+
+async def request_campaign_cancel(campaign_id: str) -> Optional[dict]:
+    """Flag a campaign for its worker to stop; its progress document, or None"""
+    with DB_OPERATION_SECONDS.time("request_campaign_cancel"):
+        return await store.cancel_campaign(campaign_id)
@@ -0,0 +1,333 @@
+# inbox/app/services/media.py
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from config import (
+    MEDIA_DIR,
+    MEDIA_CACHE_MAX_BYTES,
+    MEDIA_MAX_FILE_BYTES,
+    MEDIA_WORKERS,
+    MEDIA_QUEUE_MAX,
+    MEDIA_DOWNLOAD_TIMEOUT_SECONDS
+)
+from services.whatsapp import whatsapp_service
+from utils.logger import logger
+from utils.metrics import MEDIA_FETCHES, MEDIA_CACHE_BYTES
+
+CHUNK_BYTES = 64 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mime_type TEXT,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_lru ON blobs (last_access);
+CREATE TABLE IF NOT EXISTS media (
+    media_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    mime_type TEXT,
+    graph_sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS media_graph_sha256 ON media (graph_sha256);
+"""
+
+class MediaFile:
+    """A cached media file: where it is and what to serve it as"""
+    
+    __slots__ = ("media_id", "sha256", "path", "size", "mime_type")
+    
+    def __init__(self, media_id: str, sha256: str, path: str, size: int, mime_type: Optional[str]):
+        self.media_id = media_id
+        self.sha256 = sha256
+        self.path = path
+        self.size = size
+        self.mime_type = mime_type or "application/octet-stream"
+
+class MediaCache:
+    """
+    Local, content-addressed cache of inbound media
+    
+    Webhook media ids are queued with `enqueue`; `workers` tasks look each
+    one up on the Graph API and stream the file to disk, hashing it on the
+    way, then move it to `<dir>/<sha256[:2]>/<sha256>`. Forwarded media
+    arrives with a new id but the same bytes, so it is stored once: a
+    Graph sha256 already seen is linked without a download, and anything
+    that does get downloaded twice collapses onto the existing file.
+    
+    A SQLite index in the cache directory maps media ids to files and keeps
+    each file's last access; when the cache grows past `max_bytes` the
+    least recently used files are deleted. Their ids stay mapped, so a
+    later request fetches them again. Every lookup goes through `get`,
+    which also downloads on a miss, and concurrent requests for one id
+    share a single download.
+    """
+    
+    def __init__(self, directory: str = "media", max_bytes: int = 2 * 1024 ** 3,
+                 max_file_bytes: int = 100 * 1024 ** 2, workers: int = 4, queue_max: int = 1000,
+                 download_timeout: float = 120.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.workers = workers
+        self.queue_max = queue_max
+        self.download_timeout = download_timeout
+        self.conn: Optional[sqlite3.Connection] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.fetching: Dict[str, asyncio.Future] = {}
+        self.cached_bytes = 0
+        MEDIA_CACHE_BYTES.set_function(lambda: self.cached_bytes)
+    
+    async def _run(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+    
+    async def start(self):
+        """Open the index and start the download workers (called on app startup)"""
+        if self.executor is not None:
+            return
+        # One thread owns the index connection and does the file moves and deletes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-cache")
+        await self._run(self._open)
+        self.queue = asyncio.Queue(maxsize=self.queue_max)
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        logger.info("Media cache at %s (%d bytes of %d)", self.directory, self.cached_bytes, self.max_bytes)
+    
+    async def stop(self):
+        """Stop downloading; queued media is fetched on first request instead (called on app shutdown)"""
+        if self.executor is None:
+            return
+        # Fetches are shielded from their callers, so in-flight ones are
+        # cancelled here, before the Graph client they use is closed
+        fetching = list(self.fetching.values())
+        for task in self.tasks + fetching:
+            task.cancel()
+        await asyncio.gather(*self.tasks, *fetching, return_exceptions=True)
+        self.tasks = []
+        await self._run(self.conn.close)
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        self.conn = None
+    
+    def enqueue(self, media_id: str, sha256: Optional[str] = None):
+        """Fetch a media id in the background; never waits"""
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait((media_id, sha256))
+        except asyncio.QueueFull:
+            logger.warning("Media queue full; %s will be fetched on first request", media_id)
+    
+    def qsize(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+    
+    async def get(self, media_id: str, sha256: Optional[str] = None) -> Optional[MediaFile]:
+        """The cached file for a media id, downloading it first if needed; None if unavailable"""
+        future = self.fetching.get(media_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(media_id, sha256))
+            self.fetching[media_id] = future
+            future.add_done_callback(lambda _: self.fetching.pop(media_id, None))
+        # Shielded: a client going away mustn't cancel a download others wait on
+        return await asyncio.shield(future)
+    
+    async def _work(self):
+        while True:
+            media_id, sha256 = await self.queue.get()
+            try:
+                await self.get(media_id, sha256)
+            except Exception as e:
+                logger.error("Background fetch of media %s failed: %s", media_id, e, exc_info=True)
+    
+    async def _fetch(self, media_id: str, graph_sha256: Optional[str]) -> Optional[MediaFile]:
+        cached = await self._cached(media_id, graph_sha256)
+        if cached is not None:
+            return cached
+        
+        info = await whatsapp_service.get_media_info(media_id)
+        if info is None or not info.get("url"):
+            MEDIA_FETCHES.labels("failed").inc()
+            return None
+        if info.get("sha256") and info["sha256"] != graph_sha256:
+            graph_sha256 = info["sha256"]
+            cached = await self._cached(media_id, graph_sha256)
+            if cached is not None:
+                return cached
+        if info.get("file_size") and int(info["file_size"]) > self.max_file_bytes:
+            logger.warning("Media %s is %s bytes, over the %d byte limit", media_id, info["file_size"], self.max_file_bytes)
+            MEDIA_FETCHES.labels("failed").inc()
+            return None
+        
+        tmp_path = os.path.join(self.directory, "tmp", f"{uuid.uuid4().hex}.part")
+        try:
+            sha256, size, mime_type = await self._download(info["url"], tmp_path)
+        except asyncio.CancelledError:
+            # Shutting down: the partial file won't be finished
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        except Exception as e:
+            logger.error("Download of media %s failed: %s", media_id, e)
+            MEDIA_FETCHES.labels("failed").inc()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        
+        media = await self._run(
+            self._store, tmp_path, media_id, sha256, size, info.get("mime_type") or mime_type, graph_sha256
+        )
+        MEDIA_FETCHES.labels("downloaded").inc()
+        logger.info("Cached media %s (%d bytes, %s)", media_id, size, sha256[:12])
+        return media
+    
+    async def _cached(self, media_id: str, graph_sha256: Optional[str]) -> Optional[MediaFile]:
+        cached = await self._run(self._lookup, media_id, graph_sha256)
+        if cached is None:
+            return None
+        if cached.media_id == media_id:
+            MEDIA_FETCHES.labels("cached").inc()
+            return cached
+        # Forwarded: another id with the same Graph hash is already here
+        MEDIA_FETCHES.labels("deduplicated").inc()
+        await self._run(self._link, media_id, cached.sha256, cached.mime_type, graph_sha256)
+        cached.media_id = media_id
+        return cached
+    
+    async def _download(self, url: str, tmp_path: str):
+        """Stream a download to `tmp_path`, hashing as it goes; returns (sha256, size, content type)"""
+        digest = hashlib.sha256()
+        size = 0
+        async with whatsapp_service.stream_media(url, self.download_timeout) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            # Chunk writes land in the page cache; handing each to a thread
+            # would cost more than the write
+            with open(tmp_path, "wb") as f:
+                async for chunk in response.aiter_bytes(CHUNK_BYTES):
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise RuntimeError(f"larger than {self.max_file_bytes} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            return digest.hexdigest(), size, response.headers.get("content-type")
+    
+    # Everything below runs on the cache's thread
+    
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Partial downloads left by a previous run. Other server processes
+        # share the directory, so only files nobody has written to for a
+        # whole read timeout go; a live download writes more often than that
+        tmp = os.path.join(self.directory, "tmp")
+        os.makedirs(tmp, exist_ok=True)
+        stale = time.time() - self.download_timeout
+        for entry in os.scandir(tmp):
+            try:
+                if entry.stat().st_mtime < stale:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self.conn = sqlite3.connect(os.path.join(self.directory, "index.db"), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(SCHEMA)
+        self.cached_bytes = self._total()
+    
+    def _total(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+    
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, sha256[:2], sha256)
+    
+    def _lookup(self, media_id: str, graph_sha256: Optional[str]) -> Optional[MediaFile]:
+        """A cached file for this id, or for another id with the same Graph hash; touches it"""
+        query = (
+            "SELECT m.media_id, b.sha256, b.size, b.mime_type FROM media m "
+            "JOIN blobs b ON b.sha256 = m.sha256 WHERE m.{} = ? LIMIT 1"
+        )
+        row = self.conn.execute(query.format("media_id"), (media_id,)).fetchone()
+        if row is None and graph_sha256:
+            row = self.conn.execute(query.format("graph_sha256"), (graph_sha256,)).fetchone()
+        if row is None:
+            return None
+        
+        found_id, sha256, size, mime_type = row
+        path = self.blob_path(sha256)
+        if not os.path.exists(path):
+            # Deleted behind the index's back
+            with self.conn:
+                self.conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self.cached_bytes = self._total()
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+        return MediaFile(found_id, sha256, path, size, mime_type)
+    
+    def _link(self, media_id: str, sha256: str, mime_type: Optional[str], graph_sha256: Optional[str]):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO media (media_id, sha256, mime_type, graph_sha256) VALUES (?, ?, ?, ?)",
+                (media_id, sha256, mime_type, graph_sha256)
+            )
+    
+    def _store(self, tmp_path: str, media_id: str, sha256: str, size: int,
+               mime_type: Optional[str], graph_sha256: Optional[str]) -> MediaFile:
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            # Same bytes under another id
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO blobs (sha256, size, mime_type, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (sha256) DO UPDATE SET last_access = excluded.last_access",
+                (sha256, size, mime_type, time.time())
+            )
+        self._link(media_id, sha256, mime_type, graph_sha256)
+        self._evict(keep=sha256)
+        return MediaFile(media_id, sha256, path, size, mime_type)
+    
+    def _evict(self, keep: str):
+        """Delete least recently used files until the cache fits in max_bytes"""
+        total = self._total()
+        while total > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT sha256, size FROM blobs WHERE sha256 != ? ORDER BY last_access LIMIT 100", (keep,)
+            ).fetchall()
+            if not rows:
+                break
+            evicted = []
+            for sha256, size in rows:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    # An open response keeps streaming from the unlinked file
+                    os.remove(self.blob_path(sha256))
+                except FileNotFoundError:
+                    pass
+                evicted.append((sha256,))
+                total -= size
+            with self.conn:
+                self.conn.executemany("DELETE FROM blobs WHERE sha256 = ?", evicted)
+            logger.info("Evicted %d media files from the cache", len(evicted))
+        self.cached_bytes = total
+
+# Started/stopped with the app
+media_cache = MediaCache(
+    directory=MEDIA_DIR,
+    max_bytes=MEDIA_CACHE_MAX_BYTES,
+    max_file_bytes=MEDIA_MAX_FILE_BYTES,
+    workers=MEDIA_WORKERS,
+    queue_max=MEDIA_QUEUE_MAX,
+    download_timeout=MEDIA_DOWNLOAD_TIMEOUT_SECONDS
+)
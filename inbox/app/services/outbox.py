@@ -0,0 +1,192 @@
+# inbox/app/services/outbox.py
+import asyncio
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional
+from config import (
+    OUTBOX_WORKERS,
+    OUTBOX_RATE_PER_SECOND,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_BASE_SECONDS,
+    OUTBOX_BACKOFF_MAX_SECONDS,
+    OUTBOX_POLL_SECONDS,
+    OUTBOX_LEASE_SECONDS,
+    API_WORKERS
+)
+from services.events import event_broker
+from services.inbox import (
+    enqueue_outgoing_message,
+    claim_outgoing_messages,
+    renew_send_lease,
+    record_send_attempt
+)
+from services.whatsapp import whatsapp_service
+from utils.logger import logger
+from utils.metrics import OUTBOX_ATTEMPTS
+from utils.ratelimit import TokenBucket
+
+_STOP = object()
+
+class OutboundQueue:
+    """
+    Durable outbound queue: the store holds the messages, a worker pool delivers them
+    
+    `enqueue` only stores the message as `queued`. A dispatcher leases due
+    messages from the store (claim_outbound) into a small local queue and
+    `workers` tasks send them through the shared WhatsAppService client, all
+    behind one token bucket. Each attempt is recorded in the store: sent
+    (with the Graph message_id), failed, or queued again after exponential
+    backoff with full jitter. Retries cover throttling, 5xx, timeouts and
+    connection errors; anything else fails at once.
+    
+    Nothing lives only in memory: a message leased by a process that dies is
+    claimed again when its lease runs out, so delivery is at-least-once. A
+    worker can wait on the token bucket for longer than a lease (a throttle
+    pauses it for up to `backoff_max`), so it renews the lease right before
+    sending and drops the message if it was claimed again meanwhile; the
+    outcome is only recorded under the lease it sent with.
+    """
+    
+    def __init__(self, workers: int = 8, rate: float = 20.0, max_attempts: int = 6,
+                 backoff_base: float = 2.0, backoff_max: float = 300.0,
+                 poll_interval: float = 1.0, lease_seconds: float = 60.0):
+        self.workers = workers
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.limiter: Optional[TokenBucket] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.wake: Optional[asyncio.Event] = None
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.tasks: List[asyncio.Task] = []
+        self.stopping = False
+    
+    async def start(self):
+        """Start the dispatcher and workers (called on app startup)"""
+        if self.dispatcher is not None:
+            return
+        self.limiter = TokenBucket(self.rate)
+        self.queue = asyncio.Queue(maxsize=self.workers)
+        self.wake = asyncio.Event()
+        self.stopping = False
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self.dispatcher = asyncio.create_task(self._dispatch())
+        logger.info("Outbound queue started (workers=%d, rate=%s/s)", self.workers, self.rate)
+    
+    async def stop(self):
+        """Stop claiming, finish the messages already claimed, then stop (called on app shutdown)"""
+        if self.dispatcher is None:
+            return
+        self.stopping = True
+        self.wake.set()
+        await self.dispatcher
+        for _ in self.tasks:
+            await self.queue.put(_STOP)
+        await asyncio.gather(*self.tasks)
+        self.dispatcher = None
+        self.tasks = []
+        logger.info("Outbound queue drained and stopped")
+    
+    async def enqueue(self, to: str, message: str) -> dict:
+        """Store a message for delivery and wake the dispatcher; returns the stored document"""
+        doc = await enqueue_outgoing_message(to, message)
+        if self.wake is not None:
+            self.wake.set()
+        return doc
+    
+    def backoff(self, attempts: int) -> float:
+        """Seconds before retry number `attempts`: exponential, capped, with full jitter"""
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+        return random.uniform(0, ceiling)
+    
+    async def _dispatch(self):
+        while not self.stopping:
+            room = self.queue.maxsize - self.queue.qsize()
+            claimed = []
+            if room:
+                try:
+                    claimed = await claim_outgoing_messages(room, self.lease_seconds)
+                except Exception as e:
+                    logger.error("Failed to claim outbound messages: %s", e)
+            for doc in claimed:
+                self.queue.put_nowait(doc)
+            if room and len(claimed) == room:
+                # A full claim: probably more due already
+                continue
+            
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _work(self):
+        while True:
+            doc = await self.queue.get()
+            if doc is _STOP:
+                return
+            if self.queue.empty():
+                # Starving: let the dispatcher claim more now rather than at the next poll
+                self.wake.set()
+            try:
+                await self._deliver(doc)
+            except Exception as e:
+                # The lease runs out and the message is claimed again
+                logger.error("Outbound delivery of %s failed: %s", doc["_id"], e, exc_info=True)
+    
+    async def _deliver(self, doc: dict):
+        await self.limiter.acquire()
+        if not await renew_send_lease(doc, self.lease_seconds):
+            logger.info("Message %s was claimed again while waiting to send; leaving it to that claim", doc["_id"])
+            return
+        result = await whatsapp_service.send_text_message(doc["user_id"], doc["body"])
+        attempts = (doc.get("attempts") or 0) + 1
+        
+        if result["success"]:
+            self.limiter.recover()
+            OUTBOX_ATTEMPTS.labels("sent").inc()
+            await record_send_attempt(doc, "sent", message_id=result["message_id"])
+            self._publish(doc, "sent", message_id=result["message_id"])
+            return
+        
+        if result["retryable"] and attempts < self.max_attempts:
+            delay = self.backoff(attempts)
+            if result["throttled"]:
+                self.limiter.throttle(delay)
+            OUTBOX_ATTEMPTS.labels("retry").inc()
+            logger.warning("Send to %s failed (attempt %d/%d): %s; retrying in %.1fs",
+                           doc["user_id"], attempts, self.max_attempts, result["error"], delay)
+            await record_send_attempt(
+                doc, "queued", error=result["error"], retry_at=datetime.utcnow() + timedelta(seconds=delay)
+            )
+            return
+        
+        OUTBOX_ATTEMPTS.labels("failed").inc()
+        logger.error("Giving up on message %s to %s after %d attempts: %s",
+                     doc["_id"], doc["user_id"], attempts, result["error"])
+        await record_send_attempt(doc, "failed", error=result["error"])
+        self._publish(doc, "failed", error=result["error"])
+    
+    def _publish(self, doc: dict, status: str, message_id: Optional[str] = None, error: Optional[str] = None):
+        event_broker.publish("status", doc["user_id"], {
+            "id": str(doc["_id"]),
+            "message_id": message_id,
+            "status": status,
+            "error": error,
+            "user_id": doc["user_id"]
+        })
+
+# Started/stopped with the app; every server process runs one, so each
+# takes an equal share of the Graph rate
+outbound_queue = OutboundQueue(
+    workers=OUTBOX_WORKERS,
+    rate=OUTBOX_RATE_PER_SECOND / max(API_WORKERS, 1),
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    backoff_base=OUTBOX_BACKOFF_BASE_SECONDS,
+    backoff_max=OUTBOX_BACKOFF_MAX_SECONDS,
+    poll_interval=OUTBOX_POLL_SECONDS,
+    lease_seconds=OUTBOX_LEASE_SECONDS
+)
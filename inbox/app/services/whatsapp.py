@@ -1,32 +1,99 @@
 # inbox/app/services/whatsapp.py
-import requests
-from typing import Optional, Dict
-from config import WHATSAPP_ACCESS_TOKEN, WHATSAPP_PHONE_NUMBER_ID
+import asyncio
+import httpx
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Dict
+from config import (
+    WHATSAPP_ACCESS_TOKEN,
+    WHATSAPP_PHONE_NUMBER_ID,
+    WHATSAPP_API_BASE_URL,
+    WHATSAPP_API_VERSION,
+    WHATSAPP_TIMEOUT_SECONDS,
+    WHATSAPP_MAX_CONNECTIONS,
+    WHATSAPP_MAX_CONCURRENCY,
+    DEFAULT_COUNTRY_CODE
+)
+from utils.contacts import normalize_phone
 from utils.logger import logger
+from utils.metrics import GRAPH_API_SECONDS, GRAPH_API_RESPONSES
+from utils.ratelimit import is_throttled
 
 class WhatsAppService:
     def __init__(self):
         self.access_token = WHATSAPP_ACCESS_TOKEN
         self.phone_number_id = WHATSAPP_PHONE_NUMBER_ID
-        self.api_url = f"https://graph.facebook.com/v22.0/{self.phone_number_id}/messages"
+        self.graph_url = f"{WHATSAPP_API_BASE_URL.rstrip('/')}/{WHATSAPP_API_VERSION}"
+        self.api_url = f"{self.graph_url}/{self.phone_number_id}/messages"
         self.headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json"
         }
+        self.timeout = WHATSAPP_TIMEOUT_SECONDS
+        self.client: Optional[httpx.AsyncClient] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
     
-    def send_text_message(self, to: str, message: str) -> Dict:
+    async def start(self):
+        """Open the shared keep-alive connection pool (called on app startup)"""
+        if self.client is not None:
+            return
+        limits = httpx.Limits(
+            max_connections=WHATSAPP_MAX_CONNECTIONS,
+            max_keepalive_connections=WHATSAPP_MAX_CONNECTIONS,
+            keepalive_expiry=30
+        )
+        self.client = httpx.AsyncClient(headers=self.headers, limits=limits, timeout=self.timeout)
+        self.semaphore = asyncio.Semaphore(WHATSAPP_MAX_CONCURRENCY)
+        logger.info("WhatsApp client started (pool=%d, concurrency=%d)", WHATSAPP_MAX_CONNECTIONS, WHATSAPP_MAX_CONCURRENCY)
+    
+    async def close(self):
+        """Close the connection pool (called on app shutdown)"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            self.semaphore = None
+    
+    async def _post(self, payload: Dict, timeout: Optional[float] = None, operation: str = "send") -> httpx.Response:
+        if self.client is None:
+            await self.start()
+        async with self.semaphore:
+            status = "error"
+            try:
+                with GRAPH_API_SECONDS.time(operation):
+                    response = await self.client.post(
+                        self.api_url,
+                        json=payload,
+                        timeout=timeout or self.timeout
+                    )
+                status = str(response.status_code)
+                return response
+            finally:
+                GRAPH_API_RESPONSES.labels(operation, status).inc()
+    
+    async def send_text_message(self, to: str, message: str, timeout: Optional[float] = None) -> Dict:
         """
         Send a text message via WhatsApp Business API
         
         Args:
-            to: Recipient phone number (with country code, no +)
+            to: Recipient phone number with country code (normalized to E.164 digits)
             message: Message text to send
-            
+            timeout: Per-call timeout in seconds (defaults to WHATSAPP_TIMEOUT_SECONDS)
+        
         Returns:
-            Dict with success status and message_id or error
+            Dict with success status and message_id or error, plus whether a
+            failure is worth retrying (`retryable`: throttling, 5xx, timeouts and
+            connection errors) and whether it was throttling (`throttled`)
         """
-        # Clean phone number
-        to = to.replace("+", "").replace(" ", "").replace("-", "")
+        phone = normalize_phone(to, DEFAULT_COUNTRY_CODE)
+        if phone is None:
+            logger.error("Not sending to invalid phone number %r", to)
+            return {
+                "success": False,
+                "message_id": None,
+                "error": f"Invalid phone number: {to}",
+                "retryable": False,
+                "throttled": False
+            }
+        to = phone
         
         payload = {
             "messaging_product": "whatsapp",
@@ -36,41 +103,46 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            response = await self._post(payload, timeout)
             
             response_data = response.json()
             
             if response.status_code == 200:
                 message_id = response_data.get("messages", [{}])[0].get("id")
-                logger.info(f"Message sent successfully to {to}, ID: {message_id}")
+                logger.info("Message sent successfully to %s, ID: %s", to, message_id)
                 return {
                     "success": True,
                     "message_id": message_id,
-                    "error": None
+                    "error": None,
+                    "retryable": False,
+                    "throttled": False
                 }
             else:
-                error_msg = response_data.get("error", {}).get("message", "Unknown error")
-                logger.error(f"Failed to send message to {to}: {error_msg}")
+                error = response_data.get("error", {})
+                error_msg = error.get("message", "Unknown error")
+                throttled = is_throttled(response.status_code, response_data)
+                logger.error("Failed to send message to %s: %s", to, error_msg)
                 return {
                     "success": False,
                     "message_id": None,
-                    "error": error_msg
+                    "error": error_msg,
+                    "retryable": throttled or response.status_code >= 500,
+                    "throttled": throttled
                 }
-                
+        
         except Exception as e:
-            logger.error(f"Exception while sending message to {to}: {str(e)}")
+            logger.error("Exception while sending message to %s: %s", to, e)
             return {
                 "success": False,
                 "message_id": None,
-                "error": str(e)
+                "error": str(e) or type(e).__name__,
+                # Includes timeouts: the message may have gone out, so a retry
+                # can deliver it twice (at-least-once)
+                "retryable": True,
+                "throttled": False
             }
     
-    def mark_as_read(self, message_id: str) -> bool:
+    async def mark_as_read(self, message_id: str, timeout: Optional[float] = None) -> bool:
         """Mark a message as read"""
         payload = {
             "messaging_product": "whatsapp",
@@ -79,16 +151,48 @@ class WhatsAppService:
         }
         
         try:
-            response = requests.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            response = await self._post(payload, timeout, operation="read")
             return response.status_code == 200
         except Exception as e:
-            logger.error(f"Failed to mark message as read: {str(e)}")
+            logger.error("Failed to mark message as read: %s", e)
             return False
+    
+    async def get_media_info(self, media_id: str, timeout: Optional[float] = None) -> Optional[Dict]:
+        """
+        Look up an inbound media object
+        
+        Returns Graph's answer (a short-lived download `url`, `mime_type`,
+        `file_size` and `sha256`), or None if the lookup failed.
+        """
+        if self.client is None:
+            await self.start()
+        status = "error"
+        try:
+            async with self.semaphore:
+                with GRAPH_API_SECONDS.time("media_info"):
+                    response = await self.client.get(f"{self.graph_url}/{media_id}", timeout=timeout or self.timeout)
+            status = str(response.status_code)
+            if response.status_code == 200:
+                return response.json()
+            logger.error("Media lookup for %s failed: %s", media_id, response.text[:200])
+        except Exception as e:
+            logger.error("Media lookup for %s failed: %s", media_id, e)
+        finally:
+            GRAPH_API_RESPONSES.labels("media_info", status).inc()
+        return None
+    
+    @asynccontextmanager
+    async def stream_media(self, url: str, timeout: Optional[float] = None) -> AsyncIterator[httpx.Response]:
+        """Open a streaming download of a get_media_info URL (it takes the same bearer token)"""
+        if self.client is None:
+            await self.start()
+        status = "error"
+        try:
+            async with self.client.stream("GET", url, timeout=timeout or self.timeout) as response:
+                status = str(response.status_code)
+                yield response
+        finally:
+            GRAPH_API_RESPONSES.labels("media_download", status).inc()
 
 # Create singleton instance
-whatsapp_service = WhatsAppService()
\ No newline at end of file
+whatsapp_service = WhatsAppService()
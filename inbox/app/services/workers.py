@@ -0,0 +1,122 @@
+# inbox/app/services/workers.py
+import asyncio
+import json
+import os
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+from config import WORKER_STATS_DIR, WORKER_STATS_INTERVAL_SECONDS
+from utils.metrics import Registry, metrics
+from utils.logger import logger
+
+class WorkerStats:
+    """
+    Metrics and stats shared between serve.py's worker processes
+    
+    Each worker writes its metrics and registered stats to
+    `<directory>/<pid>.json` every `interval` seconds and reads the other
+    workers' files when asked, so /metrics and the stats endpoints answer for
+    the whole server whichever worker a request lands on. The other workers'
+    numbers are up to `interval` seconds old; a worker that stops drops out
+    of the totals, which to Prometheus looks like a counter reset. Without a
+    directory (a single process) there are no peers.
+    """
+    
+    def __init__(self, registry: Registry, directory: str = "", interval: float = 5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.path: Optional[str] = None
+        self.stats: Dict[str, Callable[[], dict]] = {}
+        self.task: Optional[asyncio.Task] = None
+    
+    def add_stats(self, name: str, function: Callable[[], dict]):
+        """Publish `function()` as this worker's stats under `name`"""
+        self.stats[name] = function
+    
+    async def start(self):
+        """Start publishing this worker's numbers (called on app startup)"""
+        if not self.directory or self.task is not None:
+            return
+        # Here rather than at import: each worker process is its own pid
+        self.path = os.path.join(self.directory, f"{os.getpid()}.json")
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+        self.task = asyncio.create_task(self._publish())
+        logger.info("Sharing metrics with the other workers through %s", self.directory)
+    
+    async def stop(self):
+        """Stop publishing and withdraw this worker's numbers (called on app shutdown)"""
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        try:
+            await asyncio.to_thread(os.remove, self.path)
+        except FileNotFoundError:
+            pass
+    
+    async def peers(self) -> List[dict]:
+        """The other live workers' latest snapshots"""
+        if self.task is None:
+            return []
+        return await asyncio.to_thread(self._read_peers)
+    
+    async def render_metrics(self) -> str:
+        """Exposition text summed over every worker"""
+        return self.registry.render([peer["metrics"] for peer in await self.peers()])
+    
+    @staticmethod
+    def combine(peers: Iterable[dict], name: str, own: dict, summed: Iterable[str]) -> dict:
+        """`own` stats with the `summed` counts of every peer's `name` stats added, and the worker count"""
+        stats = dict(own)
+        workers = 1
+        for peer in peers:
+            other = peer["stats"].get(name)
+            if other is None:
+                continue
+            workers += 1
+            for key in summed:
+                stats[key] += other.get(key, 0)
+        stats["workers"] = workers
+        return stats
+    
+    def snapshot(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "time": time.time(),
+            "metrics": self.registry.collect(),
+            "stats": {name: function() for name, function in self.stats.items()}
+        }
+    
+    async def _publish(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._write, self.snapshot())
+            except Exception as e:
+                logger.error("Could not publish worker stats to %s: %s", self.path, e)
+            await asyncio.sleep(self.interval)
+    
+    def _write(self, snapshot: dict):
+        # Written aside and renamed, so readers never see half a file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+    
+    def _read_peers(self) -> List[dict]:
+        peers = []
+        # A worker that died without stopping leaves its file behind
+        stale = time.time() - 3 * self.interval
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json") or entry.path == self.path:
+                continue
+            try:
+                with open(entry.path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot.get("time", 0) >= stale:
+                peers.append(snapshot)
+        return peers
+
+worker_stats = WorkerStats(metrics, WORKER_STATS_DIR, WORKER_STATS_INTERVAL_SECONDS)
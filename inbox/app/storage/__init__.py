@@ -0,0 +1,32 @@
+# inbox/app/storage/__init__.py
+from config import (
+    STORAGE_BACKEND, MONGO_URI, DB_NAME, COLLECTION_NAME, SQLITE_PATH, SQLITE_READ_THREADS,
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS, MONGO_CONNECT_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_MANAGE_INDEXES
+)
+from storage.base import MessageStore, SearchTimeout, SEARCH_MIN_TEXT_LENGTH, STATUS_RANK
+
+def mongo_client_options() -> dict:
+    """Pool size and timeouts for the Motor client, from config (0 = no timeout)"""
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS or None,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS or None,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS or None,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS or None
+    }
+
+def create_store(backend: str = STORAGE_BACKEND) -> MessageStore:
+    """Build the configured storage backend; only its own driver gets imported"""
+    if backend == "mongo":
+        from storage.mongo import MongoStore
+        return MongoStore(MONGO_URI, DB_NAME, COLLECTION_NAME, mongo_client_options(), MONGO_MANAGE_INDEXES)
+    if backend == "sqlite":
+        from storage.sqlite import SQLiteStore
+        return SQLiteStore(SQLITE_PATH, SQLITE_READ_THREADS)
+    if backend == "memory":
+        from storage.memory import MemoryStore
+        return MemoryStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend} (expected mongo, sqlite or memory)")
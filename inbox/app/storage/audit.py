@@ -0,0 +1,223 @@
+# inbox/app/storage/audit.py
+"""
+Query-plan audit for the MongoDB store.
+
+    cd inbox/app && python -m storage.audit
+
+Runs `explain` (queryPlanner verbosity: nothing is executed or written) on
+every query shape MongoStore issues for services/inbox.py, prints each
+winning plan, and flags collection scans (COLLSCAN) and in-memory sorts
+(SORT) that a shape isn't expected to need. Uses MONGO_URI and DB_NAME;
+also lists indexes missing from, or made redundant by, INDEXES. Exits 1
+if anything is flagged.
+"""
+import asyncio
+import sys
+from datetime import datetime
+from typing import List, Set, Tuple
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from storage.mongo import MongoStore, INDEXES, REBUILD_PIPELINE, thread_query, search_query
+from utils.serialize import MESSAGE_PROJECTION
+
+FLAGGED_STAGES = ("COLLSCAN", "SORT")
+
+def query_shapes(store: MongoStore) -> List[Tuple[str, dict, Set[str]]]:
+    """
+    (name, command to explain, stages the shape is expected to have) per query
+    
+    Names are the services/inbox.py function and the store method behind it.
+    Values are placeholders: the plan depends on a query's shape, not on them.
+    """
+    messages = store.messages.name
+    now = datetime.utcnow()
+    position = (now, ObjectId())
+    
+    def find(collection: str, query: dict, projection: dict = None, sort: list = None, limit: int = 0) -> dict:
+        command = {"find": collection, "filter": query}
+        if projection:
+            command["projection"] = projection
+        if sort:
+            command["sort"] = dict(sort)
+        if limit:
+            command["limit"] = limit
+        return command
+    
+    def update(collection: str, query: dict, changes: dict, upsert: bool = False) -> dict:
+        return {"update": collection, "updates": [{"q": query, "u": changes, "upsert": upsert}]}
+    
+    def find_and_modify(collection: str, query: dict, changes: dict, sort: list = None,
+                        upsert: bool = False) -> dict:
+        command = {"findAndModify": collection, "query": query, "update": changes, "upsert": upsert}
+        if sort:
+            command["sort"] = dict(sort)
+        return command
+    
+    shapes = [
+        ("every write: sequence",
+         find_and_modify("counters", {"_id": "changes"}, {"$inc": {"value": 1}}, upsert=True), set()),
+        ("save_*_messages: insert_messages (conversation upsert)",
+         update("conversations", {"_id": "0"}, {"$inc": {"total_messages": 1}}, upsert=True), set()),
+        ("update_message_statuses: apply_statuses (timestamps)",
+         update(messages, {"message_id": "wamid.0"}, {"$set": {"status_timestamps.read": now}}), set()),
+        ("update_message_statuses: apply_statuses (status)",
+         update(messages, {"message_id": "wamid.0", "status": {"$nin": ["read", "failed"]}},
+                {"$set": {"status": "read"}}), set()),
+    ]
+    for label, after, forward in (("newest page", None, False), ("older page", position, False),
+                                  ("newer page", position, True)):
+        query, sort = thread_query("0", after, forward)
+        shapes.append((f"get_messages_by_user: get_thread ({label})",
+                       find(messages, query, MESSAGE_PROJECTION, sort, 51), set()))
+    shapes += [
+        ("get_all_conversations: list_conversations",
+         find("conversations", {}, sort=[("last.timestamp", -1)], limit=50), set()),
+        ("mark_conversation_read: mark_read",
+         find_and_modify("conversations", {"_id": "0"}, {"$set": {"unread_count": 0}}), set()),
+        ("get_changes_since: changes_since (messages)",
+         find(messages, {"seq": {"$gt": 0}}, sort=[("seq", 1)], limit=501), set()),
+        ("get_changes_since: changes_since (conversations)",
+         find("conversations", {"seq": {"$gt": 0}}, sort=[("seq", 1)], limit=501), set()),
+    ]
+    for text, kind in (("hello", "text"), ("h", "word prefix")):
+        for label, filters in (("", {}), (", one user", {"user_id": "0"}),
+                               (", date range", {"timestamp": {"$gte": now, "$lt": now}})):
+            query, projection, sort = search_query(text, filters)
+            # Relevance can only be sorted in memory; the page is bounded by limit
+            expected = {"SORT"} if kind == "text" else set()
+            shapes.append((f"search_messages: search ({kind}{label})",
+                           find(messages, query, projection, sort, 50), expected))
+    shapes += [
+        # A batch job over every message; the sort may use the timestamp index
+        ("rebuild_conversations: rebuild_conversations",
+         {"aggregate": messages, "pipeline": REBUILD_PIPELINE[:-1], "allowDiskUse": True, "cursor": {}},
+         {"COLLSCAN", "SORT"}),
+        ("claim_outgoing_messages: claim_outbound",
+         find_and_modify(messages, {"status": "queued", "next_attempt_at": {"$lte": now}},
+                         {"$set": {"next_attempt_at": now}}, sort=[("next_attempt_at", 1)]), set()),
+        ("renew_send_lease: renew_lease",
+         update(messages, {"_id": ObjectId(), "status": "queued", "next_attempt_at": now},
+                {"$set": {"next_attempt_at": now}}), set()),
+        ("record_send_attempt: record_attempt",
+         update(messages, {"_id": ObjectId(), "status": "queued", "next_attempt_at": now},
+                {"$inc": {"attempts": 1}}), set()),
+        ("get_outgoing_message: get_message",
+         find(messages, {"_id": ObjectId()}, limit=1), set()),
+        ("store_campaign: save_campaign",
+         find_and_modify("campaigns", {"_id": "0"}, {"$set": {"status": "running"}}, upsert=True), set()),
+        ("load_campaign: get_campaign",
+         find("campaigns", {"_id": "0"}, limit=1), set()),
+        ("load_campaigns: list_campaigns",
+         find("campaigns", {}, sort=[("created_at", -1)], limit=100), set()),
+        ("request_campaign_cancel: cancel_campaign",
+         find_and_modify("campaigns", {"_id": "0"}, {"$set": {"cancel_requested": True}}), set()),
+    ]
+    return shapes
+
+def plan_stages(explain: dict) -> List[dict]:
+    """
+    Every stage of the winning plan(s) in an explain result, outermost first
+    
+    Handles classic and slot-based (`queryPlan`) plans, sharded plans and
+    aggregations; a pipeline `$sort` the query layer didn't absorb is
+    reported as a SORT stage.
+    """
+    stages: List[dict] = []
+    
+    def collect(plan: dict):
+        plan = plan.get("queryPlan", plan)
+        if "stage" in plan:
+            stages.append(plan)
+        for key in ("inputStage", "outerStage", "innerStage"):
+            if key in plan:
+                collect(plan[key])
+        for child in plan.get("inputStages", []):
+            collect(child)
+        for shard in plan.get("shards", []):
+            collect(shard.get("winningPlan", {}))
+    
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                # The echoed command has the pipeline's own $sort in it
+                if key in ("rejectedPlans", "command", "originalCommand"):
+                    continue
+                if key == "winningPlan":
+                    collect(value)
+                elif key == "stages" and isinstance(value, list):
+                    for stage in value:
+                        if "$sort" in stage:
+                            stages.append({"stage": "SORT", "pipeline": True})
+                        walk(stage)
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+    
+    walk(explain)
+    return stages
+
+def describe(stages: List[dict]) -> str:
+    parts = []
+    for stage in stages:
+        part = stage["stage"]
+        if stage.get("indexName"):
+            part += f" {stage['indexName']}"
+        elif stage.get("pipeline"):
+            part += " (pipeline)"
+        parts.append(part)
+    return " <- ".join(parts) or "?"
+
+async def audit(store: MongoStore) -> bool:
+    ok = True
+    plans = await store.index_plans()
+    for name, plan in plans.items():
+        collection = store.collection(name).name
+        for index in plan["missing"]:
+            ok = False
+            print(f"✗ {collection}: missing index {index} (python db.py creates it)")
+        for index_name, covering in plan["redundant"].items():
+            ok = False
+            print(f"✗ {collection}: {index_name} is redundant with {covering}")
+        for index_name in plan["conflicts"]:
+            ok = False
+            print(f"✗ {collection}: {index_name} has other options than the spec")
+    if any(plan["missing"] or plan["redundant"] or plan["conflicts"] for plan in plans.values()):
+        print()
+    
+    for name, command, expected in query_shapes(store):
+        try:
+            explain = await store.db.command({"explain": command, "verbosity": "queryPlanner"})
+        except OperationFailure as e:
+            ok = False
+            print(f"✗ {name}\n    explain failed: {e}")
+            continue
+        stages = plan_stages(explain)
+        found = {stage["stage"] for stage in stages if stage["stage"] in FLAGGED_STAGES}
+        unexpected = found - expected
+        mark = "✗" if unexpected else "✓"
+        print(f"{mark} {name}\n    {describe(stages)}")
+        if unexpected:
+            ok = False
+            print(f"    flagged: {', '.join(sorted(unexpected))}")
+        elif found:
+            print(f"    expected: {', '.join(sorted(found))}")
+    return ok
+
+async def main() -> bool:
+    from config import MONGO_URI, DB_NAME, COLLECTION_NAME
+    from storage import mongo_client_options
+    if not MONGO_URI:
+        print("MONGO_URI is not set")
+        return False
+    store = MongoStore(MONGO_URI, DB_NAME, COLLECTION_NAME, mongo_client_options())
+    await store.start()
+    try:
+        print(f"Auditing {DB_NAME} ({sum(len(spec) for spec in INDEXES.values())} indexes in the spec)\n")
+        return await audit(store)
+    finally:
+        await store.close()
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,209 @@
+# inbox/app/storage/base.py
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Outbound lifecycle order: a message's status never moves back down this list
+STATUS_RANK = {"queued": 0, "sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+# Queries shorter than this can't match a full-text index usefully (stemming,
+# stop words), so stores fall back to a case-insensitive word-prefix match
+SEARCH_MIN_TEXT_LENGTH = 3
+
+class SearchTimeout(Exception):
+    """A search ran past the store's time limit; narrower filters may let it finish"""
+
+def later_statuses(status: str) -> List[str]:
+    """Statuses at `status`'s rank or beyond; a message already there is not moved"""
+    return [s for s, rank in STATUS_RANK.items() if rank >= STATUS_RANK[status]]
+
+def summarize_conversations(messages: List[dict]) -> Dict[str, dict]:
+    """
+    Fold a batch of messages into one summary delta per user
+    
+    Each delta holds the newest message (`last`), the newest inbound message
+    (`last_inbound`, the target of a read receipt), per-direction counts and the
+    highest seq. Stores merge deltas into their stored summaries.
+    """
+    per_user: Dict[str, dict] = {}
+    for msg in messages:
+        summary = per_user.setdefault(
+            msg["user_id"], {"last": None, "last_inbound": None, "inbound": 0, "outbound": 0, "seq": 0}
+        )
+        summary[msg["direction"]] += 1
+        summary["seq"] = max(summary["seq"], msg.get("seq", 0))
+        if summary["last"] is None or msg["timestamp"] >= summary["last"]["timestamp"]:
+            summary["last"] = {
+                "timestamp": msg["timestamp"],
+                "body": msg["body"],
+                "direction": msg["direction"]
+            }
+        if msg["direction"] == "inbound" and (
+            summary["last_inbound"] is None or msg["timestamp"] >= summary["last_inbound"]["timestamp"]
+        ):
+            summary["last_inbound"] = {
+                "timestamp": msg["timestamp"],
+                "message_id": msg.get("message_id")
+            }
+    return per_user
+
+class MessageStore(ABC):
+    """
+    Storage backend for the inbox: messages plus per-user conversation summaries
+    
+    Documents go in and come out as dicts shaped like the MongoDB documents the
+    inbox has always used. Every stored message gets an `_id` (the tiebreaker
+    in thread cursors) and a `seq` from the store's global change sequence;
+    conversations come back as {"_id": user_id, "last": {...}, "last_inbound":
+    {...}, "total_messages", "unread_count", "seq", ...}.
+    
+    Caching, coalescing and batching live in services/inbox.py; a store only
+    has to make each call correct on its own.
+    """
+    
+    name = "base"
+    
+    async def start(self):
+        """Open connections / files (called on app startup)"""
+    
+    async def close(self):
+        """Release connections / files (called on app shutdown)"""
+    
+    @abstractmethod
+    def parse_id(self, value: str) -> Any:
+        """Parse the string form of a message `_id`; raises ValueError if it isn't one"""
+    
+    @abstractmethod
+    async def insert_messages(self, messages: List[dict]) -> List[dict]:
+        """
+        Store messages, skipping any whose message_id is already stored
+        
+        Messages without a message_id (e.g. a send Graph answered without
+        one) are never duplicates.
+        
+        Stamps `_id` and `seq` on the stored documents, folds them into their
+        conversation summaries and returns them (duplicates left out).
+        """
+    
+    @abstractmethod
+    async def apply_statuses(self, updates: Dict[str, dict]) -> int:
+        """
+        Apply coalesced status updates: {message_id: {"status", "timestamps"}}
+        
+        Status timestamps are always recorded and bump the message's seq; the
+        status itself only moves forward in STATUS_RANK. Returns the number of
+        documents modified, as the backend counts them.
+        """
+    
+    @abstractmethod
+    async def get_thread(self, user_id: str, limit: int,
+                         position: Optional[Tuple[datetime, Any]] = None,
+                         forward: bool = False) -> List[dict]:
+        """
+        Up to `limit` of a user's messages strictly beyond `position` (timestamp, _id)
+        
+        Newest first, or oldest first when `forward`. Documents carry `_id` plus
+        the MessageOut fields.
+        """
+    
+    @abstractmethod
+    async def list_conversations(self, limit: int) -> List[dict]:
+        """Conversation summaries, most recent message first"""
+    
+    @abstractmethod
+    async def mark_read(self, user_id: str) -> Optional[dict]:
+        """Zero a conversation's unread count; returns the summary as it was, or None"""
+    
+    @abstractmethod
+    async def changes_since(self, since: int, limit: int) -> Tuple[List[dict], List[dict]]:
+        """
+        Up to `limit` messages and up to `limit` conversations with seq > since, in seq order
+        
+        Both sides come from one consistent point: nothing is returned past a
+        sequence number whose write hasn't committed yet, so a reader paging
+        by seq can't step over a change that lands later. A change may show
+        up a moment after its write returns (MongoStore releases sequence
+        numbers in the background).
+        """
+    
+    @abstractmethod
+    async def current_sequence(self) -> int:
+        """The highest seq changes_since can return right now (0 before any write); a change feed starts here"""
+    
+    @abstractmethod
+    async def search(self, query: str, limit: int, offset: int = 0,
+                     user_id: Optional[str] = None, direction: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[dict]:
+        """
+        Messages whose body matches `query`
+        
+        Queries of SEARCH_MIN_TEXT_LENGTH or more use full-text matching, best
+        match first; shorter ones match a word prefix, newest first. A store
+        that bounds a search's time raises SearchTimeout when it runs out,
+        rather than return what it found so far as if it were everything.
+        """
+    
+    @abstractmethod
+    async def rebuild_conversations(self) -> int:
+        """Recompute every conversation summary from the messages; returns how many"""
+    
+    @abstractmethod
+    async def get_message(self, message_key: Any) -> Optional[dict]:
+        """One message by `_id`, or None"""
+    
+    @abstractmethod
+    async def claim_outbound(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        """
+        Lease up to `limit` queued messages that are due (next_attempt_at <= now)
+        
+        Oldest due first. Their next_attempt_at moves to `lease_until`, so no
+        other claim takes them meanwhile; if the claimer dies before recording
+        an outcome, the lease runs out and they are claimed again.
+        """
+    
+    @abstractmethod
+    async def renew_lease(self, message_key: Any, lease: datetime, lease_until: datetime) -> bool:
+        """
+        Extend a claim: move next_attempt_at from `lease` to `lease_until`
+        
+        Only if the message is still queued under `lease`; False once it has
+        been claimed again or recorded since.
+        """
+    
+    @abstractmethod
+    async def record_attempt(self, message_key: Any, lease: datetime, status: str, now: datetime,
+                             message_id: Optional[str] = None, error: Optional[str] = None,
+                             retry_at: Optional[datetime] = None) -> bool:
+        """
+        Record the outcome of one delivery attempt of a claimed message
+        
+        "queued" reschedules it for `retry_at`; "sent" stores the Graph
+        `message_id` (so status callbacks find it); "failed" gives up. Each
+        call counts an attempt and keeps `error` as last_error; sent/failed
+        also record the status timestamp and bump seq. Only a message still
+        queued under the claimant's `lease` is touched, so a worker whose
+        lease ran out can't record over the new claimant; returns whether
+        one was.
+        """
+    
+    @abstractmethod
+    async def save_campaign(self, campaign: dict) -> bool:
+        """
+        Store a campaign's progress document, replacing the one with the same `id`
+        
+        A cancel request stored by cancel_campaign is kept; returns whether
+        there is one, so the worker running the campaign learns of it with
+        its next save.
+        """
+    
+    @abstractmethod
+    async def get_campaign(self, campaign_id: str) -> Optional[dict]:
+        """A campaign's progress document (with `cancel_requested`), or None"""
+    
+    @abstractmethod
+    async def list_campaigns(self, limit: int) -> List[dict]:
+        """Up to `limit` campaign documents, newest `created_at` first"""
+    
+    @abstractmethod
+    async def cancel_campaign(self, campaign_id: str) -> Optional[dict]:
+        """Set a campaign's `cancel_requested`; returns its document, or None if there is none"""
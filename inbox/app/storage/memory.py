@@ -0,0 +1,248 @@
+# inbox/app/storage/memory.py
+import bisect
+import heapq
+import itertools
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from storage.base import (
+    MessageStore,
+    SEARCH_MIN_TEXT_LENGTH,
+    later_statuses,
+    summarize_conversations
+)
+from utils.serialize import MESSAGE_OUT_FIELDS
+
+SYNC_FIELDS = ("seq", "message_id", "user_id", "direction", "body", "timestamp", "status", "media_type")
+
+def project(doc: dict, fields) -> dict:
+    return {field: doc.get(field) for field in fields if field in doc}
+
+def merge_summary(conv: Optional[dict], user_id: str, summary: dict) -> dict:
+    """Apply one summarize_conversations delta to a stored conversation (or start one)"""
+    if conv is None:
+        conv = {
+            "_id": user_id, "user_id": user_id, "last": None, "last_inbound": None,
+            "total_messages": 0, "inbound_count": 0, "outbound_count": 0, "unread_count": 0, "seq": 0
+        }
+    last, last_inbound = summary["last"], summary["last_inbound"]
+    if conv["last"] is None or last["timestamp"] >= conv["last"]["timestamp"]:
+        conv["last"] = dict(last)
+    if last_inbound is not None and (
+        conv["last_inbound"] is None or last_inbound["timestamp"] >= conv["last_inbound"]["timestamp"]
+    ):
+        conv["last_inbound"] = dict(last_inbound)
+    conv["total_messages"] += summary["inbound"] + summary["outbound"]
+    conv["inbound_count"] += summary["inbound"]
+    conv["outbound_count"] += summary["outbound"]
+    conv["unread_count"] += summary["inbound"]
+    conv["seq"] = max(conv["seq"] or 0, summary["seq"])
+    return conv
+
+class MemoryStore(MessageStore):
+    """
+    Process-local store for tests and throwaway runs; nothing survives a restart
+    
+    Every call completes without awaiting, so each one is atomic on the event
+    loop. Threads are kept as sorted (timestamp, _id) keys per user so paging
+    is a bisect; sync and search scan everything.
+    """
+    
+    name = "memory"
+    
+    def __init__(self):
+        self.messages: Dict[int, dict] = {}
+        self.by_message_id: Dict[str, int] = {}
+        self.threads: Dict[str, List[Tuple[datetime, int]]] = {}
+        self.conversations: Dict[str, dict] = {}
+        self.outbox: Dict[int, datetime] = {}
+        self.campaigns: Dict[str, dict] = {}
+        self.ids = itertools.count(1)
+        self.sequence = 0
+    
+    def parse_id(self, value: str) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid id: {value}")
+    
+    def next_sequence(self, count: int = 1) -> int:
+        self.sequence += count
+        return self.sequence - count + 1
+    
+    async def insert_messages(self, messages: List[dict]) -> List[dict]:
+        stored = []
+        for msg in messages:
+            message_id = msg.get("message_id")
+            if message_id is not None and message_id in self.by_message_id:
+                continue
+            msg["_id"] = next(self.ids)
+            msg["seq"] = self.next_sequence()
+            self.messages[msg["_id"]] = dict(msg)
+            if message_id is not None:
+                self.by_message_id[message_id] = msg["_id"]
+            bisect.insort(self.threads.setdefault(msg["user_id"], []), (msg["timestamp"], msg["_id"]))
+            if msg.get("status") == "queued":
+                self.outbox[msg["_id"]] = msg.get("next_attempt_at") or msg["timestamp"]
+            stored.append(msg)
+        
+        for user_id, summary in summarize_conversations(stored).items():
+            self.conversations[user_id] = merge_summary(self.conversations.get(user_id), user_id, summary)
+        return stored
+    
+    async def apply_statuses(self, updates: Dict[str, dict]) -> int:
+        modified = 0
+        for message_id, entry in updates.items():
+            doc = self.messages.get(self.by_message_id.get(message_id))
+            if doc is None:
+                continue
+            doc.setdefault("status_timestamps", {}).update(entry["timestamps"])
+            doc["seq"] = self.next_sequence()
+            modified += 1
+            
+            status = entry["status"]
+            if status is not None and doc.get("status") not in later_statuses(status):
+                doc["status"] = status
+                modified += 1
+        return modified
+    
+    async def get_thread(self, user_id: str, limit: int,
+                         position: Optional[Tuple[datetime, Any]] = None,
+                         forward: bool = False) -> List[dict]:
+        keys = self.threads.get(user_id, [])
+        if forward:
+            start = bisect.bisect_right(keys, position) if position is not None else 0
+            window = keys[start:start + limit]
+        else:
+            end = bisect.bisect_left(keys, position) if position is not None else len(keys)
+            window = keys[max(0, end - limit):end][::-1]
+        return [project(self.messages[_id], ("_id",) + MESSAGE_OUT_FIELDS) for _, _id in window]
+    
+    async def list_conversations(self, limit: int) -> List[dict]:
+        newest = heapq.nlargest(limit, self.conversations.values(), key=lambda conv: conv["last"]["timestamp"])
+        return [dict(conv) for conv in newest]
+    
+    async def mark_read(self, user_id: str) -> Optional[dict]:
+        conv = self.conversations.get(user_id)
+        if conv is None:
+            return None
+        before = dict(conv)
+        conv["unread_count"] = 0
+        conv["seq"] = self.next_sequence()
+        return before
+    
+    async def changes_since(self, since: int, limit: int) -> Tuple[List[dict], List[dict]]:
+        messages = heapq.nsmallest(
+            limit, (doc for doc in self.messages.values() if doc["seq"] > since), key=lambda doc: doc["seq"]
+        )
+        conversations = heapq.nsmallest(
+            limit, (conv for conv in self.conversations.values() if conv["seq"] > since), key=lambda conv: conv["seq"]
+        )
+        return [project(doc, SYNC_FIELDS) for doc in messages], [dict(conv) for conv in conversations]
+    
+    async def current_sequence(self) -> int:
+        return self.sequence
+    
+    async def search(self, query: str, limit: int, offset: int = 0,
+                     user_id: Optional[str] = None, direction: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[dict]:
+        def wanted(doc: dict) -> bool:
+            return (
+                (not user_id or doc["user_id"] == user_id)
+                and (not direction or doc["direction"] == direction)
+                and (not since or doc["timestamp"] >= since)
+                and (not until or doc["timestamp"] < until)
+            )
+        
+        if len(query) >= SEARCH_MIN_TEXT_LENGTH:
+            # Whole-word matches on any term, scored by how many times they occur
+            # (no stemming or stop words, unlike the real text indexes)
+            terms = {term.lower() for term in re.findall(r"\w+", query)}
+            scored = []
+            for doc in self.messages.values():
+                score = sum(word in terms for word in re.findall(r"\w+", doc["body"].lower()))
+                if score and wanted(doc):
+                    scored.append((score, doc["timestamp"], doc))
+            scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+            matches = [doc for _, _, doc in scored]
+        else:
+            pattern = re.compile(r"\b" + re.escape(query), re.IGNORECASE)
+            matches = sorted(
+                (doc for doc in self.messages.values() if pattern.search(doc["body"]) and wanted(doc)),
+                key=lambda doc: doc["timestamp"], reverse=True
+            )
+        return [project(doc, ("_id",) + MESSAGE_OUT_FIELDS) for doc in matches[offset:offset + limit]]
+    
+    async def rebuild_conversations(self) -> int:
+        ordered = sorted(self.messages.values(), key=lambda doc: (doc["timestamp"], doc["_id"]))
+        self.conversations = {}
+        for user_id, summary in summarize_conversations(ordered).items():
+            conv = merge_summary(None, user_id, summary)
+            # Read state isn't stored per message, so a rebuild starts everyone at 0 unread
+            conv["unread_count"] = 0
+            self.conversations[user_id] = conv
+        return len(self.conversations)
+    
+    async def get_message(self, message_key: int) -> Optional[dict]:
+        doc = self.messages.get(message_key)
+        return dict(doc) if doc is not None else None
+    
+    async def claim_outbound(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        due = heapq.nsmallest(limit, ((at, _id) for _id, at in self.outbox.items() if at <= now))
+        claimed = []
+        for _, _id in due:
+            self.outbox[_id] = lease_until
+            doc = self.messages[_id]
+            doc["next_attempt_at"] = lease_until
+            claimed.append(dict(doc))
+        return claimed
+    
+    async def renew_lease(self, message_key: int, lease: datetime, lease_until: datetime) -> bool:
+        if self.outbox.get(message_key) != lease:
+            return False
+        self.outbox[message_key] = self.messages[message_key]["next_attempt_at"] = lease_until
+        return True
+    
+    async def record_attempt(self, message_key: int, lease: datetime, status: str, now: datetime,
+                             message_id: Optional[str] = None, error: Optional[str] = None,
+                             retry_at: Optional[datetime] = None) -> bool:
+        # Only queued messages are in the outbox
+        if self.outbox.get(message_key) != lease:
+            return False
+        doc = self.messages[message_key]
+        doc["attempts"] = doc.get("attempts", 0) + 1
+        doc["last_error"] = error
+        if status == "queued":
+            doc["next_attempt_at"] = self.outbox[message_key] = retry_at
+            return True
+        
+        self.outbox.pop(message_key, None)
+        doc.pop("next_attempt_at", None)
+        doc["status"] = status
+        doc.setdefault("status_timestamps", {})[status] = now
+        if message_id is not None:
+            doc["message_id"] = message_id
+            self.by_message_id[message_id] = message_key
+        doc["seq"] = self.next_sequence()
+        return True
+    
+    async def save_campaign(self, campaign: dict) -> bool:
+        stored = self.campaigns.get(campaign["id"])
+        cancel_requested = stored is not None and stored["cancel_requested"]
+        self.campaigns[campaign["id"]] = {**campaign, "cancel_requested": cancel_requested}
+        return cancel_requested
+    
+    async def get_campaign(self, campaign_id: str) -> Optional[dict]:
+        campaign = self.campaigns.get(campaign_id)
+        return dict(campaign) if campaign is not None else None
+    
+    async def list_campaigns(self, limit: int) -> List[dict]:
+        newest = heapq.nlargest(limit, self.campaigns.values(), key=lambda campaign: campaign["created_at"])
+        return [dict(campaign) for campaign in newest]
+    
+    async def cancel_campaign(self, campaign_id: str) -> Optional[dict]:
+        campaign = self.campaigns.get(campaign_id)
+        if campaign is None:
+            return None
+        campaign["cancel_requested"] = True
+        return dict(campaign)
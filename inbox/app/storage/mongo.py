@@ -0,0 +1,645 @@
+# inbox/app/storage/mongo.py
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, ExecutionTimeout
+from storage.base import MessageStore, SearchTimeout, SEARCH_MIN_TEXT_LENGTH, later_statuses, summarize_conversations
+from utils.serialize import MESSAGE_PROJECTION
+from utils.logger import logger
+
+SYNC_MESSAGE_FIELDS = {
+    "_id": 0, "seq": 1, "message_id": 1, "user_id": 1, "direction": 1,
+    "body": 1, "timestamp": 1, "status": 1, "media_type": 1
+}
+
+# Word-prefix searches can't use the text index, so they're capped by time
+# (and raise SearchTimeout past it)
+SEARCH_PREFIX_MAX_TIME_MS = 2000
+
+# A sequence reservation whose writer died (without releasing it) stops
+# holding /api/sync back after this long; a live writer renews its own
+SEQUENCE_LEASE_SECONDS = 10
+# How long a finished reservation waits to be released by the next one
+SEQUENCE_RELEASE_DELAY = 0.05
+
+# Every index the queries below rely on, by collection ("messages" is the
+# configured collection name). Reconciled by MongoStore.reconcile_indexes();
+# `python -m storage.audit` checks the queries actually use them
+INDEXES: Dict[str, List[dict]] = {
+    "messages": [
+        # Threads and keyset pagination; _id breaks timestamp ties so a page
+        # never needs an in-memory sort. Also serves lookups by user_id alone
+        {"keys": [("user_id", 1), ("timestamp", -1), ("_id", -1)]},
+        # Newest first across all users: prefix search, conversation rebuild
+        {"keys": [("timestamp", 1)]},
+        # Webhook retries and status callbacks; outbound messages get theirs on send
+        {"keys": [("message_id", 1)], "unique": True, "sparse": True},
+        # Outbound queue: only queued messages are indexed, due soonest first
+        {"keys": [("next_attempt_at", 1)], "partialFilterExpression": {"status": "queued"}},
+        # Change sequence for delta sync
+        {"keys": [("seq", 1)], "sparse": True},
+        {"keys": [("body", "text")]}
+    ],
+    "conversations": [
+        {"keys": [("last.timestamp", -1)]},
+        {"keys": [("seq", 1)], "sparse": True}
+    ],
+    "campaigns": [
+        {"keys": [("created_at", -1)]}
+    ]
+}
+
+# Options that make two indexes on the same key different indexes
+INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+def index_key(info: dict) -> List[Tuple[str, Any]]:
+    """
+    An index's key as INDEXES writes it, from a spec entry or index_information()
+    
+    A text index is stored as `_fts`/`_ftsx` plus weights; it comes back as
+    its (field, "text") pairs.
+    """
+    keys = info["keys"] if "keys" in info else info["key"]
+    if any(field == "_fts" for field, _ in keys):
+        return [(field, "text") for field in sorted(info.get("weights", {}))]
+    return [(field, direction if isinstance(direction, str) else int(direction)) for field, direction in keys]
+
+def index_options(info: dict) -> dict:
+    return {name: info[name] for name in INDEX_OPTIONS if info.get(name)}
+
+def covers(key: List[Tuple[str, Any]], other: List[Tuple[str, Any]]) -> bool:
+    """
+    Whether an index on `other` serves every query an index on `key` does
+    
+    True when `key` is a strict prefix of `other`, with the same directions
+    or all of them reversed (an index can be walked backwards).
+    """
+    if len(key) >= len(other) or any(isinstance(d, str) for _, d in key + other):
+        return False
+    prefix = other[:len(key)]
+    if [field for field, _ in key] != [field for field, _ in prefix]:
+        return False
+    same = all(d == p for (_, d), (_, p) in zip(key, prefix))
+    reversed_ = all(d == -p for (_, d), (_, p) in zip(key, prefix))
+    return same or reversed_
+
+def plan_indexes(spec: List[dict], existing: Dict[str, dict]) -> dict:
+    """
+    Compare one collection's spec with its index_information()
+    
+    Returns the spec entries that are `missing`, the ones whose key exists
+    with other options (`conflicts`: existing name -> spec entry, left alone
+    since createIndex would fail), existing indexes the spec doesn't list
+    that a plain index in it makes `redundant` (name -> covering key), and
+    any others as `unmanaged`.
+    """
+    plan: dict = {"missing": [], "conflicts": {}, "redundant": {}, "unmanaged": []}
+    matched = set()
+    for index in spec:
+        key = index_key(index)
+        same_key = [name for name, info in existing.items() if index_key(info) == key]
+        match = [name for name in same_key if index_options(existing[name]) == index_options(index)]
+        if match:
+            matched.add(match[0])
+        elif same_key:
+            plan["conflicts"][same_key[0]] = index
+            matched.add(same_key[0])
+        else:
+            plan["missing"].append(index)
+    
+    # Only a plain index can stand in for another: a sparse or partial one
+    # leaves documents out, and a unique one is there for its constraint
+    plain = [index_key(index) for index in spec if not index_options(index)]
+    for name, info in existing.items():
+        if name == "_id_" or name in matched:
+            continue
+        key = index_key(info)
+        covering = next((other for other in plain if covers(key, other)), None)
+        if covering is not None and not index_options(info):
+            plan["redundant"][name] = covering
+        else:
+            plan["unmanaged"].append(name)
+    return plan
+
+def conversation_updates(messages: List[dict]) -> List[UpdateOne]:
+    """
+    Build one upsert per user for the `conversations` summary collection
+    
+    `last` is an embedded document whose first field is the timestamp, so
+    `$max` on it keeps the newest message atomically even when saves race or
+    arrive out of order.
+    """
+    operations = []
+    for user_id, summary in summarize_conversations(messages).items():
+        update = {
+            "$setOnInsert": {"user_id": user_id},
+            "$max": {"last": summary["last"]},
+            "$inc": {
+                "total_messages": summary["inbound"] + summary["outbound"],
+                "inbound_count": summary["inbound"],
+                "outbound_count": summary["outbound"],
+                "unread_count": summary["inbound"]
+            }
+        }
+        if summary["last_inbound"] is not None:
+            update["$max"]["last_inbound"] = summary["last_inbound"]
+        if summary["seq"]:
+            update["$max"]["seq"] = summary["seq"]
+        operations.append(UpdateOne({"_id": user_id}, update, upsert=True))
+    return operations
+
+def thread_query(user_id: str, position: Optional[Tuple[datetime, Any]] = None,
+                 forward: bool = False) -> Tuple[dict, List[Tuple[str, int]]]:
+    """Filter and sort for a page of a thread, before or after a (timestamp, _id) position"""
+    query: dict = {"user_id": user_id}
+    if position is not None:
+        timestamp, object_id = position
+        op = "$gt" if forward else "$lt"
+        query["$or"] = [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "_id": {op: object_id}}
+        ]
+    direction = 1 if forward else -1
+    return query, [("timestamp", direction), ("_id", direction)]
+
+def search_query(query: str, filters: dict) -> Tuple[dict, dict, list]:
+    """Filter, projection and sort for a search: full text, or word prefix for short queries"""
+    if len(query) >= SEARCH_MIN_TEXT_LENGTH:
+        # `body` text index with relevance ranking
+        return (
+            {"$text": {"$search": query}, **filters},
+            {**MESSAGE_PROJECTION, "score": {"$meta": "textScore"}},
+            [("score", {"$meta": "textScore"}), ("timestamp", -1)]
+        )
+    return (
+        {"body": {"$regex": r"\b" + re.escape(query), "$options": "i"}, **filters},
+        MESSAGE_PROJECTION,
+        [("timestamp", -1)]
+    )
+
+# Conversation summaries recomputed from every message (rebuild_conversations)
+REBUILD_PIPELINE = [
+    {
+        "$sort": {"timestamp": -1}
+    },
+    {
+        "$group": {
+            "_id": "$user_id",
+            "user_id": {"$first": "$user_id"},
+            "last": {
+                "$first": {
+                    "timestamp": "$timestamp",
+                    "body": "$body",
+                    "direction": "$direction"
+                }
+            },
+            "total_messages": {"$sum": 1},
+            "seq": {"$max": "$seq"},
+            "inbound_count": {
+                "$sum": {"$cond": [{"$eq": ["$direction", "inbound"]}, 1, 0]}
+            },
+            "outbound_count": {
+                "$sum": {"$cond": [{"$eq": ["$direction", "outbound"]}, 1, 0]}
+            },
+            "last_inbound": {
+                "$max": {
+                    "$cond": [
+                        {"$eq": ["$direction", "inbound"]},
+                        {"timestamp": "$timestamp", "message_id": "$message_id"},
+                        None
+                    ]
+                }
+            }
+        }
+    },
+    {
+        # Read state isn't stored per message, so a rebuild starts everyone at 0 unread
+        "$set": {"unread_count": 0}
+    },
+    {
+        # Replaces the collection atomically and keeps its indexes
+        "$out": "conversations"
+    }
+]
+
+class MongoStore(MessageStore):
+    """
+    MongoDB via Motor: `messages`, `conversations` and a `counters` collection
+    
+    The client is created in start() so it binds to the running event loop,
+    and each server process gets its own pool; `client_options` are passed
+    to AsyncIOMotorClient (pool size, timeouts). With `manage_indexes`,
+    start() also reconciles the indexes with INDEXES.
+    """
+    
+    name = "mongo"
+    
+    def __init__(self, uri: str, db_name: str, collection_name: str = "messages",
+                 client_options: Optional[Dict[str, Any]] = None, manage_indexes: bool = False):
+        self.uri = uri
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.client_options = client_options or {}
+        self.manage_indexes = manage_indexes
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.db = None
+        # This process's sequence reservations: still being written (first ->
+        # monotonic start) and written but not yet released on the counter
+        self.in_flight: Dict[int, float] = {}
+        self.released: Set[int] = set()
+        self.wake: Optional[asyncio.Event] = None
+        self.keeper: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        if self.client is not None:
+            return
+        self.client = AsyncIOMotorClient(self.uri, **self.client_options)
+        self.db = self.client[self.db_name]
+        self.wake = asyncio.Event()
+        self.keeper = asyncio.create_task(self._keep_leases())
+        logger.info(
+            "MongoDB store using database %s (pool %s-%s connections)", self.db_name,
+            self.client_options.get("minPoolSize", 0), self.client_options.get("maxPoolSize", 100)
+        )
+        if self.manage_indexes:
+            try:
+                await self.reconcile_indexes()
+            except Exception as e:
+                # e.g. a user without createIndex rights: serve anyway, slower
+                logger.error("Could not reconcile MongoDB indexes: %s", e)
+    
+    async def close(self):
+        if self.keeper is not None:
+            self.keeper.cancel()
+            await asyncio.gather(self.keeper, return_exceptions=True)
+            self.keeper = None
+            if self.released:
+                await self._release(list(self.released))
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
+    
+    @property
+    def messages(self):
+        return self.db[self.collection_name]
+    
+    def collection(self, name: str):
+        """A collection by its INDEXES name"""
+        return self.messages if name == "messages" else self.db[name]
+    
+    async def index_plans(self) -> Dict[str, dict]:
+        """plan_indexes() for every collection in INDEXES, without changing anything"""
+        return {
+            name: plan_indexes(spec, await self.collection(name).index_information())
+            for name, spec in INDEXES.items()
+        }
+    
+    async def reconcile_indexes(self, drop_redundant: bool = False) -> Dict[str, dict]:
+        """
+        Create the INDEXES a collection is missing and report the rest of its plan
+        
+        Redundant indexes are only dropped with `drop_redundant`; conflicts
+        and unmanaged indexes are left for a person to look at. Safe to run
+        from several processes at once: creating an index that exists, or is
+        being built, is a no-op. Returns the plans with `created` and
+        `dropped` names added.
+        """
+        plans = await self.index_plans()
+        for name, plan in plans.items():
+            collection = self.collection(name)
+            plan["created"] = []
+            for index in plan["missing"]:
+                options = {k: v for k, v in index.items() if k != "keys"}
+                plan["created"].append(await collection.create_index(index["keys"], **options))
+                logger.info("Created index %s on %s", plan["created"][-1], collection.name)
+            plan["dropped"] = []
+            for index_name, covering in plan["redundant"].items():
+                if drop_redundant:
+                    await collection.drop_index(index_name)
+                    plan["dropped"].append(index_name)
+                    logger.info("Dropped redundant index %s on %s", index_name, collection.name)
+                else:
+                    logger.warning(
+                        "Index %s on %s is redundant with %s; drop it with `python db.py --drop-redundant`",
+                        index_name, collection.name, covering
+                    )
+            for index_name, index in plan["conflicts"].items():
+                logger.warning(
+                    "Index %s on %s has other options than the spec %s; left as it is",
+                    index_name, collection.name, index
+                )
+        return plans
+    
+    def parse_id(self, value: str) -> ObjectId:
+        try:
+            return ObjectId(value)
+        except Exception:
+            raise ValueError(f"Invalid id: {value}")
+    
+    @asynccontextmanager
+    async def sequence(self, count: int = 1) -> AsyncIterator[int]:
+        """
+        Reserve `count` numbers from the global change sequence for one write; yields the first
+        
+        Numbers are handed out before the write commits, and concurrent
+        writers (in this or another process) can commit out of order, so a
+        reader paging by seq could step over one still being written. Each
+        reservation is therefore listed as `pending` on the counter document
+        (in the same update that takes it) until the write is done, and
+        changes_since never returns anything past the lowest pending number.
+        
+        That update is the only round trip a batch pays: finished
+        reservations are dropped from `pending` by this process's next
+        reservation, or by _keep_leases if none comes within
+        SEQUENCE_RELEASE_DELAY. A lease lasts SEQUENCE_LEASE_SECONDS and is
+        renewed while its write runs, so only a dead writer's reservation
+        holds readers back, and not for longer than that.
+        """
+        released = list(self.released)
+        first = await self._reserve(count, released)
+        self.released.difference_update(released)
+        self.in_flight[first] = time.monotonic()
+        try:
+            yield first
+        finally:
+            del self.in_flight[first]
+            self.released.add(first)
+            if self.wake is not None:
+                self.wake.set()
+    
+    async def _reserve(self, count: int, released: List[int]) -> int:
+        now = datetime.utcnow()
+        # An update pipeline, so the lease can hold the number it reserves;
+        # `released` and lapsed leases are dropped on the way
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": "changes"},
+            [
+                {"$set": {"value": {"$add": [{"$ifNull": ["$value", 0]}, count]}}},
+                {"$set": {"pending": {"$concatArrays": [
+                    {"$filter": {
+                        "input": {"$ifNull": ["$pending", []]},
+                        "cond": {"$and": [
+                            {"$gte": ["$$this.expires", now]},
+                            {"$not": [{"$in": ["$$this.first", released]}]}
+                        ]}
+                    }},
+                    [{
+                        "first": {"$subtract": ["$value", count - 1]},
+                        "expires": now + timedelta(seconds=SEQUENCE_LEASE_SECONDS)
+                    }]
+                ]}}}
+            ],
+            projection={"value": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["value"] - count + 1
+    
+    async def _release(self, firsts: List[int]):
+        await self.db.counters.update_one({"_id": "changes"}, {"$pull": {"pending": {"first": {"$in": firsts}}}})
+    
+    async def _renew(self, firsts: List[int]):
+        # Only writes slower than a third of a lease get here, so there are few
+        expires = datetime.utcnow() + timedelta(seconds=SEQUENCE_LEASE_SECONDS)
+        for first in firsts:
+            await self.db.counters.update_one(
+                {"_id": "changes", "pending.first": first},
+                {"$set": {"pending.$.expires": expires}}
+            )
+    
+    async def _keep_leases(self):
+        """Release finished reservations no later one carried off, and renew those still being written"""
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), SEQUENCE_LEASE_SECONDS / 3)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            await asyncio.sleep(SEQUENCE_RELEASE_DELAY)
+            try:
+                released = list(self.released)
+                if released:
+                    await self._release(released)
+                    self.released.difference_update(released)
+                slow_since = time.monotonic() - SEQUENCE_LEASE_SECONDS / 3
+                slow = [first for first, started in self.in_flight.items() if started < slow_since]
+                if slow:
+                    await self._renew(slow)
+            except Exception as e:
+                logger.error("Could not release or renew change sequence leases: %s", e)
+    
+    async def insert_messages(self, messages: List[dict]) -> List[dict]:
+        if not messages:
+            return []
+        async with self.sequence(len(messages)) as first:
+            for offset, doc in enumerate(messages):
+                doc["seq"] = first + offset
+                # The unique message_id index is sparse: it skips a missing
+                # field but not a null one, and a second null would be
+                # rejected as a duplicate
+                if "message_id" in doc and doc["message_id"] is None:
+                    del doc["message_id"]
+            
+            try:
+                await self.messages.insert_many(messages, ordered=False)
+                stored = messages
+            except BulkWriteError as e:
+                # ordered=False keeps going past duplicates (webhook retries hit the
+                # unique message_id index), so only non-duplicate errors are real failures
+                errors = e.details.get("writeErrors", [])
+                failed = [err for err in errors if err.get("code") != 11000]
+                if failed:
+                    logger.error("Error saving %d messages: %s", len(failed), failed[0].get("errmsg"))
+                rejected = {err["index"] for err in errors}
+                stored = [msg for i, msg in enumerate(messages) if i not in rejected]
+            
+            if stored:
+                try:
+                    await self.db.conversations.bulk_write(conversation_updates(stored), ordered=False)
+                except Exception as e:
+                    logger.error("Error updating conversations: %s", e)
+        return stored
+    
+    async def apply_statuses(self, updates: Dict[str, dict]) -> int:
+        if not updates:
+            return 0
+        async with self.sequence(len(updates)) as seq:
+            return await self._apply_statuses(updates, seq)
+    
+    async def _apply_statuses(self, updates: Dict[str, dict], seq: int) -> int:
+        operations = []
+        for message_id, entry in updates.items():
+            # Timestamps are always recorded, even for a status that arrives late
+            changes = {f"status_timestamps.{status}": ts for status, ts in entry["timestamps"].items()}
+            changes["seq"] = seq
+            seq += 1
+            operations.append(UpdateOne({"message_id": message_id}, {"$set": changes}))
+            
+            status = entry["status"]
+            if status is None:
+                continue
+            # Only move forward: skip documents already at this rank or beyond
+            operations.append(UpdateOne(
+                {"message_id": message_id, "status": {"$nin": later_statuses(status)}},
+                {"$set": {"status": status}}
+            ))
+        
+        result = await self.messages.bulk_write(operations, ordered=False)
+        return result.modified_count
+    
+    async def get_thread(self, user_id: str, limit: int,
+                         position: Optional[Tuple[datetime, Any]] = None,
+                         forward: bool = False) -> List[dict]:
+        # A range scan on the (user_id, timestamp, _id) index; _id comes back
+        # too because it's half of the page cursor
+        query, sort = thread_query(user_id, position, forward)
+        cursor = self.messages.find(query, MESSAGE_PROJECTION).sort(sort).limit(limit)
+        return await cursor.to_list(length=limit)
+    
+    async def list_conversations(self, limit: int) -> List[dict]:
+        # Served from the summary collection via the last.timestamp index
+        cursor = self.db.conversations.find({}).sort("last.timestamp", -1).limit(limit)
+        return await cursor.to_list(length=limit)
+    
+    async def mark_read(self, user_id: str) -> Optional[dict]:
+        async with self.sequence() as seq:
+            return await self.db.conversations.find_one_and_update(
+                {"_id": user_id},
+                {"$set": {"unread_count": 0, "seq": seq}},
+                projection={"unread_count": 1, "last_inbound": 1}
+            )
+    
+    async def current_sequence(self) -> int:
+        # Read first: a number taken after this is above `value`, and one
+        # taken before is either pending here or already committed
+        counter = await self.db.counters.find_one({"_id": "changes"})
+        if counter is None:
+            return 0
+        now = datetime.utcnow()
+        pending = [lease["first"] for lease in counter.get("pending", []) if lease["expires"] >= now]
+        return min(pending) - 1 if pending else counter["value"]
+    
+    async def changes_since(self, since: int, limit: int) -> Tuple[List[dict], List[dict]]:
+        visible = await self.current_sequence()
+        if not visible:
+            return [], []
+        query = {"seq": {"$gt": since, "$lte": visible}}
+        messages = await self.messages.find(
+            query, SYNC_MESSAGE_FIELDS
+        ).sort("seq", 1).limit(limit).to_list(length=limit)
+        conversations = await self.db.conversations.find(
+            query
+        ).sort("seq", 1).limit(limit).to_list(length=limit)
+        return messages, conversations
+    
+    async def search(self, query: str, limit: int, offset: int = 0,
+                     user_id: Optional[str] = None, direction: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[dict]:
+        filters: dict = {}
+        if user_id:
+            filters["user_id"] = user_id
+        if direction:
+            filters["direction"] = direction
+        if since or until:
+            filters["timestamp"] = {}
+            if since:
+                filters["timestamp"]["$gte"] = since
+            if until:
+                filters["timestamp"]["$lt"] = until
+        
+        find, projection, sort = search_query(query, filters)
+        cursor = self.messages.find(find, projection).sort(sort)
+        if len(query) < SEARCH_MIN_TEXT_LENGTH:
+            cursor = cursor.max_time_ms(SEARCH_PREFIX_MAX_TIME_MS)
+        try:
+            return await cursor.skip(offset).limit(limit).to_list(length=limit)
+        except ExecutionTimeout as e:
+            raise SearchTimeout(f"Search for {query!r} ran past {SEARCH_PREFIX_MAX_TIME_MS} ms") from e
+    
+    async def rebuild_conversations(self) -> int:
+        await self.messages.aggregate(REBUILD_PIPELINE, allowDiskUse=True).to_list(length=None)
+        return await self.db.conversations.count_documents({})
+    
+    async def get_message(self, message_key: ObjectId) -> Optional[dict]:
+        return await self.messages.find_one({"_id": message_key})
+    
+    async def claim_outbound(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        # One find_one_and_update per message: each claim is atomic on its own,
+        # so concurrent workers (or processes) never lease the same message
+        claimed = []
+        for _ in range(limit):
+            doc = await self.messages.find_one_and_update(
+                {"status": "queued", "next_attempt_at": {"$lte": now}},
+                {"$set": {"next_attempt_at": lease_until}},
+                sort=[("next_attempt_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                break
+            claimed.append(doc)
+        return claimed
+    
+    async def renew_lease(self, message_key: ObjectId, lease: datetime, lease_until: datetime) -> bool:
+        result = await self.messages.update_one(
+            {"_id": message_key, "status": "queued", "next_attempt_at": lease},
+            {"$set": {"next_attempt_at": lease_until}}
+        )
+        return result.modified_count == 1
+    
+    async def record_attempt(self, message_key: ObjectId, lease: datetime, status: str, now: datetime,
+                             message_id: Optional[str] = None, error: Optional[str] = None,
+                             retry_at: Optional[datetime] = None) -> bool:
+        claimed = {"_id": message_key, "status": "queued", "next_attempt_at": lease}
+        update: dict = {"$inc": {"attempts": 1}, "$set": {"last_error": error}}
+        if status == "queued":
+            update["$set"]["next_attempt_at"] = retry_at
+            result = await self.messages.update_one(claimed, update)
+            return result.modified_count == 1
+        
+        update["$set"].update({"status": status, f"status_timestamps.{status}": now})
+        update["$unset"] = {"next_attempt_at": ""}
+        if message_id is not None:
+            update["$set"]["message_id"] = message_id
+        async with self.sequence() as seq:
+            update["$set"]["seq"] = seq
+            result = await self.messages.update_one(claimed, update)
+        return result.modified_count == 1
+    
+    async def save_campaign(self, campaign: dict) -> bool:
+        # Keyed by the campaign id; cancel_requested is only ever set by cancel_campaign
+        stored = await self.db.campaigns.find_one_and_update(
+            {"_id": campaign["id"]},
+            {"$set": campaign},
+            projection={"cancel_requested": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return bool(stored.get("cancel_requested"))
+    
+    async def get_campaign(self, campaign_id: str) -> Optional[dict]:
+        campaign = await self.db.campaigns.find_one({"_id": campaign_id}, {"_id": 0})
+        if campaign is not None:
+            campaign.setdefault("cancel_requested", False)
+        return campaign
+    
+    async def list_campaigns(self, limit: int) -> List[dict]:
+        cursor = self.db.campaigns.find({}, {"_id": 0}).sort("created_at", -1).limit(limit)
+        campaigns = await cursor.to_list(length=limit)
+        for campaign in campaigns:
+            campaign.setdefault("cancel_requested", False)
+        return campaigns
+    
+    async def cancel_campaign(self, campaign_id: str) -> Optional[dict]:
+        return await self.db.campaigns.find_one_and_update(
+            {"_id": campaign_id},
+            {"$set": {"cancel_requested": True}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
@@ -0,0 +1,595 @@
+# inbox/app/storage/sqlite.py
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from storage.base import MessageStore, SEARCH_MIN_TEXT_LENGTH, later_statuses, summarize_conversations
+from utils.logger import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id TEXT UNIQUE,
+    user_id TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    body TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL,
+    status TEXT,
+    media_url TEXT,
+    media_type TEXT,
+    status_timestamps TEXT NOT NULL DEFAULT '{}',
+    extra TEXT,
+    seq INTEGER,
+    next_attempt_at TEXT,
+    attempts INTEGER,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_thread ON messages (user_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS messages_seq ON messages (seq);
+-- Outbound queue: only queued rows are indexed, so it stays as small as the backlog
+CREATE INDEX IF NOT EXISTS messages_outbox ON messages (next_attempt_at) WHERE status = 'queued';
+
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id TEXT PRIMARY KEY,
+    last_timestamp TEXT NOT NULL,
+    last_body TEXT,
+    last_direction TEXT,
+    last_inbound_timestamp TEXT,
+    last_inbound_message_id TEXT,
+    total_messages INTEGER NOT NULL DEFAULT 0,
+    inbound_count INTEGER NOT NULL DEFAULT 0,
+    outbound_count INTEGER NOT NULL DEFAULT 0,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER
+);
+CREATE INDEX IF NOT EXISTS conversations_last ON conversations (last_timestamp);
+CREATE INDEX IF NOT EXISTS conversations_seq ON conversations (seq);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+-- Campaign progress, as JSON documents (see MessageStore.save_campaign)
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS campaigns_created ON campaigns (created_at);
+
+-- Full-text index over message bodies, kept in step by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    body, content='messages', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, body) VALUES (new.id, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF body ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, body) VALUES ('delete', old.id, old.body);
+    INSERT INTO messages_fts (rowid, body) VALUES (new.id, new.body);
+END;
+"""
+
+MESSAGE_COLUMNS = (
+    "message_id", "user_id", "direction", "body", "timestamp", "status", "media_url", "media_type",
+    "next_attempt_at", "attempts", "last_error"
+)
+
+# Columns added after the first release; databases created before get them on open
+ADDED_COLUMNS = {"next_attempt_at": "TEXT", "attempts": "INTEGER", "last_error": "TEXT"}
+
+INSERT_MESSAGE = f"""
+INSERT INTO messages ({", ".join(MESSAGE_COLUMNS)}, extra, seq)
+VALUES ({", ".join("?" * (len(MESSAGE_COLUMNS) + 2))})
+ON CONFLICT (message_id) DO NOTHING
+"""
+
+# Same merge as the MongoDB `$max`/`$inc` upsert: the newer `last` wins, counts add up.
+# SET expressions all see the row as it was before the update.
+UPSERT_CONVERSATION = """
+INSERT INTO conversations (
+    user_id, last_timestamp, last_body, last_direction,
+    last_inbound_timestamp, last_inbound_message_id,
+    total_messages, inbound_count, outbound_count, unread_count, seq
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    last_timestamp = MAX(last_timestamp, excluded.last_timestamp),
+    last_body = CASE WHEN excluded.last_timestamp >= last_timestamp THEN excluded.last_body ELSE last_body END,
+    last_direction = CASE WHEN excluded.last_timestamp >= last_timestamp THEN excluded.last_direction ELSE last_direction END,
+    last_inbound_timestamp = CASE
+        WHEN excluded.last_inbound_timestamp >= IFNULL(last_inbound_timestamp, '')
+        THEN excluded.last_inbound_timestamp ELSE last_inbound_timestamp END,
+    last_inbound_message_id = CASE
+        WHEN excluded.last_inbound_timestamp >= IFNULL(last_inbound_timestamp, '')
+        THEN excluded.last_inbound_message_id ELSE last_inbound_message_id END,
+    total_messages = total_messages + excluded.total_messages,
+    inbound_count = inbound_count + excluded.inbound_count,
+    outbound_count = outbound_count + excluded.outbound_count,
+    unread_count = unread_count + excluded.unread_count,
+    seq = MAX(IFNULL(seq, 0), excluded.seq)
+"""
+
+REBUILD_CONVERSATIONS = """
+INSERT INTO conversations (
+    user_id, last_timestamp, last_body, last_direction,
+    last_inbound_timestamp, last_inbound_message_id,
+    total_messages, inbound_count, outbound_count, unread_count, seq
+)
+SELECT
+    user_id,
+    MAX(CASE WHEN newest = 1 THEN timestamp END),
+    MAX(CASE WHEN newest = 1 THEN body END),
+    MAX(CASE WHEN newest = 1 THEN direction END),
+    MAX(CASE WHEN direction = 'inbound' AND newest_in_direction = 1 THEN timestamp END),
+    MAX(CASE WHEN direction = 'inbound' AND newest_in_direction = 1 THEN message_id END),
+    COUNT(*),
+    SUM(direction = 'inbound'),
+    SUM(direction = 'outbound'),
+    0,
+    MAX(seq)
+FROM (
+    SELECT user_id, timestamp, body, direction, message_id, seq,
+           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp DESC, id DESC) AS newest,
+           ROW_NUMBER() OVER (PARTITION BY user_id, direction ORDER BY timestamp DESC, id DESC) AS newest_in_direction
+    FROM messages
+)
+GROUP BY user_id
+"""
+
+THREAD_FIELDS = "id, user_id, direction, body, timestamp, status, message_id, media_url, media_type"
+OUTBOX_FIELDS = "id, user_id, direction, body, timestamp, status, message_id, attempts, last_error, next_attempt_at"
+
+# The status literal (not a parameter) lets SQLite use the partial messages_outbox index
+CLAIM_OUTBOUND = f"""
+UPDATE messages SET next_attempt_at = ?
+WHERE id IN (
+    SELECT id FROM messages WHERE status = 'queued' AND next_attempt_at <= ?
+    ORDER BY next_attempt_at LIMIT ?
+)
+RETURNING {OUTBOX_FIELDS}
+"""
+SYNC_FIELDS = "seq, message_id, user_id, direction, body, timestamp, status, media_type"
+# Timestamps in a campaign document, stored as to_text() strings
+CAMPAIGN_TIMES = ("created_at", "finished_at", "updated_at")
+
+def to_text(value: datetime) -> str:
+    """
+    Fixed-width UTC text for a timestamp, so string order is time order
+    
+    Aware datetimes are converted to naive UTC, the way MongoDB stores them.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+@lru_cache(maxsize=256)
+def _compile(pattern: str):
+    return re.compile(pattern, re.IGNORECASE)
+
+def _regexp(pattern: str, value: Optional[str]) -> bool:
+    return value is not None and _compile(pattern).search(value) is not None
+
+def message_doc(row: sqlite3.Row) -> dict:
+    doc = dict(row)
+    if "id" in doc:
+        doc["_id"] = doc.pop("id")
+    doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
+    if doc.get("next_attempt_at") is not None:
+        doc["next_attempt_at"] = datetime.fromisoformat(doc["next_attempt_at"])
+    return doc
+
+def conversation_doc(row: sqlite3.Row) -> dict:
+    conv = {
+        "_id": row["user_id"],
+        "user_id": row["user_id"],
+        "last": {
+            "timestamp": datetime.fromisoformat(row["last_timestamp"]),
+            "body": row["last_body"],
+            "direction": row["last_direction"]
+        },
+        "last_inbound": None,
+        "total_messages": row["total_messages"],
+        "inbound_count": row["inbound_count"],
+        "outbound_count": row["outbound_count"],
+        "unread_count": row["unread_count"],
+        "seq": row["seq"]
+    }
+    if row["last_inbound_timestamp"] is not None:
+        conv["last_inbound"] = {
+            "timestamp": datetime.fromisoformat(row["last_inbound_timestamp"]),
+            "message_id": row["last_inbound_message_id"]
+        }
+    return conv
+
+def campaign_doc(row: sqlite3.Row) -> dict:
+    campaign = json.loads(row["doc"])
+    for field in CAMPAIGN_TIMES:
+        if campaign.get(field) is not None:
+            campaign[field] = datetime.fromisoformat(campaign[field])
+    campaign["cancel_requested"] = bool(row["cancel_requested"])
+    return campaign
+
+class SQLiteStore(MessageStore):
+    """
+    Embedded SQLite database in WAL mode, for single-node deployments and test rigs
+    
+    Writes go through one connection owned by a single worker thread, so they
+    are serialized and the event loop never waits on a commit. Each write
+    (messages + summaries + change sequence) is one transaction.
+    
+    Reads (thread pages, conversation list, sync, search) run on a pool of
+    `readers` threads, each with its own read-only connection: WAL lets them
+    proceed alongside a write and each other, and a slow read, like a search
+    that scans, never holds up the event loop. Search uses an FTS5 index
+    with porter stemming, ranked by bm25.
+    """
+    
+    name = "sqlite"
+    
+    def __init__(self, path: str, readers: int = 4):
+        self.path = path
+        self.readers = readers
+        self.conn: Optional[sqlite3.Connection] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.read_executor: Optional[ThreadPoolExecutor] = None
+        self.local = threading.local()
+        self.reader_connections: List[sqlite3.Connection] = []
+    
+    async def _run(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+    
+    async def _read(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.read_executor, fn, *args)
+    
+    @property
+    def reader(self) -> sqlite3.Connection:
+        """The calling reader thread's read-only connection, opened on first use"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # Only ever used by this thread; close() shuts it from another
+            conn = self.local.conn = self._connect(check_same_thread=False)
+            conn.execute("PRAGMA query_only=1")
+            self.reader_connections.append(conn)
+        return conn
+    
+    async def start(self):
+        if self.executor is not None:
+            return
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+        self.read_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="sqlite-reader")
+        await self._run(self._open)
+        logger.info("SQLite store at %s (%d reader threads)", self.path, self.readers)
+    
+    async def close(self):
+        if self.executor is None:
+            return
+        self.read_executor.shutdown(wait=True)
+        for conn in self.reader_connections:
+            conn.close()
+        self.reader_connections.clear()
+        await self._run(self.conn.close)
+        self.executor.shutdown(wait=True)
+        self.executor = None
+        self.read_executor = None
+        self.conn = None
+    
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=check_same_thread)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.create_function("regexp", 2, _regexp, deterministic=True)
+        return conn
+    
+    def _open(self):
+        self.conn = self._connect()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent at NORMAL; only the last commits
+        # before a power loss can be lost
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(messages)")}
+        if columns:
+            for column, declaration in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE messages ADD COLUMN {column} {declaration}")
+        self.conn.executescript(SCHEMA)
+    
+    def parse_id(self, value: str) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid id: {value}")
+    
+    def _next_sequence(self, count: int = 1) -> int:
+        """Reserve `count` change sequence numbers inside the caller's transaction"""
+        row = self.conn.execute(
+            "INSERT INTO counters (name, value) VALUES ('changes', ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value RETURNING value",
+            (count,)
+        ).fetchone()
+        return row["value"] - count + 1
+    
+    def _insert(self, messages: List[dict]) -> List[dict]:
+        stored = []
+        with self.conn:
+            seq = self._next_sequence(len(messages))
+            for msg in messages:
+                extra = {k: v for k, v in msg.items() if k not in MESSAGE_COLUMNS and k not in ("_id", "seq")}
+                values = [msg.get(column) for column in MESSAGE_COLUMNS]
+                values = [to_text(value) if isinstance(value, datetime) else value for value in values]
+                cursor = self.conn.execute(
+                    INSERT_MESSAGE,
+                    (*values, json.dumps(extra, default=str) if extra else None, seq)
+                )
+                if cursor.rowcount:
+                    msg["_id"] = cursor.lastrowid
+                    msg["seq"] = seq
+                    stored.append(msg)
+                seq += 1
+            
+            for user_id, summary in summarize_conversations(stored).items():
+                last, last_inbound = summary["last"], summary["last_inbound"] or {}
+                self.conn.execute(UPSERT_CONVERSATION, (
+                    user_id, to_text(last["timestamp"]), last["body"], last["direction"],
+                    to_text(last_inbound["timestamp"]) if last_inbound else None,
+                    last_inbound.get("message_id"),
+                    summary["inbound"] + summary["outbound"], summary["inbound"], summary["outbound"],
+                    summary["inbound"], summary["seq"]
+                ))
+        return stored
+    
+    async def insert_messages(self, messages: List[dict]) -> List[dict]:
+        if not messages:
+            return []
+        return await self._run(self._insert, messages)
+    
+    def _apply_statuses(self, updates: Dict[str, dict]) -> int:
+        modified = 0
+        with self.conn:
+            seq = self._next_sequence(len(updates))
+            for message_id, entry in updates.items():
+                # Timestamps are always recorded, even for a status that arrives late
+                timestamps = {status: to_text(ts) for status, ts in entry["timestamps"].items()}
+                modified += self.conn.execute(
+                    "UPDATE messages SET status_timestamps = json_patch(status_timestamps, ?), seq = ? "
+                    "WHERE message_id = ?",
+                    (json.dumps(timestamps), seq, message_id)
+                ).rowcount
+                seq += 1
+                
+                status = entry["status"]
+                if status is None:
+                    continue
+                # Only move forward: skip rows already at this rank or beyond
+                later = later_statuses(status)
+                modified += self.conn.execute(
+                    f"UPDATE messages SET status = ? WHERE message_id = ? "
+                    f"AND (status IS NULL OR status NOT IN ({', '.join('?' * len(later))}))",
+                    (status, message_id, *later)
+                ).rowcount
+        return modified
+    
+    async def apply_statuses(self, updates: Dict[str, dict]) -> int:
+        if not updates:
+            return 0
+        return await self._run(self._apply_statuses, updates)
+    
+    def _get_thread(self, user_id: str, limit: int, position: Optional[Tuple[datetime, Any]],
+                    forward: bool) -> List[dict]:
+        sql = f"SELECT {THREAD_FIELDS} FROM messages WHERE user_id = ?"
+        params: list = [user_id]
+        if position is not None:
+            op = ">" if forward else "<"
+            timestamp = to_text(position[0])
+            sql += f" AND (timestamp {op} ? OR (timestamp = ? AND id {op} ?))"
+            params += [timestamp, timestamp, position[1]]
+        order = "ASC" if forward else "DESC"
+        sql += f" ORDER BY timestamp {order}, id {order} LIMIT ?"
+        params.append(limit)
+        return [message_doc(row) for row in self.reader.execute(sql, params)]
+    
+    async def get_thread(self, user_id: str, limit: int,
+                         position: Optional[Tuple[datetime, Any]] = None,
+                         forward: bool = False) -> List[dict]:
+        return await self._read(self._get_thread, user_id, limit, position, forward)
+    
+    def _list_conversations(self, limit: int) -> List[dict]:
+        rows = self.reader.execute(
+            "SELECT * FROM conversations ORDER BY last_timestamp DESC LIMIT ?", (limit,)
+        )
+        return [conversation_doc(row) for row in rows]
+    
+    async def list_conversations(self, limit: int) -> List[dict]:
+        return await self._read(self._list_conversations, limit)
+    
+    def _mark_read(self, user_id: str) -> Optional[dict]:
+        with self.conn:
+            row = self.conn.execute("SELECT * FROM conversations WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE conversations SET unread_count = 0, seq = ? WHERE user_id = ?",
+                (self._next_sequence(), user_id)
+            )
+        return conversation_doc(row)
+    
+    async def mark_read(self, user_id: str) -> Optional[dict]:
+        return await self._run(self._mark_read, user_id)
+    
+    def _changes_since(self, since: int, limit: int) -> Tuple[List[dict], List[dict]]:
+        # One snapshot for both: a commit between the two reads could put a
+        # conversation's seq past messages the first read didn't see
+        self.reader.execute("BEGIN")
+        try:
+            messages = self.reader.execute(
+                f"SELECT {SYNC_FIELDS} FROM messages WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit)
+            ).fetchall()
+            conversations = self.reader.execute(
+                "SELECT * FROM conversations WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit)
+            ).fetchall()
+        finally:
+            self.reader.execute("COMMIT")
+        return [message_doc(row) for row in messages], [conversation_doc(row) for row in conversations]
+    
+    async def changes_since(self, since: int, limit: int) -> Tuple[List[dict], List[dict]]:
+        return await self._read(self._changes_since, since, limit)
+    
+    def _current_sequence(self) -> int:
+        # The counter moves in the same transaction as the rows it stamps
+        row = self.reader.execute("SELECT value FROM counters WHERE name = 'changes'").fetchone()
+        return row["value"] if row is not None else 0
+    
+    async def current_sequence(self) -> int:
+        return await self._read(self._current_sequence)
+    
+    def _search(self, query: str, limit: int, offset: int, user_id: Optional[str], direction: Optional[str],
+                since: Optional[datetime], until: Optional[datetime]) -> List[dict]:
+        filters, params = [], []
+        if user_id:
+            filters.append("m.user_id = ?")
+            params.append(user_id)
+        if direction:
+            filters.append("m.direction = ?")
+            params.append(direction)
+        if since:
+            filters.append("m.timestamp >= ?")
+            params.append(to_text(since))
+        if until:
+            filters.append("m.timestamp < ?")
+            params.append(to_text(until))
+        fields = ", ".join(f"m.{field}" for field in THREAD_FIELDS.split(", "))
+        
+        if len(query) >= SEARCH_MIN_TEXT_LENGTH:
+            # Any of the words, like MongoDB's $text; each is quoted so FTS5
+            # syntax in user input is matched literally
+            terms = re.findall(r"\w+", query)
+            if not terms:
+                return []
+            match = " OR ".join(f'"{term}"' for term in terms)
+            sql = (
+                f"SELECT {fields} FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                f"WHERE messages_fts MATCH ?{''.join(' AND ' + f for f in filters)} "
+                f"ORDER BY bm25(messages_fts), m.timestamp DESC LIMIT ? OFFSET ?"
+            )
+            params = [match, *params]
+        else:
+            sql = (
+                f"SELECT {fields} FROM messages m WHERE m.body REGEXP ?{''.join(' AND ' + f for f in filters)} "
+                f"ORDER BY m.timestamp DESC LIMIT ? OFFSET ?"
+            )
+            params = [r"\b" + re.escape(query), *params]
+        params += [limit, offset]
+        return [message_doc(row) for row in self.reader.execute(sql, params)]
+    
+    async def search(self, query: str, limit: int, offset: int = 0,
+                     user_id: Optional[str] = None, direction: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[dict]:
+        return await self._read(self._search, query, limit, offset, user_id, direction, since, until)
+    
+    def _rebuild_conversations(self) -> int:
+        with self.conn:
+            # Read state isn't stored per message, so a rebuild starts everyone at 0 unread
+            self.conn.execute("DELETE FROM conversations")
+            self.conn.execute(REBUILD_CONVERSATIONS)
+        return self.conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+    
+    async def rebuild_conversations(self) -> int:
+        return await self._run(self._rebuild_conversations)
+    
+    def _get_message(self, message_key: int) -> Optional[dict]:
+        row = self.reader.execute(f"SELECT {OUTBOX_FIELDS} FROM messages WHERE id = ?", (message_key,)).fetchone()
+        return message_doc(row) if row is not None else None
+    
+    async def get_message(self, message_key: int) -> Optional[dict]:
+        return await self._read(self._get_message, message_key)
+    
+    def _claim_outbound(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        with self.conn:
+            rows = self.conn.execute(CLAIM_OUTBOUND, (to_text(lease_until), to_text(now), limit)).fetchall()
+        return [message_doc(row) for row in rows]
+    
+    async def claim_outbound(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        return await self._run(self._claim_outbound, limit, now, lease_until)
+    
+    def _renew_lease(self, message_key: int, lease: datetime, lease_until: datetime) -> bool:
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE messages SET next_attempt_at = ? WHERE id = ? AND status = 'queued' AND next_attempt_at = ?",
+                (to_text(lease_until), message_key, to_text(lease))
+            ).rowcount == 1
+    
+    async def renew_lease(self, message_key: int, lease: datetime, lease_until: datetime) -> bool:
+        return await self._run(self._renew_lease, message_key, lease, lease_until)
+    
+    def _record_attempt(self, message_key: int, lease: datetime, status: str, now: datetime,
+                        message_id: Optional[str], error: Optional[str], retry_at: Optional[datetime]) -> bool:
+        with self.conn:
+            if status == "queued":
+                return self.conn.execute(
+                    "UPDATE messages SET attempts = IFNULL(attempts, 0) + 1, last_error = ?, next_attempt_at = ? "
+                    "WHERE id = ? AND status = 'queued' AND next_attempt_at = ?",
+                    (error, to_text(retry_at), message_key, to_text(lease))
+                ).rowcount == 1
+            return self.conn.execute(
+                "UPDATE messages SET attempts = IFNULL(attempts, 0) + 1, last_error = ?, next_attempt_at = NULL, "
+                "status = ?, message_id = IFNULL(?, message_id), "
+                "status_timestamps = json_patch(status_timestamps, ?), seq = ? "
+                "WHERE id = ? AND status = 'queued' AND next_attempt_at = ?",
+                (error, status, message_id, json.dumps({status: to_text(now)}), self._next_sequence(),
+                 message_key, to_text(lease))
+            ).rowcount == 1
+    
+    async def record_attempt(self, message_key: int, lease: datetime, status: str, now: datetime,
+                             message_id: Optional[str] = None, error: Optional[str] = None,
+                             retry_at: Optional[datetime] = None) -> bool:
+        return await self._run(self._record_attempt, message_key, lease, status, now, message_id, error, retry_at)
+    
+    def _save_campaign(self, campaign: dict) -> bool:
+        doc = json.dumps(campaign, default=lambda value: to_text(value) if isinstance(value, datetime) else str(value))
+        with self.conn:
+            row = self.conn.execute(
+                "INSERT INTO campaigns (id, created_at, doc) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET doc = excluded.doc RETURNING cancel_requested",
+                (campaign["id"], to_text(campaign["created_at"]), doc)
+            ).fetchone()
+        return bool(row["cancel_requested"])
+    
+    async def save_campaign(self, campaign: dict) -> bool:
+        return await self._run(self._save_campaign, campaign)
+    
+    def _get_campaign(self, campaign_id: str) -> Optional[dict]:
+        row = self.reader.execute("SELECT doc, cancel_requested FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+        return campaign_doc(row) if row is not None else None
+    
+    async def get_campaign(self, campaign_id: str) -> Optional[dict]:
+        return await self._read(self._get_campaign, campaign_id)
+    
+    def _list_campaigns(self, limit: int) -> List[dict]:
+        rows = self.reader.execute(
+            "SELECT doc, cancel_requested FROM campaigns ORDER BY created_at DESC LIMIT ?", (limit,)
+        )
+        return [campaign_doc(row) for row in rows]
+    
+    async def list_campaigns(self, limit: int) -> List[dict]:
+        return await self._read(self._list_campaigns, limit)
+    
+    def _cancel_campaign(self, campaign_id: str) -> Optional[dict]:
+        with self.conn:
+            row = self.conn.execute(
+                "UPDATE campaigns SET cancel_requested = 1 WHERE id = ? RETURNING doc, cancel_requested",
+                (campaign_id,)
+            ).fetchone()
+        return campaign_doc(row) if row is not None else None
+    
+    async def cancel_campaign(self, campaign_id: str) -> Optional[dict]:
+        return await self._run(self._cancel_campaign, campaign_id)
@@ -0,0 +1,119 @@
+# inbox/app/utils/cache.py
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Set
+
+class LRUCache:
+    """
+    In-process LRU cache with a TTL and tag-based invalidation
+    
+    Entries are bounded by count; the least recently used entry is evicted
+    first and anything older than `ttl` seconds is treated as a miss. Each entry
+    carries tags (e.g. a user_id) so a write can drop exactly the entries it
+    affects without scanning the cache. Tag versions, which keep a slow load
+    from caching what a write replaced, only exist while a load carrying the
+    tag is running, so they are bounded by concurrent loads, not by every
+    tag ever invalidated.
+    """
+    
+    def __init__(self, max_entries: int = 1000, ttl: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.tags: Dict[Hashable, Set[Hashable]] = {}
+        self.versions: Dict[Hashable, int] = {}
+        self.loading: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    
+    def set(self, key: Hashable, value: Any, tags: Iterable[Hashable] = ()):
+        if key in self.entries:
+            self._remove(key)
+        tags = tuple(tags)
+        self.entries[key] = (value, time.monotonic() + self.ttl, tags)
+        for tag in tags:
+            self.tags.setdefault(tag, set()).add(key)
+        
+        while len(self.entries) > self.max_entries:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+    
+    def invalidate(self, *tags: Hashable):
+        """Drop every entry carrying any of `tags`"""
+        for tag in tags:
+            if tag in self.loading:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+            for key in list(self.tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+    
+    async def get_or_load(self, key: Hashable, tags: Iterable[Hashable],
+                          loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Read-through: return the cached value or await `loader` and cache it
+        
+        The result isn't cached if one of its tags was invalidated while the
+        loader was running, so a slow read can't resurrect stale data.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        
+        tags = tuple(tags)
+        for tag in tags:
+            self.loading[tag] = self.loading.get(tag, 0) + 1
+        versions = [self.versions.get(tag, 0) for tag in tags]
+        try:
+            value = await loader()
+            fresh = versions == [self.versions.get(tag, 0) for tag in tags]
+        finally:
+            for tag in tags:
+                self.loading[tag] -= 1
+                if not self.loading[tag]:
+                    del self.loading[tag]
+                    self.versions.pop(tag, None)
+        if fresh:
+            self.set(key, value, tags)
+        return value
+    
+    def clear(self):
+        self.entries.clear()
+        self.tags.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+    
+    def _remove(self, key: Hashable):
+        _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+_MISSING = object()
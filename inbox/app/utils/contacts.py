@@ -0,0 +1,239 @@
+# inbox/app/utils/contacts.py
+"""
+Contact list preflight, shared by the app and message_sender.py
+
+Nothing here imports other app modules, so the bulk sender script can use
+it as `app.utils.contacts` and the app as `utils.contacts`.
+"""
+import sqlite3
+import string
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Separators people put in phone numbers beyond spaces, dashes and "+"
+PHONE_SEPARATORS = str.maketrans("", "", "().\t\r\n/\xa0")
+# E.164: at most 15 digits including the country code
+PHONE_MIN_DIGITS = 7
+PHONE_MAX_DIGITS = 15
+
+# Problem samples kept per kind in a preflight report
+REPORT_SAMPLES = 10
+
+def normalize_phone(raw: Optional[str], default_country: Optional[str] = None) -> Optional[str]:
+    """
+    Normalize a phone number to E.164 digits without the "+" (the Graph API `to` format)
+    
+    Separators and a leading "+" or "00" are dropped. With `default_country`
+    (e.g. "91"), a national number written with a trunk "0" gets that
+    country code; anything else is taken to start with its country code
+    already. Returns None if what's left isn't 7-15 ASCII digits.
+    """
+    if not raw:
+        return None
+    # Cheapest checks first: most lists are clean digits, the rest mostly
+    # only spaces, dashes and "+" (str.replace is much faster than translate)
+    phone = raw
+    if not phone.isdigit():
+        phone = phone.replace(" ", "").replace("-", "").replace("+", "")
+        if not phone.isdigit():
+            phone = phone.translate(PHONE_SEPARATORS)
+    if phone[:1] == "0":
+        if phone[:2] == "00":
+            phone = phone[2:]
+        elif default_country:
+            phone = default_country + phone.lstrip("0")
+    if (PHONE_MIN_DIGITS <= len(phone) <= PHONE_MAX_DIGITS and phone.isdigit()
+            and phone.isascii() and phone[0] != "0"):
+        return phone
+    return None
+
+class RecipientSet:
+    """
+    Exact set of normalized phone numbers with bounded memory
+    
+    Numbers are held as ints in a Python set until there are `max_in_memory`
+    of them; past that the set moves into a private temporary SQLite
+    database (deleted on close) whose page cache is capped at `cache_kib`.
+    """
+    
+    def __init__(self, max_in_memory: int = 1_000_000, cache_kib: int = 16 * 1024):
+        self.max_in_memory = max_in_memory
+        self.cache_kib = cache_kib
+        self.numbers = set()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.count = 0
+    
+    def add(self, phone: str) -> bool:
+        """Record a normalized number; returns False if it was already there"""
+        number = int(phone)
+        if self.conn is None:
+            if number in self.numbers:
+                return False
+            self.numbers.add(number)
+            self.count += 1
+            if self.count > self.max_in_memory:
+                self._spill()
+            return True
+        
+        cursor = self.conn.execute("INSERT OR IGNORE INTO numbers VALUES (?)", (number,))
+        if cursor.rowcount:
+            self.count += 1
+            return True
+        return False
+    
+    def _spill(self):
+        # An empty filename is a private on-disk temp database
+        self.conn = sqlite3.connect("", isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute(f"PRAGMA cache_size = -{self.cache_kib}")
+        self.conn.execute("CREATE TABLE numbers (n INTEGER PRIMARY KEY)")
+        self.conn.execute("BEGIN")
+        self.conn.executemany("INSERT INTO numbers VALUES (?)", ((n,) for n in sorted(self.numbers)))
+        self.numbers = set()
+    
+    @property
+    def spilled(self) -> bool:
+        return self.conn is not None
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.numbers = set()
+
+def template_fields(template: str) -> List[str]:
+    """
+    Top-level names a str.format template uses, in order of first use
+    
+    Raises ValueError for malformed templates and for positional fields
+    ({} or {0}), which a CSV row can't fill.
+    """
+    fields = []
+    pending = [template]
+    while pending:
+        for _, field, spec, _ in string.Formatter().parse(pending.pop()):
+            if field is None:
+                continue
+            name = field.split(".", 1)[0].split("[", 1)[0]
+            if not name or name.isdigit():
+                raise ValueError(f"Template uses a positional field {{{field}}}; name it after a CSV column")
+            if name not in fields:
+                fields.append(name)
+            if spec:
+                # Nested fields, e.g. {name:>{width}}
+                pending.append(spec)
+    return fields
+
+class Preflight:
+    """
+    Check a contact list row by row before anything is sent
+    
+    The template is parsed once and its placeholders checked against the
+    CSV header; a placeholder with no column, or a header with no `phone`
+    column, raises ValueError straight away. `check` then normalizes a
+    row's phone, renders the message, drops repeats of a number already
+    seen and tallies what it found; `report` summarizes the tallies.
+    
+    Run it over the whole file for a report before any API call, then
+    through a fresh instance again while sending: it is deterministic, so
+    both passes keep the same rows.
+    """
+    
+    def __init__(self, template: str, header: Iterable[str], default_country: Optional[str] = None,
+                 max_in_memory: int = 1_000_000):
+        self.template = template
+        self.header = list(header)
+        self.default_country = default_country
+        if "phone" not in self.header:
+            raise ValueError(f"Contact file needs a 'phone' column (found: {', '.join(self.header) or 'none'})")
+        self.fields = template_fields(template)
+        unknown = [field for field in self.fields if field not in self.header]
+        if unknown:
+            raise ValueError(
+                f"Template placeholders with no CSV column: {', '.join(unknown)} "
+                f"(columns: {', '.join(self.header)})"
+            )
+        
+        self.recipients = RecipientSet(max_in_memory)
+        self.rows = 0
+        self.sendable = 0
+        self.problems: Dict[str, int] = {
+            "missing_phone": 0, "invalid_phone": 0, "duplicate": 0, "template_error": 0
+        }
+        self.samples: Dict[str, list] = {kind: [] for kind in self.problems}
+        self.empty_fields: Dict[str, int] = {field: 0 for field in self.fields}
+        self.started = time.monotonic()
+    
+    def check(self, row_number: int, row: Dict[str, Optional[str]]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        Returns (phone, message, None) for a row to send, or (phone, None, problem)
+        with problem one of missing_phone, invalid_phone, duplicate, template_error
+        """
+        self.rows += 1
+        raw = (row.get("phone") or "").strip()
+        if not raw:
+            return self._problem("missing_phone", row_number, None)
+        phone = normalize_phone(raw, self.default_country)
+        if phone is None:
+            return self._problem("invalid_phone", row_number, raw)
+        if None in row.values():
+            # A short CSV row has None for its missing columns
+            row = {k: v if v is not None else "" for k, v in row.items()}
+        try:
+            message = self.template.format_map(row)
+        except (KeyError, IndexError, AttributeError, ValueError) as e:
+            return self._problem("template_error", row_number, phone, f"{type(e).__name__}: {e}")
+        if not self.recipients.add(phone):
+            return self._problem("duplicate", row_number, phone)
+        
+        for field in self.fields:
+            if not row.get(field):
+                self.empty_fields[field] += 1
+        self.sendable += 1
+        return phone, message, None
+    
+    def _problem(self, kind: str, row_number: int, value: Optional[str], error: Optional[str] = None):
+        self.problems[kind] += 1
+        if len(self.samples[kind]) < REPORT_SAMPLES:
+            self.samples[kind].append({"row": row_number, "value": value, "error": error})
+        return value, None, kind
+    
+    def report(self) -> dict:
+        return {
+            "rows": self.rows,
+            "sendable": self.sendable,
+            **self.problems,
+            "placeholders": self.fields,
+            "empty_fields": {field: count for field, count in self.empty_fields.items() if count},
+            "samples": {kind: samples for kind, samples in self.samples.items() if samples},
+            "dedupe_spilled": self.recipients.spilled,
+            "seconds": round(time.monotonic() - self.started, 3)
+        }
+    
+    def close(self):
+        self.recipients.close()
+
+def format_report(report: dict) -> str:
+    """Human-readable preflight report for the command line"""
+    lines = [
+        f"Rows:            {report['rows']}",
+        f"Will send:       {report['sendable']}",
+        f"Missing phone:   {report['missing_phone']}",
+        f"Invalid phone:   {report['invalid_phone']}",
+        f"Duplicates:      {report['duplicate']}",
+        f"Template errors: {report['template_error']}",
+        f"Placeholders:    {', '.join(report['placeholders']) or 'none'}",
+    ]
+    for field, count in report["empty_fields"].items():
+        lines.append(f"  {count} rows have an empty '{field}'")
+    for kind, samples in report["samples"].items():
+        lines.append(f"{kind} (first {len(samples)}):")
+        for sample in samples:
+            detail = f" ({sample['error']})" if sample["error"] else ""
+            lines.append(f"  row {sample['row']}: {sample['value']}{detail}")
+    lines.append(f"Checked in {report['seconds']}s")
+    return "\n".join(lines)
@@ -0,0 +1,47 @@
+# inbox/app/utils/dedup.py
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+class RecentIds:
+    """
+    Bounded set of recently seen ids with a TTL
+    
+    Holds at most `max_size` ids, dropping the oldest first; an id seen more
+    than `ttl` seconds ago counts as new again.
+    """
+    
+    def __init__(self, max_size: int = 50000, ttl: float = 86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ids: "OrderedDict[Hashable, float]" = OrderedDict()
+        self.checked = 0
+        self.suppressed = 0
+    
+    def seen(self, key: Hashable) -> bool:
+        """Record `key`; returns True if it was already recorded within the TTL"""
+        now = time.monotonic()
+        self.checked += 1
+        
+        expires = self.ids.get(key)
+        if expires is not None and expires > now:
+            self.suppressed += 1
+            return True
+        
+        self.ids[key] = now + self.ttl
+        self.ids.move_to_end(key)
+        while len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+        return False
+    
+    def forget(self, key: Hashable):
+        """Un-record `key`, so its next delivery counts as new (e.g. its write failed)"""
+        self.ids.pop(key, None)
+    
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self.ids),
+            "max_size": self.max_size,
+            "checked": self.checked,
+            "suppressed": self.suppressed
+        }
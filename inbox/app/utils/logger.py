@@ -1,38 +1,113 @@
 # inbox/app/utils/logger.py
+import atexit
+import json
 import logging
+import queue
+import random
 import sys
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from config import (
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_FILE,
+    LOG_QUEUE,
+    LOG_PAYLOADS,
+    LOG_PAYLOAD_MAX_CHARS,
+    LOG_PAYLOAD_SAMPLE_RATE
+)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Queue records without formatting them first
+    
+    The stock QueueHandler renders the message in the calling thread; passing
+    the record through untouched leaves %-style formatting to the listener
+    thread as well. Don't log arguments you mutate right afterwards.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class TruncatedPayload:
+    """Renders a payload as JSON cut to `limit` chars, only when actually logged"""
+    
+    def __init__(self, payload, limit: int):
+        self.payload = payload
+        self.limit = limit
+    
+    def __str__(self) -> str:
+        text = json.dumps(self.payload, ensure_ascii=False, default=str)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... (+{len(text) - self.limit} chars)"
+
+def log_payload(logger: logging.Logger, label: str, payload):
+    """Log a request payload per LOG_PAYLOADS: off, truncate, or sample (truncated)"""
+    if LOG_PAYLOADS == "off" or not logger.isEnabledFor(logging.INFO):
+        return
+    if LOG_PAYLOADS == "sample" and random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    logger.info("%s: %s", label, TruncatedPayload(payload, LOG_PAYLOAD_MAX_CHARS))
 
 def setup_logger(name: str = "whatsapp_inbox") -> logging.Logger:
     """Configure and return logger instance"""
     
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
     
     # Avoid duplicate handlers
     if logger.handlers:
         return logger
     
+    # Formatter
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+    
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
+    console_handler.setLevel(LOG_LEVEL)
+    console_handler.setFormatter(formatter)
+    handlers = [console_handler]
     
     # File handler
-    log_filename = f"inbox_{datetime.now().strftime('%Y%m%d')}.log"
-    file_handler = logging.FileHandler(log_filename, encoding="utf-8")
-    file_handler.setLevel(logging.DEBUG)
-    
-    # Formatter
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    console_handler.setFormatter(formatter)
-    file_handler.setFormatter(formatter)
+    if LOG_FILE:
+        log_filename = datetime.now().strftime(LOG_FILE)
+        file_handler = logging.FileHandler(log_filename, encoding="utf-8")
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
     
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    if LOG_QUEUE:
+        # Request handlers only enqueue; a background thread formats and writes
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        logger.addHandler(DeferredQueueHandler(log_queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
     
     return logger
 
 # Create default logger
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
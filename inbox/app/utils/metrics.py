@@ -0,0 +1,326 @@
+# inbox/app/utils/metrics.py
+import bisect
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; covers a cached read (~100µs) up to a Graph API timeout
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Timer:
+    """Context manager observing elapsed seconds into a histogram child"""
+    
+    __slots__ = ("child", "started")
+    
+    def __init__(self, child: "HistogramChild"):
+        self.child = child
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+class CounterChild:
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def time(self) -> Timer:
+        return Timer(self)
+
+class Metric:
+    """
+    A named metric family with fixed label names
+    
+    `labels(*values)` returns the child for one label combination (created on
+    first use and kept); callers on hot paths can hold on to the child.
+    """
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+    
+    def new_child(self):
+        raise NotImplementedError
+    
+    def labels(self, *values: str):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self.children[values] = self.new_child()
+        return child
+    
+    def collect(self) -> Dict[Tuple[str, ...], object]:
+        """Current value per label combination, as plain (JSON-able) data"""
+        raise NotImplementedError
+    
+    def merge(self, value, other):
+        """Combine two workers' values for one label combination"""
+        raise NotImplementedError
+    
+    def samples(self, data: Dict[Tuple[str, ...], object]) -> List[str]:
+        raise NotImplementedError
+    
+    def render(self, peers: Iterable[list] = ()) -> str:
+        """Exposition text; `peers` are other workers' `collect()`s of this family, added in"""
+        data = self.collect()
+        for peer in peers:
+            for values, value in peer:
+                values = tuple(values)
+                data[values] = self.merge(data[values], value) if values in data else value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples(data))
+        return "\n".join(lines)
+
+class Counter(Metric):
+    kind = "counter"
+    
+    def new_child(self) -> CounterChild:
+        return CounterChild()
+    
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+    
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        return {values: child.value for values, child in list(self.children.items())}
+    
+    def merge(self, value: float, other: float) -> float:
+        return value + other
+    
+    def samples(self, data: Dict[Tuple[str, ...], float]) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, values)} {format_value(value)}"
+            for values, value in data.items()
+        ]
+
+class Gauge(Metric):
+    """Read at scrape time from callbacks, so keeping it current costs nothing"""
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), aggregate: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        # How workers' values combine: "sum" for what each holds, "max" for a shared resource
+        self.aggregate = aggregate
+    
+    def set_function(self, function: Callable[[], float], *values: str):
+        self.children[values] = function
+    
+    def collect(self) -> Dict[Tuple[str, ...], float]:
+        return {values: function() for values, function in list(self.children.items())}
+    
+    def merge(self, value: float, other: float) -> float:
+        return max(value, other) if self.aggregate == "max" else value + other
+    
+    def samples(self, data: Dict[Tuple[str, ...], float]) -> List[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, values)} {format_value(value)}"
+            for values, value in data.items()
+        ]
+
+class Histogram(Metric):
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+    
+    def observe(self, value: float):
+        self.labels().observe(value)
+    
+    def time(self, *values: str) -> Timer:
+        return Timer(self.labels(*values))
+    
+    def collect(self) -> Dict[Tuple[str, ...], list]:
+        # [bucket counts, sum, count]
+        return {values: [list(child.counts), child.sum, child.count] for values, child in list(self.children.items())}
+    
+    def merge(self, value: list, other: list) -> list:
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1], value[2] + other[2]]
+    
+    def samples(self, data: Dict[Tuple[str, ...], list]) -> List[str]:
+        lines = []
+        for values, (counts, total, count) in data.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Registry:
+    """
+    Process-local metrics in the Prometheus text exposition format
+    
+    Everything is updated from the event loop thread, so there are no locks:
+    an observation is a dict lookup, a bisect and a few additions. With
+    several worker processes each one keeps its own numbers; services/workers.py
+    passes the others' `collect()`s to `render` so any worker can answer for all.
+    """
+    
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+    
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+              aggregate: str = "sum") -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, aggregate))
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+    
+    def collect(self) -> Dict[str, list]:
+        """Every family's values as JSON-able [[label values, value], ...] lists"""
+        return {
+            name: [[list(values), value] for values, value in metric.collect().items()]
+            for name, metric in self.metrics.items()
+        }
+    
+    def render(self, peers: Sequence[Dict[str, list]] = ()) -> str:
+        """Exposition text for this process, plus other workers' `collect()`s if given"""
+        return "\n".join(
+            metric.render(peer.get(name, ()) for peer in peers) for name, metric in self.metrics.items()
+        ) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette appends the charset
+
+metrics = Registry()
+
+# Shared families, defined here so modules don't register them twice
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+HTTP_REQUESTS = metrics.counter(
+    "http_requests_total", "HTTP responses by route template and status code", ("method", "route", "status")
+)
+DB_OPERATION_SECONDS = metrics.histogram(
+    "inbox_db_operation_seconds", "Storage call latency by services/inbox.py operation", ("operation",)
+)
+GRAPH_API_SECONDS = metrics.histogram(
+    "whatsapp_api_request_seconds", "Graph API request latency (excluding the concurrency wait)", ("operation",)
+)
+GRAPH_API_RESPONSES = metrics.counter(
+    "whatsapp_api_responses_total", "Graph API responses by HTTP status (\"error\" when no response)",
+    ("operation", "status")
+)
+WEBHOOK_QUEUE_DEPTH = metrics.gauge(
+    "webhook_queue_depth", "Items waiting in a webhook batch writer's queue", ("writer",)
+)
+WEBHOOK_BATCH_SIZE = metrics.histogram(
+    "webhook_batch_size", "Items per batch flushed by a webhook batch writer", ("writer",), SIZE_BUCKETS
+)
+WEBHOOK_FLUSH_SECONDS = metrics.histogram(
+    "webhook_flush_seconds", "Time to flush one batch", ("writer",)
+)
+OUTBOX_ATTEMPTS = metrics.counter(
+    "outbox_attempts_total", "Outbound delivery attempts by outcome (sent, retry, failed)", ("outcome",)
+)
+MEDIA_FETCHES = metrics.counter(
+    "media_fetches_total", "Media cache lookups by outcome (cached, deduplicated, downloaded, failed)", ("outcome",)
+)
+MEDIA_CACHE_BYTES = metrics.gauge(
+    "media_cache_bytes", "Bytes of media files held in the local cache", aggregate="max"
+)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency per route template
+    
+    Requests are labelled with the matched route's path ("/api/conversations/{user_id}"),
+    never the raw path, so the number of series stays fixed; anything that
+    didn't match a route is "unmatched". For streaming responses the latency is
+    the lifetime of the stream.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.routes: Dict[Callable, str] = {}
+    
+    def route_for(self, scope: dict) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self.routes.get(endpoint)
+        if route is None:
+            for candidate in getattr(scope.get("app"), "routes", ()):
+                if getattr(candidate, "endpoint", None) is not None:
+                    self.routes[candidate.endpoint] = candidate.path
+            route = self.routes.setdefault(endpoint, getattr(endpoint, "__name__", "unknown"))
+        return route
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = "500"
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            method, route = scope["method"], self.route_for(scope)
+            HTTP_REQUEST_SECONDS.labels(method, route).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, status).inc()
@@ -0,0 +1,68 @@
+# inbox/app/utils/ratelimit.py
+"""
+Graph API rate limiting, shared by the app and message_sender.py
+
+Nothing here imports other app modules, so the bulk sender script can use
+it as `app.utils.ratelimit` and the app as `utils.ratelimit`.
+"""
+import asyncio
+import time
+
+# Graph API error codes that mean "slow down", not "this message is bad"
+# (4: app rate limit, 80007: WABA rate limit, 130429: throughput limit,
+#  131048: spam rate limit, 131056: pair rate limit)
+THROTTLE_ERROR_CODES = {4, 80007, 130429, 131048, 131056}
+
+def is_throttled(status_code: int, body) -> bool:
+    """Whether a Graph API response (status and decoded JSON body) is a rate limit"""
+    error = body.get("error", {}) if isinstance(body, dict) else {}
+    return status_code == 429 or error.get("code") in THROTTLE_ERROR_CODES
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, bursting up to `capacity`
+    
+    A throttling response pauses every waiter and halves the rate, and each
+    success creeps it back up.
+    """
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.max_rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self):
+        """Wait until a token is available and take it (FIFO across waiters)"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def throttle(self, pause_seconds: float):
+        """Back off after a rate-limit response: pause everyone and halve the rate"""
+        self._refill()
+        self.paused_until = max(self.paused_until, time.monotonic() + pause_seconds)
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        self.tokens = 0
+    
+    def recover(self):
+        """Creep back towards the configured rate after a successful send"""
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
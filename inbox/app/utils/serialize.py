@@ -0,0 +1,16 @@
+# inbox/app/utils/serialize.py
+from typing import Iterable, List
+
+# Fields of schemas.MessageOut. Reads that only feed MessageOut project to
+# these, and routes encode them straight to JSON without a pydantic pass.
+MESSAGE_OUT_FIELDS = (
+    "user_id", "direction", "body", "timestamp", "status", "message_id", "media_url", "media_type"
+)
+MESSAGE_PROJECTION = {field: 1 for field in MESSAGE_OUT_FIELDS}
+
+def message_out(doc: dict) -> dict:
+    """Shape a (projected) message document exactly like schemas.MessageOut"""
+    return {field: doc.get(field) for field in MESSAGE_OUT_FIELDS}
+
+def messages_out(docs: Iterable[dict]) -> List[dict]:
+    return [message_out(doc) for doc in docs]
@@ -0,0 +1,159 @@
+# inbox/benchmarks/campaign.py
+"""
+Offline campaign benchmark: message_sender's bulk send path against the fake
+Graph API in benchmarks/fake_graph.py.
+
+    cd inbox && python benchmarks/campaign.py [--contacts 2000] [--rate 200] [--in-flight 20]
+    cd inbox && python benchmarks/campaign.py --latency lognormal:80,0.4 --max-rps 150 --failure-rate 0.01
+    cd inbox && python benchmarks/campaign.py --compare benchmarks/results/<earlier>.json
+
+The fake runs as a separate process on a free local port, so its latency
+and rate limiting don't share the sender's event loop. Reports throughput,
+outcomes, how many requests the server saw (attempts - contacts = retries),
+how many of them were throttled (429) or failed (5xx), and per-message
+latency including retries and backoff. Results are saved as JSON with the
+git commit, like benchmarks/load.py.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+
+from load import HERE, ROOT, free_port, git_commit, percentile, start_fake_graph
+
+ACCESS_TOKEN = "fake-token"
+PHONE_NUMBER_ID = "106540352242922"
+
+def contacts(count: int, seed: int) -> List[Dict]:
+    rng = random.Random(seed)
+    return [{"name": f"Customer {i}", "phone": f"+91 {rng.randrange(10**9, 10**10)}"} for i in range(count)]
+
+def run(args, base_url: str) -> dict:
+    from message_sender import WhatsAppBulkSender
+    
+    class TimedSender(WhatsAppBulkSender):
+        """Records how long each message took end to end, retries included"""
+        
+        def __init__(self, *a, **kw):
+            super().__init__(*a, **kw)
+            self.latencies: List[float] = []
+        
+        async def send_message_async(self, *a, **kw):
+            started = time.perf_counter()
+            try:
+                return await super().send_message_async(*a, **kw)
+            finally:
+                self.latencies.append(time.perf_counter() - started)
+    
+    sender = TimedSender(
+        ACCESS_TOKEN, PHONE_NUMBER_ID, messages_per_second=args.rate,
+        max_in_flight=args.in_flight, max_retries=args.max_retries, api_base_url=base_url
+    )
+    httpx.post(f"{base_url}/stats/reset")
+    started = time.perf_counter()
+    sender.send_bulk_messages(contacts(args.contacts, args.seed), "Hello {name}, your order has shipped.")
+    elapsed = time.perf_counter() - started
+    server = httpx.get(f"{base_url}/stats").json()
+    
+    by_status = server["by_status"]
+    ordered = sorted(sender.latencies)
+    return {
+        "contacts": args.contacts,
+        "seconds": round(elapsed, 4),
+        "sent_per_sec": round(sender.success_count / elapsed, 1) if elapsed else 0.0,
+        "sent": sender.success_count,
+        "failed": sender.failed_count,
+        "attempts": server["requests"],
+        "retries": server["requests"] - args.contacts,
+        "throttled": by_status.get("429", 0),
+        "server_errors": sum(count for status, count in by_status.items() if status.startswith("5")),
+        "max_in_flight": server["max_in_flight"],
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0
+    }
+
+def print_report(stats: dict, previous: dict = None):
+    width = max(len(key) for key in stats) + 2
+    before = (previous or {}).get("campaign", {})
+    for key, value in stats.items():
+        line = f"{key:<{width}}{value:>12}"
+        if before.get(key):
+            line += f"   {(value - before[key]) / before[key]:+.1%} vs {previous.get('commit', '?')}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--contacts", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=200.0, help="sender messages/sec")
+    parser.add_argument("--in-flight", type=int, default=20, help="sender concurrent requests")
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--latency", default="lognormal:80,0.4", help="fake Graph latency spec (ms)")
+    parser.add_argument("--throttle-rate", type=float, default=0.01, help="share of requests the fake answers 429")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="fake's requests/sec cap (0: no cap)")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds on the fake's 429s")
+    parser.add_argument("--failure-rate", type=float, default=0.005, help="share of requests the fake answers 500")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="results file (default benchmarks/results/campaign-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+    
+    port = free_port()
+    options = [
+        "--latency", args.latency, "--throttle-rate", str(args.throttle_rate), "--max-rps", str(args.max_rps),
+        "--failure-rate", str(args.failure_rate), "--seed", str(args.seed)
+    ]
+    if args.retry_after is not None:
+        options += ["--retry-after", str(args.retry_after)]
+    server = start_fake_graph(port, options)
+    
+    # message_sender writes failed_messages_*.json into the working directory
+    cwd = os.getcwd()
+    directory = tempfile.TemporaryDirectory(prefix="inbox-campaign-")
+    os.chdir(directory.name)
+    sys.path.insert(0, ROOT)
+    try:
+        import message_sender  # noqa: F401 (configures logging on import)
+        logging.getLogger().setLevel(args.log_level)
+        stats = run(args, f"http://127.0.0.1:{port}")
+    finally:
+        os.chdir(cwd)
+        directory.cleanup()
+        server.terminate()
+        server.wait()
+    
+    report = {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "campaign": stats
+    }
+    
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(stats, previous)
+    
+    output = args.output or os.path.join(
+        HERE, "results", f"campaign-{report['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# inbox/benchmarks/fake_graph.py
+"""
+Fake WhatsApp Cloud (Graph) API for offline send benchmarks.
+
+    cd inbox && python benchmarks/fake_graph.py --port 9000 --latency lognormal:80,0.4 \\
+        --throttle-rate 0.01 --max-rps 200 --failure-rate 0.005
+
+Then point the senders at it:
+    WHATSAPP_API_BASE_URL=http://127.0.0.1:9000
+
+POST /{version}/{phone_number_id}/messages answers like Graph does: a
+`messages` id for sends, {"success": true} for read receipts, and Graph's
+error bodies for bad tokens/payloads, rate limits (HTTP 429, code 130429)
+and server failures (HTTP 500, code 131000). GET /stats returns counters;
+POST /stats/reset clears them.
+
+GET /{version}/{media_id} answers a media lookup with a download URL on
+the fake itself, served as `--media-bytes` bytes derived from the part of
+the id before the first "-" (so "cat-1" and "cat-2" are the same file,
+like forwarded media).
+
+Latency specs (milliseconds): fixed:MS, uniform:LOW,HIGH, normal:MEAN,SD,
+lognormal:MEDIAN,SIGMA, exponential:MEAN.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import math
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Turn a latency spec into a sampler returning seconds"""
+    kind, _, args = spec.partition(":")
+    try:
+        values = [float(v) for v in args.split(",")] if args else []
+        ms = [v / 1000 for v in values]
+        if kind == "fixed" and len(values) == 1:
+            return lambda rng: ms[0]
+        if kind == "uniform" and len(values) == 2:
+            return lambda rng: rng.uniform(ms[0], ms[1])
+        if kind == "normal" and len(values) == 2:
+            return lambda rng: max(0.0, rng.gauss(ms[0], ms[1]))
+        if kind == "lognormal" and len(values) == 2 and values[0] > 0:
+            # MEDIAN is in ms, SIGMA is the (unitless) spread of the log
+            return lambda rng: rng.lognormvariate(math.log(ms[0]), values[1])
+        if kind == "exponential" and len(values) == 1 and values[0] > 0:
+            return lambda rng: rng.expovariate(1 / ms[0])
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+def graph_error(status_code: int, code: int, message: str, details: Optional[str] = None,
+                error_type: str = "OAuthException", headers: Optional[dict] = None) -> JSONResponse:
+    """An error response in Graph's shape"""
+    error = {
+        "message": message,
+        "type": error_type,
+        "code": code,
+        "fbtrace_id": base64.b64encode(uuid.uuid4().bytes[:12]).decode().rstrip("=")
+    }
+    if details:
+        error["error_data"] = {"messaging_product": "whatsapp", "details": details}
+    return JSONResponse({"error": error}, status_code=status_code, headers=headers)
+
+class FakeGraphAPI:
+    """
+    The fake's behaviour and counters
+    
+    Each request waits a sampled latency, then is throttled (random
+    `throttle_rate`, or over `max_rps` requests/second), failed (random
+    `failure_rate`) or accepted, in that order.
+    """
+    
+    def __init__(self, latency: str = "fixed:0", throttle_rate: float = 0.0, max_rps: float = 0.0,
+                 retry_after: Optional[float] = None, failure_rate: float = 0.0, seed: Optional[int] = None,
+                 media_bytes: int = 256 * 1024):
+        self.sample_latency = parse_latency(latency)
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+        self.media_bytes = media_bytes
+        self.rng = random.Random(seed)
+        self.tokens = max_rps
+        self.updated_at = time.monotonic()
+        self.reset()
+        self.app = self.create_app()
+    
+    def reset(self):
+        self.by_status: Counter = Counter()
+        self.requests = 0
+        self.accepted = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.media_downloads = 0
+    
+    def over_rate_limit(self) -> bool:
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        self.tokens = min(self.max_rps, self.tokens + (now - self.updated_at) * self.max_rps)
+        self.updated_at = now
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+    
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "accepted": self.accepted,
+            "by_status": {str(code): count for code, count in sorted(self.by_status.items())},
+            "max_in_flight": self.max_in_flight,
+            "media_downloads": self.media_downloads
+        }
+    
+    async def handle(self, request: Request, phone_number_id: str) -> JSONResponse:
+        if not request.headers.get("authorization", "").startswith("Bearer "):
+            return graph_error(401, 190, "Invalid OAuth access token - Cannot parse access token")
+        try:
+            payload = await request.json()
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict) or payload.get("messaging_product") != "whatsapp":
+            return graph_error(400, 100, "(#100) Invalid parameter", "messaging_product is required")
+        
+        await asyncio.sleep(self.sample_latency(self.rng))
+        
+        if self.rng.random() < self.throttle_rate or self.over_rate_limit():
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else None
+            return graph_error(429, 130429, "(#130429) Rate limit hit",
+                               "Cloud API message throughput has been reached.", headers=headers)
+        if self.rng.random() < self.failure_rate:
+            return graph_error(500, 131000, "(#131000) Something went wrong", "Something went wrong")
+        
+        self.accepted += 1
+        if payload.get("status") == "read":
+            return JSONResponse({"success": True})
+        if not payload.get("to"):
+            return graph_error(400, 100, "(#100) Invalid parameter", "to is required")
+        return JSONResponse({
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": payload["to"], "wa_id": payload["to"]}],
+            "messages": [{"id": "wamid." + base64.b64encode(uuid.uuid4().bytes).decode().rstrip("=")}]
+        })
+    
+    def media_content(self, media_id: str) -> bytes:
+        seed = hashlib.sha256(media_id.split("-", 1)[0].encode()).digest()
+        return (seed * (self.media_bytes // len(seed) + 1))[:self.media_bytes]
+    
+    def create_app(self) -> FastAPI:
+        app = FastAPI(title="Fake Graph API")
+        
+        @app.post("/{version}/{phone_number_id}/messages")
+        async def messages(version: str, phone_number_id: str, request: Request):
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                response = await self.handle(request, phone_number_id)
+            finally:
+                self.in_flight -= 1
+            self.by_status[response.status_code] += 1
+            return response
+        
+        @app.get("/media/{media_id}")
+        async def media_download(media_id: str, request: Request):
+            if not request.headers.get("authorization", "").startswith("Bearer "):
+                return graph_error(401, 190, "Invalid OAuth access token - Cannot parse access token")
+            self.media_downloads += 1
+            await asyncio.sleep(self.sample_latency(self.rng))
+            return Response(self.media_content(media_id), media_type="image/jpeg")
+        
+        @app.get("/stats")
+        async def stats():
+            return self.stats()
+        
+        @app.post("/stats/reset")
+        async def reset():
+            self.reset()
+            return self.stats()
+        
+        # Last: the path would also match /stats and /media
+        @app.get("/{version}/{media_id}")
+        async def media_info(version: str, media_id: str, request: Request):
+            if not request.headers.get("authorization", "").startswith("Bearer "):
+                return graph_error(401, 190, "Invalid OAuth access token - Cannot parse access token")
+            await asyncio.sleep(self.sample_latency(self.rng))
+            content = self.media_content(media_id)
+            return JSONResponse({
+                "messaging_product": "whatsapp",
+                "url": str(request.url_for("media_download", media_id=media_id)),
+                "mime_type": "image/jpeg",
+                "sha256": hashlib.sha256(content).hexdigest(),
+                "file_size": len(content),
+                "id": media_id
+            })
+        
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="lognormal:80,0.4", help="per-request latency spec (ms)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--max-rps", type=float, default=0.0, help="answer 429 above this many requests/sec (0: no cap)")
+    parser.add_argument("--retry-after", type=float, help="Retry-After seconds sent with 429s (default: none)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--media-bytes", type=int, default=256 * 1024, help="size of each fake media file")
+    args = parser.parse_args()
+    
+    import uvicorn
+    fake = FakeGraphAPI(
+        latency=args.latency, throttle_rate=args.throttle_rate, max_rps=args.max_rps,
+        retry_after=args.retry_after, failure_rate=args.failure_rate, seed=args.seed,
+        media_bytes=args.media_bytes
+    )
+    uvicorn.run(fake.app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+# inbox/benchmarks/load.py
+"""
+Offline load test: webhook ingestion, status storms and read latency, driven
+through the FastAPI app in-process against a local store.
+
+    cd inbox && python benchmarks/load.py [--backend memory|sqlite] [--messages 20000]
+    cd inbox && python benchmarks/load.py --compare benchmarks/results/<earlier>.json
+
+Payloads look like what Meta sends: batched `messages` of every type
+receive_webhook handles (text, image, video, audio, document, plus
+unsupported types), some webhook retries, and `statuses` storms of
+sent/delivered/read callbacks. Phases:
+  ingest:        POST /webhook with message batches; messages/sec counts
+                 until the batch writer has flushed everything
+  statuses:      POST /webhook with status batches for outbound messages
+  conversations: GET /api/conversations
+  threads:       GET /api/conversations/{user_id} (thread heads)
+
+Each phase reports p50/p95/p99/max latency and throughput (webhook phases
+also the peak batch-writer queue depth: once it reaches WEBHOOK_QUEUE_MAX,
+webhook latency is the writer's backpressure). Results are saved as JSON
+with the git commit so runs can be compared between commits.
+
+Media in the inbound messages is fetched by the app's media cache from a
+benchmarks/fake_graph.py started on a free local port (with a fake token),
+into a temporary directory that is removed afterwards, like the store.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+WABA_ID = "102290129340398"
+PHONE_NUMBER_ID = "106540352242922"
+DISPLAY_NUMBER = "15550783881"
+
+# Share of each inbound message type; the tail hits receive_webhook's fallback branch
+MESSAGE_TYPES = [
+    ("text", 0.70), ("image", 0.10), ("audio", 0.06), ("document", 0.05),
+    ("video", 0.04), ("sticker", 0.02), ("location", 0.02), ("reaction", 0.01)
+]
+
+WORDS = (
+    "hi hello thanks order invoice payment delivery tomorrow today please "
+    "confirm address price discount available stock size colour refund "
+    "when where how much is the my your can you send ok yes no"
+).split()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_fake_graph(port: int, options: List[str] = ()) -> subprocess.Popen:
+    """Run fake_graph.py in its own process and wait until it answers"""
+    import httpx
+    command = [sys.executable, os.path.join(HERE, "fake_graph.py"), "--port", str(port), *options]
+    server = subprocess.Popen(command)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"fake_graph.py exited with {server.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/stats", timeout=0.5)
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("fake_graph.py did not start")
+
+def wamid(n: int) -> str:
+    return f"wamid.HBgMOTE5ODc2NTQzMjEwFQIAEhgg{n:020d}"
+
+def random_text(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 25)))
+
+def message_object(rng: random.Random, n: int, user_id: str, timestamp: int) -> dict:
+    """One entry of value.messages, shaped per message type"""
+    message_type = rng.choices([t for t, _ in MESSAGE_TYPES], [w for _, w in MESSAGE_TYPES])[0]
+    msg = {"from": user_id, "id": wamid(n), "timestamp": str(timestamp), "type": message_type}
+    media = {"id": str(10**15 + n), "sha256": f"{n:064x}"}
+    if message_type == "text":
+        msg["text"] = {"body": random_text(rng)}
+    elif message_type == "image":
+        msg["image"] = {**media, "mime_type": "image/jpeg", "caption": random_text(rng)}
+    elif message_type == "video":
+        msg["video"] = {**media, "mime_type": "video/mp4"}
+    elif message_type == "audio":
+        msg["audio"] = {**media, "mime_type": "audio/ogg; codecs=opus", "voice": True}
+    elif message_type == "document":
+        msg["document"] = {**media, "mime_type": "application/pdf", "filename": f"invoice-{n}.pdf"}
+    elif message_type == "sticker":
+        msg["sticker"] = {**media, "mime_type": "image/webp", "animated": False}
+    elif message_type == "location":
+        msg["location"] = {"latitude": 19.07, "longitude": 72.87, "name": "Office"}
+    else:
+        msg["reaction"] = {"message_id": wamid(max(n - 1, 0)), "emoji": "\U0001F44D"}
+    return msg
+
+def envelope(value: dict) -> dict:
+    """Wrap a change value in the webhook envelope"""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": WABA_ID,
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": DISPLAY_NUMBER, "phone_number_id": PHONE_NUMBER_ID},
+                    **value
+                }
+            }]
+        }]
+    }
+
+def message_payloads(rng: random.Random, count: int, users: List[str], max_batch: int,
+                     retry_rate: float, start: int) -> List[dict]:
+    """
+    Webhook bodies carrying `count` unique inbound messages
+    
+    Meta batches several messages per delivery under load; about
+    `retry_rate` of the deliveries are sent again, as when an ack is slow.
+    """
+    payloads, n = [], 0
+    while n < count:
+        size = min(rng.randint(1, max_batch), count - n)
+        messages, contacts = [], {}
+        for _ in range(size):
+            user_id = rng.choice(users)
+            contacts[user_id] = {"profile": {"name": f"Customer {user_id[-4:]}"}, "wa_id": user_id}
+            messages.append(message_object(rng, n, user_id, start + n))
+            n += 1
+        payloads.append(envelope({"contacts": list(contacts.values()), "messages": messages}))
+        if rng.random() < retry_rate:
+            payloads.append(payloads[-1])
+    return payloads
+
+def status_payloads(rng: random.Random, outbound: List[dict], max_batch: int, start: int) -> List[dict]:
+    """
+    Storm of sent/delivered/read callbacks for outbound messages
+    
+    Every message gets the full lifecycle, shuffled within a window so some
+    statuses arrive out of order, as they do when Meta retries.
+    """
+    statuses = []
+    for i, msg in enumerate(outbound):
+        for offset, status in enumerate(("sent", "delivered", "read")):
+            item = {
+                "id": msg["message_id"],
+                "status": status,
+                "timestamp": str(start + i + offset * 5),
+                "recipient_id": msg["user_id"]
+            }
+            if status != "read":
+                item["conversation"] = {"id": f"conv{i % 997}", "origin": {"type": "service"}}
+                item["pricing"] = {"billable": True, "pricing_model": "CBP", "category": "service"}
+            statuses.append(item)
+    for i in range(0, len(statuses), 50):
+        window = statuses[i:i + 50]
+        rng.shuffle(window)
+        statuses[i:i + 50] = window
+    
+    payloads, i = [], 0
+    while i < len(statuses):
+        size = rng.randint(1, max_batch)
+        payloads.append(envelope({"statuses": statuses[i:i + size]}))
+        i += size
+    return payloads
+
+def percentile(ordered: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+def summarize(latencies: List[float], errors: int, elapsed: float, items: int) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "items": items,
+        "seconds": round(elapsed, 4),
+        "requests_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "items_per_sec": round(items / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0
+    }
+
+async def drive(client, requests: List[tuple], concurrency: int, writer=None):
+    """
+    Issue (method, url, json) requests from `concurrency` clients
+    
+    Returns (latencies, errors, seconds, peak depth of `writer`'s queue).
+    """
+    latencies: List[float] = []
+    errors = 0
+    peak = 0
+    pending = iter(requests)
+    
+    async def worker():
+        nonlocal errors, peak
+        for method, url, body in pending:
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+            if writer is not None:
+                peak = max(peak, writer.qsize())
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started, peak
+
+async def drain(writer):
+    """Wait until everything queued on a batch writer has been flushed"""
+    await writer.stop()
+    await writer.start()
+
+async def run(args) -> dict:
+    import httpx
+    from app.main import app
+    from services.inbox import store, incoming_writer, status_writer
+    
+    rng = random.Random(args.seed)
+    users = [f"91{rng.randrange(10**9, 10**10)}" for _ in range(args.users)]
+    start = int(time.time()) - args.messages - 3600
+    results: Dict[str, dict] = {}
+    
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # Ingest: the webhook only queues, so throughput runs until the writer has flushed
+            payloads = message_payloads(rng, args.messages, users, args.batch, args.retry_rate, start)
+            requests = [("POST", "/webhook", body) for body in payloads]
+            started = time.perf_counter()
+            latencies, errors, _, peak = await drive(client, requests, args.concurrency, incoming_writer)
+            await drain(incoming_writer)
+            results["ingest"] = summarize(latencies, errors, time.perf_counter() - started, args.messages)
+            results["ingest"]["peak_queue"] = peak
+            
+            # Status storm over outbound messages stored directly, as /api/send would have
+            base = datetime.utcfromtimestamp(start)
+            outbound = [{
+                "user_id": rng.choice(users),
+                "direction": "outbound",
+                "body": random_text(rng),
+                "timestamp": base + timedelta(seconds=i),
+                "status": "sent",
+                "message_id": f"wamid.out.{i}"
+            } for i in range(args.statuses)]
+            for i in range(0, len(outbound), 500):
+                await store.insert_messages(outbound[i:i + 500])
+            payloads = status_payloads(rng, outbound, args.batch, start)
+            requests = [("POST", "/webhook", body) for body in payloads]
+            started = time.perf_counter()
+            latencies, errors, _, peak = await drive(client, requests, args.concurrency, status_writer)
+            await drain(status_writer)
+            results["statuses"] = summarize(latencies, errors, time.perf_counter() - started, args.statuses * 3)
+            results["statuses"]["peak_queue"] = peak
+            
+            requests = [("GET", "/api/conversations?limit=50", None)] * args.reads
+            latencies, errors, elapsed, _ = await drive(client, requests, args.concurrency)
+            results["conversations"] = summarize(latencies, errors, elapsed, len(latencies))
+            
+            requests = [("GET", f"/api/conversations/{rng.choice(users)}?limit=100", None) for _ in range(args.reads)]
+            latencies, errors, elapsed, _ = await drive(client, requests, args.concurrency)
+            results["threads"] = summarize(latencies, errors, elapsed, len(latencies))
+            
+            stored = sum(conv["total_messages"] for conv in await store.list_conversations(args.users))
+            if stored != args.messages + args.statuses:
+                print(f"⚠ store holds {stored} messages, expected {args.messages + args.statuses}")
+    finally:
+        await app.router.shutdown()
+    return results
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+def print_report(phases: Dict[str, dict], previous: dict = None):
+    columns = ("requests", "errors", "items_per_sec", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    print(f"{'phase':<14}" + "".join(f"{c:>15}" for c in columns) + f"{'peak_queue':>12}")
+    for phase, stats in phases.items():
+        print(f"{phase:<14}" + "".join(f"{stats[c]:>15}" for c in columns) + f"{stats.get('peak_queue', ''):>12}")
+        before = (previous or {}).get("phases", {}).get(phase)
+        if before:
+            changes = []
+            for c in columns[2:]:
+                if before.get(c):
+                    changes.append(f"{(stats[c] - before[c]) / before[c]:>+15.1%}")
+                else:
+                    changes.append(f"{'-':>15}")
+            print(f"{'  vs ' + previous.get('commit', '?'):<14}{'':>30}" + "".join(changes))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--messages", type=int, default=20000, help="unique inbound messages")
+    parser.add_argument("--statuses", type=int, default=5000, help="outbound messages to send sent/delivered/read for")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=20, help="largest number of messages/statuses per webhook")
+    parser.add_argument("--retry-rate", type=float, default=0.02, help="share of webhooks delivered twice")
+    parser.add_argument("--reads", type=int, default=5000, help="requests per read phase")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--media-bytes", type=int, default=16 * 1024, help="size of each fake media file")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="results file (default benchmarks/results/load-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    args = parser.parse_args()
+    
+    # Configuration is read at import time, so the environment is set first;
+    # nothing may reach the real Graph API or use the token in .env
+    port = free_port()
+    directory = tempfile.mkdtemp(prefix="inbox-bench-")
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ["SQLITE_PATH"] = os.path.join(directory, "inbox.db")
+    os.environ["MEDIA_DIR"] = os.path.join(directory, "media")
+    os.environ["CAMPAIGN_DIR"] = os.path.join(directory, "campaigns")
+    os.environ["WHATSAPP_API_BASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["WHATSAPP_ACCESS_TOKEN"] = "fake-token"
+    os.environ["WHATSAPP_PHONE_NUMBER_ID"] = PHONE_NUMBER_ID
+    os.environ["LOG_LEVEL"] = args.log_level
+    os.environ["LOG_FILE"] = ""
+    sys.path[:0] = [ROOT, os.path.join(ROOT, "app")]
+    
+    server = start_fake_graph(port, ["--latency", "fixed:5", "--media-bytes", str(args.media_bytes)])
+    try:
+        phases = asyncio.run(run(args))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory, ignore_errors=True)
+    report = {
+        "commit": git_commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "phases": phases
+    }
+    
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(phases, previous)
+    
+    output = args.output or os.path.join(
+        HERE, "results", f"load-{report['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved {output}")
+
+if __name__ == "__main__":
+    main()
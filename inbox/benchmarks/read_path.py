@@ -0,0 +1,114 @@
+# inbox/benchmarks/read_path.py
+"""
+CPU cost per request of the thread read path: before vs. after projections
+and direct orjson encoding.
+
+    cd inbox && python benchmarks/read_path.py [--iterations 200]
+
+Both paths start from BSON bytes, as the driver receives them, so decoding
+the unprojected fields is part of the measured cost:
+  baseline: full documents -> dict rebuild -> response_model validation -> json
+  fast:     projected documents -> messages_out -> orjson
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bson
+from bson import ObjectId
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+from schemas import MessagePage  # noqa: E402
+from utils.serialize import MESSAGE_OUT_FIELDS, messages_out  # noqa: E402
+
+def make_documents(count: int) -> list:
+    """Thread documents shaped like what the webhook and send paths store"""
+    start = datetime(2024, 1, 1)
+    docs = []
+    for i in range(count):
+        ts = start + timedelta(seconds=37 * i)
+        docs.append({
+            "_id": ObjectId(),
+            "user_id": "919876543210",
+            "direction": "inbound" if i % 3 else "outbound",
+            "body": f"Message number {i} with a realistic amount of text in it, give or take.",
+            "timestamp": ts,
+            "status": "read",
+            "message_id": f"wamid.HBgMOTE5ODc2NTQzMjEwFQIAEhgg{i:012d}",
+            "media_url": None,
+            "media_type": None,
+            "seq": 100000 + i,
+            "status_timestamps": {
+                "sent": ts,
+                "delivered": ts + timedelta(seconds=2),
+                "read": ts + timedelta(seconds=40)
+            }
+        })
+    return docs
+
+def encode(docs: list) -> bytes:
+    return b"".join(bson.encode(doc) for doc in docs)
+
+def baseline_request(raw: bytes, field, loop) -> bytes:
+    docs = bson.decode_all(raw)
+    result = []
+    for msg in docs:
+        result.append({
+            "user_id": msg.get("user_id"),
+            "direction": msg.get("direction"),
+            "body": msg.get("body"),
+            "timestamp": msg.get("timestamp"),
+            "status": msg.get("status"),
+            "message_id": msg.get("message_id")
+        })
+    content = loop.run_until_complete(serialize_response(
+        field=field,
+        response_content={"messages": result, "next_cursor": "cursor"},
+        is_coroutine=True
+    ))
+    return JSONResponse(content).body
+
+def fast_request(raw: bytes) -> bytes:
+    docs = bson.decode_all(raw)
+    return ORJSONResponse({"messages": messages_out(docs), "next_cursor": "cursor"}).body
+
+def cpu_per_call(fn, iterations: int) -> float:
+    fn()  # warm up
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 500])
+    args = parser.parse_args()
+    
+    field = create_response_field(name="response", type_=MessagePage)
+    loop = asyncio.new_event_loop()
+    
+    print(f"{'messages':>8} {'baseline ms':>12} {'fast ms':>9} {'saving':>7}")
+    for size in args.sizes:
+        docs = make_documents(size)
+        full_raw = encode(docs)
+        projected_raw = encode([
+            {"_id": doc["_id"], **{f: doc.get(f) for f in MESSAGE_OUT_FIELDS}} for doc in docs
+        ])
+        
+        # Both paths must produce the same response body
+        assert json.loads(baseline_request(full_raw, field, loop)) == json.loads(fast_request(projected_raw))
+        
+        baseline = cpu_per_call(lambda: baseline_request(full_raw, field, loop), args.iterations)
+        fast = cpu_per_call(lambda: fast_request(projected_raw), args.iterations)
+        print(f"{size:>8} {baseline * 1000:>12.3f} {fast * 1000:>9.3f} {1 - fast / baseline:>7.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# inbox/benchmarks/resume_check.py
+"""
+Crash/resume check for message_sender's campaign checkpoint.
+
+    cd inbox && python benchmarks/resume_check.py [--contacts 200]
+
+Starts a campaign against benchmarks/fake_graph.py in a child process whose
+send to one early row never returns, so the rows after it finish out of
+order past the checkpoint's watermark. Once they have all been saved the
+child is killed (SIGKILL: no cleanup runs), the campaign is resumed in this
+process, and the check passes if the fake accepted every contact exactly
+once and the resumed totals count each row once. Exits 1 otherwise.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from campaign import ACCESS_TOKEN, PHONE_NUMBER_ID
+from load import HERE, ROOT, free_port
+
+TEMPLATE = "Hello {name}"
+
+def write_contacts(path: str, count: int):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        f.write("name,phone\n")
+        for i in range(1, count + 1):
+            f.write(f"Customer {i},91{9000000000 + i}\n")
+
+def child(args):
+    """The run that gets killed: row `--stall-row` hangs, everything else is sent"""
+    sys.path.insert(0, ROOT)
+    from message_sender import WhatsAppBulkSender, CampaignCheckpoint
+    stall_phone = f"91{9000000000 + args.stall_row}"
+    
+    class StallingSender(WhatsAppBulkSender):
+        async def send_message_async(self, client, limiter, recipient_phone, *a, **kw):
+            if recipient_phone == stall_phone:
+                await asyncio.Event().wait()
+            return await super().send_message_async(client, limiter, recipient_phone, *a, **kw)
+    
+    sender = StallingSender(ACCESS_TOKEN, PHONE_NUMBER_ID, messages_per_second=1000,
+                            max_in_flight=8, api_base_url=args.base_url)
+    sender.send_campaign(args.contacts_file, TEMPLATE, checkpoint=CampaignCheckpoint(args.contacts_file, save_every=1))
+
+def wait_for(condition, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.05)
+    raise RuntimeError(f"timed out waiting for {what}")
+
+def check(args) -> bool:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "fake_graph.py"), "--port", str(port),
+        "--latency", "fixed:1", "--throttle-rate", "0", "--failure-rate", "0"
+    ])
+    # message_sender writes failed_messages_*.json into the working directory
+    cwd = os.getcwd()
+    directory = tempfile.TemporaryDirectory(prefix="inbox-resume-")
+    os.chdir(directory.name)
+    try:
+        wait_for(lambda: _answers(base_url), 15, "fake_graph.py")
+        contacts_file = os.path.join(directory.name, "contacts.csv")
+        write_contacts(contacts_file, args.contacts)
+        checkpoint_path = os.path.join(directory.name, "contacts.checkpoint.json")
+        
+        run = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), "--child", "--contacts-file", contacts_file,
+            "--base-url", base_url, "--stall-row", str(args.stall_row)
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        
+        def all_but_one_saved() -> bool:
+            try:
+                with open(checkpoint_path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                return False
+            return sum(state["counts"].values()) == args.contacts - 1
+        
+        wait_for(all_but_one_saved, 60, "the first run to finish every other row")
+        run.send_signal(signal.SIGKILL)
+        run.wait()
+        with open(checkpoint_path) as f:
+            state = json.load(f)
+        print(f"killed at watermark row {state['row']} with {len(state.get('done', []))} rows done past it")
+        
+        sys.path.insert(0, ROOT)
+        from message_sender import WhatsAppBulkSender, CampaignCheckpoint
+        checkpoint = CampaignCheckpoint(contacts_file)
+        checkpoint.load()
+        sender = WhatsAppBulkSender(ACCESS_TOKEN, PHONE_NUMBER_ID, messages_per_second=1000,
+                                    max_in_flight=8, api_base_url=base_url)
+        sender.send_campaign(contacts_file, TEMPLATE, checkpoint=checkpoint)
+        
+        accepted = httpx.get(f"{base_url}/stats").json()["accepted"]
+        print(f"fake Graph accepted {accepted} sends for {args.contacts} contacts")
+        print(f"resumed totals: {checkpoint.counts}")
+        ok = accepted == args.contacts and checkpoint.counts == {"sent": args.contacts, "failed": 0, "skipped": 0}
+        print("✓ no row sent or counted twice" if ok else "✗ rows were sent or counted twice")
+        return ok
+    finally:
+        os.chdir(cwd)
+        directory.cleanup()
+        server.terminate()
+        server.wait()
+
+def _answers(base_url: str) -> bool:
+    try:
+        httpx.get(f"{base_url}/stats", timeout=0.5)
+        return True
+    except httpx.HTTPError:
+        return False
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--contacts", type=int, default=200)
+    parser.add_argument("--stall-row", type=int, default=3, help="row whose send never returns in the first run")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--contacts-file", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+    sys.exit(0 if check(args) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,205 @@
 import requests
+import httpx
+import asyncio
+import random
 import json
 import csv
-import time
 import logging
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
 import os
 from dotenv import load_dotenv
+from app.utils.contacts import Preflight, format_report
+from app.utils.ratelimit import TokenBucket, is_throttled
 
 # Load environment variables
 load_dotenv()
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(f'whatsapp_log_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log', encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+
+def setup_logging():
+    """Log to the console and a whatsapp_log_<time>.log file; only for a run of this script, not an import"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(f'whatsapp_log_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log', encoding="utf-8"),
+            logging.StreamHandler()
+        ]
+    )
+
+
+# Point WHATSAPP_API_BASE_URL at benchmarks/fake_graph.py to send offline
+GRAPH_API_BASE_URL = os.getenv("WHATSAPP_API_BASE_URL", "https://graph.facebook.com")
+GRAPH_API_VERSION = os.getenv("WHATSAPP_API_VERSION", "v22.0")
+
+
+def read_header(csv_file: str) -> List[str]:
+    """Column names of a contacts file"""
+    with open(csv_file, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+
+def stream_contacts(csv_file: str, start_offset: int = 0,
+                    start_row: int = 0) -> Iterator[Tuple[int, int, Dict]]:
+    """
+    Stream contacts from a CSV file without loading it into memory
+
+    Yields (row_index, end_offset, row) where row_index counts data rows from 1
+    and end_offset is the byte offset just past the row, so a run can be resumed
+    by seeking straight to it.
+    """
+    with open(csv_file, "rb") as f:
+        def lines():
+            while True:
+                line = f.readline()
+                if not line:
+                    return
+                yield line.decode("utf-8")
+
+        # csv.reader pulls one line at a time, so f.tell() stays aligned with
+        # record boundaries (including quoted multi-line fields)
+        reader = csv.reader(lines())
+        header = next(reader, None)
+        if not header:
+            return
+        header[0] = header[0].lstrip("\ufeff")
+
+        if start_offset:
+            f.seek(start_offset)
+
+        row_index = start_row
+        for values in reader:
+            row_index += 1
+            yield row_index, f.tell(), dict(zip(header, values))
+
+
+class CampaignCheckpoint:
+    """
+    Resumable progress for one contacts file
+
+    The checkpoint JSON holds a low watermark (last row such that every row up to
+    it is finished, and the byte offset after it) and the rows finished past it.
+    Per-row outcomes are appended to a JSONL results file as they happen; rows
+    finished after the last save are recovered from the tail of that file on
+    resume, so nothing is sent (or counted) twice.
+    """
+
+    def __init__(self, csv_file: str, save_every: int = 100):
+        base = os.path.splitext(csv_file)[0]
+        self.path = f"{base}.checkpoint.json"
+        self.results_path = f"{base}.results.jsonl"
+        self.save_every = save_every
+        self.row = 0
+        self.offset = 0
+        self.counts = {"sent": 0, "failed": 0, "skipped": 0}
+        self.finished = False
+        self.done = set()        # rows finished past the watermark
+        self.pending = {}        # row -> end offset, for rows dispatched but unfinished
+        self.results_file = None
+        self.unsaved = 0
+
+    def load(self) -> bool:
+        """Restore state from disk; returns True if there was something to resume"""
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, "r") as f:
+            state = json.load(f)
+        self.row = state["row"]
+        self.offset = state["offset"]
+        self.counts = state["counts"]
+        self.finished = state.get("finished", False)
+        # Already in `counts`; their results lines are before results_offset
+        self.done = set(state.get("done", []))
+
+        # Outcomes written after the last checkpoint save
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "rb") as f:
+                f.seek(state["results_offset"])
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        break  # torn write from a crash
+                    if result["row"] > self.row and result["row"] not in self.done:
+                        self.done.add(result["row"])
+                        self.counts[result["status"]] += 1
+        return True
+
+    def open(self):
+        # Line-buffered so each outcome reaches the OS as soon as it is known
+        self.results_file = open(self.results_path, "a", encoding="utf-8", buffering=1)
+
+    def dispatch(self, row: int, offset: int) -> bool:
+        """Record where a row ends; returns False if it already finished in a previous run"""
+        self.pending[row] = offset
+        if row in self.done:
+            self.advance()
+            return False
+        return True
+
+    def completed(self, row: int, outcome: Dict):
+        if row not in self.done:
+            self.counts[outcome["status"]] += 1
+            self.results_file.write(json.dumps({"row": row, **outcome}) + "\n")
+        self.done.add(row)
+        self.advance()
+
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.save()
+
+    def advance(self):
+        """Move the watermark over every contiguous finished row whose offset is known"""
+        while self.row + 1 in self.done and self.row + 1 in self.pending:
+            self.row += 1
+            self.done.discard(self.row)
+            self.offset = self.pending.pop(self.row)
+
+    def save(self):
+        self.results_file.flush()
+        state = {
+            "row": self.row,
+            "offset": self.offset,
+            "counts": self.counts,
+            "results_offset": self.results_file.tell(),
+            "done": sorted(self.done),
+            "finished": self.finished,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
+
+    def close(self, finished: bool = False):
+        self.finished = finished
+        self.save()
+        self.results_file.close()
+
 
 class WhatsAppBulkSender:
-    def __init__(self, access_token: str, phone_number_id: str):
+    def __init__(self, access_token: str, phone_number_id: str,
+                 messages_per_second: float = 20.0, max_in_flight: int = 10,
+                 max_retries: int = 3, api_base_url: str = None, default_country: str = None):
         self.access_token = access_token
         self.phone_number_id = phone_number_id
-        self.api_url = f"https://graph.facebook.com/v22.0/{phone_number_id}/messages"
+        base_url = (api_base_url or GRAPH_API_BASE_URL).rstrip("/")
+        self.api_url = f"{base_url}/{GRAPH_API_VERSION}/{phone_number_id}/messages"
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
+        self.messages_per_second = messages_per_second
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.default_country = default_country
         self.success_count = 0
         self.failed_count = 0
         self.failed_messages = []
 
-    def send_message(self, recipient_phone: str, message: str, use_template: bool = False) -> bool:
-        """Send a WhatsApp message (text or template)"""
-
+    def build_payload(self, recipient_phone: str, message: str, use_template: bool = False) -> Dict:
+        """Build the Graph API payload for a text or template message"""
         if use_template:
             payload = {
                 "messaging_product": "whatsapp",
@@ -55,6 +218,21 @@ class WhatsAppBulkSender:
                         "text": {"body": message}
 
             }
+        return payload
+
+    def record_success(self, recipient_phone: str, resp_json: Dict):
+        # Counters are only touched from the event loop thread with no await in
+        # between, so concurrent workers can't interleave a read-modify-write.
+        logging.info(f"[SUCCESS] Sent to {recipient_phone} | Response: {resp_json}")
+        self.success_count += 1
+
+    def record_failure(self, recipient_phone: str, error_msg: str):
+        self.failed_count += 1
+        self.failed_messages.append({"phone": recipient_phone, "error": error_msg})
+
+    def send_message(self, recipient_phone: str, message: str, use_template: bool = False) -> bool:
+        """Send a WhatsApp message (text or template)"""
+        payload = self.build_payload(recipient_phone, message, use_template)
 
         try:
             response = requests.post(
@@ -70,64 +248,211 @@ class WhatsAppBulkSender:
                 resp_json = {"raw": response.text}
 
             if response.status_code == 200:
-                logging.info(f"[SUCCESS] Sent to {recipient_phone} | Response: {resp_json}")
-                self.success_count += 1
+                self.record_success(recipient_phone, resp_json)
                 return True
             else:
                 error_msg = resp_json.get("error", {}).get("message", "Unknown error")
                 logging.error(f"[FAILED] {recipient_phone} | {error_msg} | Full: {resp_json}")
-                self.failed_count += 1
-                self.failed_messages.append({"phone": recipient_phone, "error": error_msg})
+                self.record_failure(recipient_phone, error_msg)
                 return False
 
         except Exception as e:
             logging.error(f"[EXCEPTION] {recipient_phone} | {str(e)}")
-            self.failed_count += 1
-            self.failed_messages.append({"phone": recipient_phone, "error": str(e)})
+            self.record_failure(recipient_phone, str(e))
             return False
 
-    def personalize_message(self, template: str, data: Dict) -> str:
+    def backoff_seconds(self, attempt: int, response: httpx.Response) -> float:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return min(60.0, 2 ** attempt) + random.uniform(0, 1)
+
+    async def send_message_async(self, client: httpx.AsyncClient, limiter: TokenBucket,
+                                 recipient_phone: str, message: str,
+                                 use_template: bool = False) -> Dict:
+        """
+        Send one message through the shared client, retrying only on throttling
+
+        Returns:
+            Dict with success status and message_id or error
+        """
+        payload = self.build_payload(recipient_phone, message, use_template)
+
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            try:
+                response = await client.post(self.api_url, json=payload)
+            except Exception as e:
+                # Not retried: a timed-out request may still have been delivered
+                logging.error(f"[EXCEPTION] {recipient_phone} | {str(e)}")
+                self.record_failure(recipient_phone, str(e))
+                return {"success": False, "message_id": None, "error": str(e)}
+
+            try:
+                resp_json = response.json()
+            except Exception:
+                resp_json = {"raw": response.text}
+
+            if response.status_code == 200:
+                limiter.recover()
+                self.record_success(recipient_phone, resp_json)
+                message_id = resp_json.get("messages", [{}])[0].get("id")
+                return {"success": True, "message_id": message_id, "error": None}
+
+            if is_throttled(response.status_code, resp_json) and attempt < self.max_retries:
+                pause = self.backoff_seconds(attempt, response)
+                limiter.throttle(pause)
+                logging.warning(
+                    f"[THROTTLED] {recipient_phone} | retry {attempt + 1}/{self.max_retries} "
+                    f"in {pause:.1f}s, rate now {limiter.rate:.1f}/s"
+                )
+                continue
+            break
+
+        error_msg = resp_json.get("error", {}).get("message", "Unknown error")
+        logging.error(f"[FAILED] {recipient_phone} | {error_msg} | Full: {resp_json}")
+        self.record_failure(recipient_phone, error_msg)
+        return {"success": False, "message_id": None, "error": error_msg}
+
+    def preflight(self, message_template: str, header: Iterable[str]) -> Preflight:
+        """Compile the template against the header; raises ValueError if they don't fit"""
+        return Preflight(message_template, header, self.default_country)
+
+    def check_campaign(self, csv_file: str, message_template: str) -> Dict:
+        """
+        Preflight every row of a contacts file without sending anything
+
+        Returns the report (rows to send, missing/invalid phones, duplicates,
+        template errors); raises ValueError for a missing `phone` column or
+        a placeholder with no column.
+        """
+        preflight = self.preflight(message_template, read_header(csv_file))
         try:
-            return template.format(**data)
-        except KeyError as e:
-            logging.warning(f"Missing placeholder {e} in template")
-            return template
+            for idx, _, contact in stream_contacts(csv_file):
+                preflight.check(idx, contact)
+            return preflight.report()
+        finally:
+            preflight.close()
 
     def load_contacts_from_csv(self, csv_file: str) -> List[Dict]:
-        contacts = []
         try:
-            with open(csv_file, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    contacts.append(row)
+            contacts = [row for _, _, row in stream_contacts(csv_file)]
             logging.info(f"Loaded {len(contacts)} contacts from {csv_file}")
             return contacts
         except Exception as e:
             logging.error(f"Error loading CSV: {str(e)}")
             return []
 
-    def send_bulk_messages(self, contacts: List[Dict], message_template: str,
-                           delay_seconds: float = 0.0, use_template: bool = False):
-        total = len(contacts)
-        logging.info(f"Starting bulk send to {total} contacts...")
+    def prepare_jobs(self, rows: Iterable[Tuple[int, Optional[int], Dict]],
+                     preflight: Preflight) -> Iterator[Tuple[int, Optional[int], Optional[str], Optional[str], Optional[str]]]:
+        """Normalize, dedupe and personalize as rows stream past: (row, offset, phone, message, problem)"""
+        for idx, offset, contact in rows:
+            phone, message, problem = preflight.check(idx, contact)
+            yield idx, offset, phone, message, problem
 
-        for idx, contact in enumerate(contacts, 1):
-            phone = contact.get("phone", "").strip()
-            if not phone:
-                logging.warning(f"Skipping contact {idx}: No phone number")
-                continue
+    async def send_jobs(self, jobs: Iterable[Tuple[int, Optional[int], Optional[str], Optional[str], Optional[str]]],
+                        use_template: bool = False, messages_per_second: float = None,
+                        checkpoint: CampaignCheckpoint = None):
+        """Send (row, offset, phone, message, problem) jobs with up to `max_in_flight` requests on one connection pool"""
+        rate = messages_per_second or self.messages_per_second
+        logging.info(f"Starting bulk send ({rate}/s, {self.max_in_flight} in flight)...")
+
+        limiter = TokenBucket(rate)
+        queue = asyncio.Queue(maxsize=self.max_in_flight * 2)
+        limits = httpx.Limits(max_connections=self.max_in_flight,
+                              max_keepalive_connections=self.max_in_flight)
+
+        async with httpx.AsyncClient(headers=self.headers, timeout=30, limits=limits) as client:
+            async def worker():
+                while True:
+                    job = await queue.get()
+                    if job is None:
+                        return
+                    idx, phone, message = job
+                    logging.info(f"[{idx}] Sending to {phone}...")
+                    result = await self.send_message_async(client, limiter, phone, message, use_template)
+                    if checkpoint:
+                        checkpoint.completed(idx, {
+                            "phone": phone,
+                            "status": "sent" if result["success"] else "failed",
+                            "message_id": result["message_id"],
+                            "error": result["error"],
+                        })
 
-            phone = phone.replace("+", "").replace(" ", "").replace("-", "")
-            message = self.personalize_message(message_template, contact)
+            workers = [asyncio.create_task(worker()) for _ in range(self.max_in_flight)]
 
-            logging.info(f"[{idx}/{total}] Sending to {phone}...")
-            self.send_message(phone, message, use_template=use_template)
+            for idx, offset, phone, message, problem in jobs:
+                if checkpoint and not checkpoint.dispatch(idx, offset):
+                    continue
 
-            if idx < total:
-                time.sleep(delay_seconds)
+                if problem:
+                    logging.warning(f"Skipping contact {idx}: {problem} ({phone})")
+                    if checkpoint:
+                        checkpoint.completed(idx, {"phone": phone, "status": "skipped", "error": problem})
+                    continue
+
+                await queue.put((idx, phone, message))
+
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
 
         self.print_summary()
 
+    async def send_bulk_messages_async(self, contacts: List[Dict], message_template: str,
+                                       use_template: bool = False, messages_per_second: float = None):
+        """Send to an in-memory list of contacts"""
+        preflight = self.preflight(message_template, contacts[0].keys() if contacts else ["phone"])
+        rows = ((idx, None, contact) for idx, contact in enumerate(contacts, 1))
+        try:
+            await self.send_jobs(self.prepare_jobs(rows, preflight),
+                                 use_template=use_template, messages_per_second=messages_per_second)
+        finally:
+            preflight.close()
+
+    def send_bulk_messages(self, contacts: List[Dict], message_template: str,
+                           delay_seconds: float = 0.0, use_template: bool = False):
+        # A non-zero delay_seconds still caps throughput at one message per delay
+        rate = 1 / delay_seconds if delay_seconds > 0 else None
+        asyncio.run(self.send_bulk_messages_async(
+            contacts, message_template, use_template=use_template, messages_per_second=rate
+        ))
+
+    def send_campaign(self, csv_file: str, message_template: str, delay_seconds: float = 0.0,
+                      use_template: bool = False, checkpoint: CampaignCheckpoint = None):
+        """
+        Stream a contacts file through preflight (normalize -> personalize -> dedupe)
+        -> send, resuming from `checkpoint` if it was loaded from a previous run
+        """
+        checkpoint = checkpoint or CampaignCheckpoint(csv_file)
+        rate = 1 / delay_seconds if delay_seconds > 0 else None
+        preflight = self.preflight(message_template, read_header(csv_file))
+        if checkpoint.row:
+            logging.info(f"Resuming {csv_file} after row {checkpoint.row} (byte {checkpoint.offset})")
+            # Replay the rows already done through the checks (no sends) so a
+            # number they covered still counts as a duplicate further on
+            for idx, _, contact in stream_contacts(csv_file):
+                if idx > checkpoint.row:
+                    break
+                preflight.check(idx, contact)
+
+        rows = stream_contacts(csv_file, start_offset=checkpoint.offset, start_row=checkpoint.row)
+        checkpoint.open()
+        finished = False
+        try:
+            asyncio.run(self.send_jobs(
+                self.prepare_jobs(rows, preflight),
+                use_template=use_template, messages_per_second=rate, checkpoint=checkpoint
+            ))
+            finished = True
+        finally:
+            preflight.close()
+            checkpoint.close(finished=finished)
+            logging.info(f"Campaign totals: {checkpoint.counts} | results: {checkpoint.results_path}")
+
     def print_summary(self):
         logging.info("\n" + "="*50)
         logging.info("SENDING SUMMARY")
@@ -143,12 +468,16 @@ class WhatsAppBulkSender:
 
 
 def main():
+    setup_logging()
     ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN")
     PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
     CONTACTS_FILE = os.getenv("CONTACTS_FILE", "contacts.csv")
     MESSAGE_TEMPLATE = os.getenv("MESSAGE_TEMPLATE", "Hello {name}, this is a test message.")
     DELAY_SECONDS = float(os.getenv("DELAY_SECONDS", "0"))
+    MESSAGES_PER_SECOND = float(os.getenv("MESSAGES_PER_SECOND", "20"))
+    MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "10"))
     USE_TEMPLATE = os.getenv("USE_TEMPLATE", "false").lower() == "true"
+    DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE") or None
 
     if not ACCESS_TOKEN or not PHONE_NUMBER_ID:
         print("[ERROR] Missing WHATSAPP_ACCESS_TOKEN or WHATSAPP_PHONE_NUMBER_ID in .env")
@@ -158,23 +487,49 @@ def main():
         print(f"[ERROR] Contacts file '{CONTACTS_FILE}' not found")
         return
 
-    sender = WhatsAppBulkSender(ACCESS_TOKEN, PHONE_NUMBER_ID)
-    contacts = sender.load_contacts_from_csv(CONTACTS_FILE)
+    sender = WhatsAppBulkSender(ACCESS_TOKEN, PHONE_NUMBER_ID,
+                                messages_per_second=MESSAGES_PER_SECOND,
+                                max_in_flight=MAX_IN_FLIGHT,
+                                default_country=DEFAULT_COUNTRY_CODE)
 
-    if not contacts:
-        print("[ERROR] No contacts found")
+    # Check the whole file before anything is sent
+    try:
+        report = sender.check_campaign(CONTACTS_FILE, MESSAGE_TEMPLATE)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        return
+    print(f"\n[PREFLIGHT] {CONTACTS_FILE}")
+    print(format_report(report))
+    if not report["sendable"]:
+        print("[ERROR] Nothing to send")
         return
 
-    print(f"\n[READY] Will send to {len(contacts)} contacts")
-    print(f"[DELAY] {DELAY_SECONDS} seconds between messages")
+    checkpoint = CampaignCheckpoint(CONTACTS_FILE)
+
+    if checkpoint.load():
+        if checkpoint.finished:
+            print(f"[DONE] Campaign for '{CONTACTS_FILE}' already completed: {checkpoint.counts}")
+            print(f"[INFO] Delete '{checkpoint.path}' to send it again")
+            return
+        print(f"\n[RESUME] Continuing after row {checkpoint.row}: {checkpoint.counts}")
+    else:
+        print(f"\n[READY] Will stream contacts from {CONTACTS_FILE}")
+
+    if DELAY_SECONDS > 0:
+        print(f"[DELAY] {DELAY_SECONDS} seconds between messages")
+    else:
+        print(f"[RATE] {MESSAGES_PER_SECOND} messages/sec, {MAX_IN_FLIGHT} in flight")
     print(f"[MODE] {'TEMPLATE (hello_world)' if USE_TEMPLATE else 'TEXT'}")
+    # Set WHATSAPP_API_BASE_URL to a benchmarks/fake_graph.py to try a run without the live API
+    print(f"[API] {GRAPH_API_BASE_URL}")
     confirm = input("\nProceed? (yes/no): ")
 
     if confirm.lower() != "yes":
         print("[CANCELLED] Sending cancelled")
         return
 
-    sender.send_bulk_messages(contacts, MESSAGE_TEMPLATE, DELAY_SECONDS, use_template=USE_TEMPLATE)
+    sender.send_campaign(CONTACTS_FILE, MESSAGE_TEMPLATE, DELAY_SECONDS,
+                         use_template=USE_TEMPLATE, checkpoint=checkpoint)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,7 @@
+# inbox/tests/conftest.py
+import os
+import sys
+
+# The app imports its modules from app/ and reads its configuration at import time
+os.environ.setdefault("LOG_FILE", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
@@ -0,0 +1,378 @@
+# inbox/tests/test_storage_conformance.py
+"""
+Conformance checks every storage backend has to pass.
+
+    cd inbox && pip install pytest && python -m pytest tests [-k sqlite]
+
+Each check runs against memory and sqlite, plus mongo when TEST_MONGO_URI is
+set (against a scratch `<DB_NAME>_conformance` database that is dropped after
+each check); MONGO_URI is never used, so a bare run can't reach the app's own
+cluster. Each check gets a fresh, empty store.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import pytest
+from storage.base import MessageStore
+
+TEST_MONGO_URI = os.getenv("TEST_MONGO_URI")
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+def message(user_id: str, n: int, direction: str = "inbound", body: str = None, message_id: str = None,
+            status: str = None) -> dict:
+    return {
+        "user_id": user_id,
+        "direction": direction,
+        "body": body if body is not None else f"message {n}",
+        "timestamp": T0 + timedelta(minutes=n),
+        "status": status or ("received" if direction == "inbound" else "sent"),
+        "message_id": message_id or f"wamid.{user_id}.{n}"
+    }
+
+async def conversation(store: MessageStore, user_id: str) -> dict:
+    for conv in await store.list_conversations(1000):
+        if conv["_id"] == user_id:
+            return conv
+    raise AssertionError(f"no conversation for {user_id}")
+
+async def thread_status(store: MessageStore, user_id: str, message_id: str) -> str:
+    for msg in await store.get_thread(user_id, 1000):
+        if msg.get("message_id") == message_id:
+            return msg.get("status")
+    raise AssertionError(f"{message_id} not in thread")
+
+async def check_insert_skips_duplicates(store: MessageStore):
+    batch = [message("a", 1), message("a", 2), message("a", 1)]
+    stored = await store.insert_messages(batch)
+    assert [msg["message_id"] for msg in stored] == ["wamid.a.1", "wamid.a.2"], stored
+    assert all("_id" in msg and msg["seq"] for msg in stored)
+    assert stored[0]["seq"] < stored[1]["seq"]
+    
+    stored = await store.insert_messages([message("a", 2), message("a", 3)])
+    assert [msg["message_id"] for msg in stored] == ["wamid.a.3"], stored
+    assert len(await store.get_thread("a", 100)) == 3
+    
+    # No id (a send Graph answered without one) never counts as a duplicate
+    stored = await store.insert_messages([{**message("a", 4), "message_id": None}])
+    stored += await store.insert_messages([{**message("a", 5), "message_id": None}])
+    assert len(stored) == 2, stored
+    assert len(await store.get_thread("a", 100)) == 5
+
+async def check_conversation_summary(store: MessageStore):
+    await store.insert_messages([message("a", 5, body="newest"), message("a", 1)])
+    # Arrives late with an older timestamp: counted, but doesn't become `last`
+    await store.insert_messages([message("a", 3, direction="outbound", body="reply")])
+    
+    conv = await conversation(store, "a")
+    assert conv["last"]["body"] == "newest", conv
+    assert conv["last"]["timestamp"] == T0 + timedelta(minutes=5)
+    assert conv["total_messages"] == 3
+    assert conv["inbound_count"] == 2 and conv["outbound_count"] == 1
+    assert conv["unread_count"] == 2
+    assert conv["last_inbound"]["message_id"] == "wamid.a.5"
+
+async def check_mark_read(store: MessageStore):
+    await store.insert_messages([message("a", 1), message("a", 2), message("a", 3, direction="outbound")])
+    before = await store.mark_read("a")
+    assert before["unread_count"] == 2, before
+    assert before["last_inbound"]["message_id"] == "wamid.a.2"
+    assert (await conversation(store, "a"))["unread_count"] == 0
+    assert await store.mark_read("nobody") is None
+
+async def check_status_only_moves_forward(store: MessageStore):
+    await store.insert_messages([message("a", 1, direction="outbound", status="sent")])
+    ts = T0 + timedelta(hours=1)
+    
+    await store.apply_statuses({"wamid.a.1": {"status": "read", "timestamps": {"read": ts}}})
+    assert await thread_status(store, "a", "wamid.a.1") == "read"
+    
+    # A late "delivered" is recorded but doesn't move the status back
+    await store.apply_statuses({"wamid.a.1": {"status": "delivered", "timestamps": {"delivered": ts}}})
+    assert await thread_status(store, "a", "wamid.a.1") == "read"
+    
+    await store.apply_statuses({"wamid.a.1": {"status": "failed", "timestamps": {"failed": ts}}})
+    assert await thread_status(store, "a", "wamid.a.1") == "failed"
+    
+    # Unknown ids are ignored
+    await store.apply_statuses({"wamid.missing": {"status": "read", "timestamps": {"read": ts}}})
+
+async def check_thread_paging(store: MessageStore):
+    # Timestamp ties (minute 2 twice, minute 4 three times) must still page cleanly
+    minutes = [1, 2, 2, 3, 4, 4, 4, 5]
+    await store.insert_messages([
+        {**message("a", n), "message_id": f"wamid.a.{i}", "body": f"m{i}"} for i, n in enumerate(minutes)
+    ])
+    await store.insert_messages([message("b", 1)])
+    
+    head = await store.get_thread("a", 3)
+    assert [msg["body"] for msg in head] == ["m7", "m6", "m5"], head
+    assert all(msg["user_id"] == "a" for msg in head)
+    
+    seen, page = [], head
+    while page:
+        seen += [msg["body"] for msg in page]
+        last = page[-1]
+        page = await store.get_thread("a", 3, (last["timestamp"], last["_id"]))
+    assert seen == [f"m{i}" for i in reversed(range(8))], seen
+    
+    seen, page = [], await store.get_thread("a", 3, (T0, store.parse_id(str(head[0]["_id"]))), forward=True)
+    while page:
+        seen += [msg["body"] for msg in page]
+        last = page[-1]
+        page = await store.get_thread("a", 3, (last["timestamp"], last["_id"]), forward=True)
+    assert seen == [f"m{i}" for i in range(8)], seen
+    
+    try:
+        store.parse_id("not an id")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("parse_id accepted garbage")
+
+async def check_conversation_list_order(store: MessageStore):
+    await store.insert_messages([message("a", 2), message("b", 3), message("c", 1)])
+    await store.insert_messages([message("c", 4, direction="outbound")])
+    assert [conv["_id"] for conv in await store.list_conversations(10)] == ["c", "b", "a"]
+    assert [conv["_id"] for conv in await store.list_conversations(2)] == ["c", "b"]
+
+async def check_search(store: MessageStore):
+    await store.insert_messages([
+        message("a", 1, body="Your invoice is attached"),
+        message("a", 2, body="invoice invoice reminder"),
+        message("a", 3, direction="outbound", body="Thanks for the invoice"),
+        message("b", 4, body="Where is my invoice?"),
+        message("b", 5, body="ok thanks"),
+        message("b", 6, body="OK"),
+        message("b", 7, body="booking confirmed"),
+    ])
+    
+    found = await store.search("invoice", 10)
+    assert len(found) == 4, found
+    assert found[0]["body"] == "invoice invoice reminder", found
+    assert {msg["body"] for msg in await store.search("invoice", 10, user_id="a", direction="inbound")} == {
+        "Your invoice is attached", "invoice invoice reminder"
+    }
+    assert len(await store.search("invoice", 2, offset=3)) == 1
+    windowed = await store.search("invoice", 10, since=T0 + timedelta(minutes=2), until=T0 + timedelta(minutes=4))
+    assert {msg["body"] for msg in windowed} == {"invoice invoice reminder", "Thanks for the invoice"}
+    assert await store.search("nothing matches this", 10) == []
+    
+    # Short queries: word prefix, case-insensitive, newest first
+    assert [msg["body"] for msg in await store.search("ok", 10)] == ["OK", "ok thanks"]
+    assert [msg["body"] for msg in await store.search("(", 10)] == []
+
+async def check_changes_since(store: MessageStore):
+    assert await store.current_sequence() == 0
+    await store.insert_messages([message("a", 1), message("a", 2)])
+    messages, conversations = await store.changes_since(0, 100)
+    assert [msg["message_id"] for msg in messages] == ["wamid.a.1", "wamid.a.2"]
+    assert [conv["_id"] for conv in conversations] == ["a"]
+    high = max(doc["seq"] for doc in messages + conversations)
+    assert await store.current_sequence() == high
+    
+    await store.apply_statuses({"wamid.a.1": {"status": None, "timestamps": {"x": T0}}})
+    messages, conversations = await store.changes_since(high, 100)
+    assert [msg["message_id"] for msg in messages] == ["wamid.a.1"], messages
+    assert conversations == []
+    high = messages[0]["seq"]
+    
+    await store.mark_read("a")
+    messages, conversations = await store.changes_since(high, 100)
+    assert messages == [] and [conv["unread_count"] for conv in conversations] == [0]
+    assert await store.changes_since(await store.current_sequence(), 100) == ([], [])
+    
+    await store.insert_messages([message("b", n) for n in range(5)])
+    messages, _ = await store.changes_since(0, 3)
+    assert len(messages) == 3 and [msg["seq"] for msg in messages] == sorted(msg["seq"] for msg in messages)
+
+async def check_changes_since_concurrent_writers(store: MessageStore):
+    # One writer stamps big batches (slow to commit), the other single messages
+    # and read marks, so later sequence numbers can commit first; a reader
+    # paging by seq meanwhile must still see every change
+    done = asyncio.Event()
+    seen = set()
+    expected = {f"wamid.a.{n}" for n in range(400)} | {f"wamid.b.{n}" for n in range(100)}
+    
+    async def writer(user_id: str, batch: int, rounds: int):
+        for r in range(rounds):
+            await store.insert_messages([message(user_id, r * batch + n) for n in range(batch)])
+            if batch == 1:
+                await store.mark_read(user_id)
+    
+    async def reader():
+        since = 0
+        # A store may show a change shortly after its write returns
+        settled = None
+        while True:
+            finished = done.is_set()
+            messages, conversations = await store.changes_since(since, 50)
+            # Paged like get_changes_since: a full side cuts the batch at its last seq
+            cut = [batch[-1]["seq"] for batch in (messages, conversations) if len(batch) == 50]
+            high = min(cut) if cut else max([since] + [doc["seq"] for doc in messages + conversations])
+            seen.update(msg["message_id"] for msg in messages if msg["seq"] <= high)
+            since = high
+            if finished and not messages and not conversations:
+                settled = settled or time.monotonic() + 2
+                if expected <= seen or time.monotonic() > settled:
+                    return
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0)
+    
+    reading = asyncio.create_task(reader())
+    await asyncio.gather(writer("a", 40, 10), writer("b", 1, 100))
+    done.set()
+    await reading
+    missed = expected - seen
+    assert not missed, f"{len(missed)} changes skipped, e.g. {sorted(missed)[:5]}"
+
+async def check_rebuild_conversations(store: MessageStore):
+    await store.insert_messages([message("a", 1), message("a", 3, direction="outbound", body="last"), message("b", 2)])
+    await store.insert_messages([message("a", 2)])
+    incremental = {conv["_id"]: conv for conv in await store.list_conversations(10)}
+    
+    assert await store.rebuild_conversations() == 2
+    rebuilt = {conv["_id"]: conv for conv in await store.list_conversations(10)}
+    for user_id, conv in incremental.items():
+        for field in ("last", "last_inbound", "total_messages", "inbound_count", "outbound_count"):
+            assert rebuilt[user_id][field] == conv[field], (user_id, field, rebuilt[user_id][field], conv[field])
+        assert rebuilt[user_id]["unread_count"] == 0
+
+async def check_outbound_queue(store: MessageStore):
+    def queued(n: int, due_minutes: int) -> dict:
+        msg = message("a", n, direction="outbound", status="queued")
+        del msg["message_id"]
+        return {**msg, "next_attempt_at": T0 + timedelta(minutes=due_minutes), "attempts": 0}
+    
+    stored = await store.insert_messages([queued(1, 0), queued(2, 1), queued(3, 10), message("a", 4)])
+    ids = [msg["_id"] for msg in stored]
+    assert (await conversation(store, "a"))["outbound_count"] == 3
+    
+    def claimed_ids(docs):
+        return [doc["_id"] for doc in docs]
+    
+    at = lambda minutes: T0 + timedelta(minutes=minutes)
+    assert claimed_ids(await store.claim_outbound(10, at(2), at(5))) == ids[:2]
+    assert await store.claim_outbound(10, at(2), at(5)) == []
+    # An unrecorded claim (a crashed or stalled worker) comes back once its lease runs out
+    assert claimed_ids(await store.claim_outbound(1, at(6), at(20))) == ids[:1]
+    assert claimed_ids(await store.claim_outbound(10, at(6), at(20))) == ids[1:2]
+    # The first claimant can neither renew nor record under its lapsed lease
+    assert not await store.renew_lease(ids[0], at(5), at(21))
+    assert not await store.record_attempt(ids[0], at(5), "sent", at(7), message_id="wamid.stale.1")
+    assert await store.renew_lease(ids[0], at(20), at(21))
+    
+    assert await store.record_attempt(ids[0], at(21), "sent", at(7), message_id="wamid.sent.1")
+    assert not await store.record_attempt(ids[0], at(21), "failed", at(7), error="late")
+    sent = await store.get_message(ids[0])
+    assert sent["status"] == "sent" and sent["message_id"] == "wamid.sent.1" and sent["attempts"] == 1, sent
+    await store.apply_statuses({"wamid.sent.1": {"status": "delivered", "timestamps": {"delivered": at(8)}}})
+    assert await thread_status(store, "a", "wamid.sent.1") == "delivered"
+    
+    assert await store.record_attempt(ids[1], at(20), "queued", at(7), error="HTTP 503", retry_at=at(30))
+    retrying = await store.get_message(ids[1])
+    assert retrying["status"] == "queued" and retrying["attempts"] == 1 and retrying["last_error"] == "HTTP 503"
+    assert claimed_ids(await store.claim_outbound(10, at(25), at(40))) == ids[2:3]
+    assert claimed_ids(await store.claim_outbound(10, at(31), at(40))) == ids[1:2]
+    assert await store.record_attempt(ids[1], at(40), "failed", at(32), error="HTTP 400")
+    failed = await store.get_message(ids[1])
+    assert failed["status"] == "failed" and failed["attempts"] == 2 and failed["last_error"] == "HTTP 400"
+    assert await store.record_attempt(ids[2], at(40), "sent", at(33), message_id="wamid.sent.3")
+    assert await store.claim_outbound(10, at(100), at(120)) == []
+    
+    messages, _ = await store.changes_since(0, 100)
+    assert {msg.get("message_id"): msg["status"] for msg in messages if msg["status"] != "received"} == {
+        "wamid.sent.1": "delivered", "wamid.sent.3": "sent", None: "failed"
+    }, messages
+    assert await store.get_message(store.parse_id(str(ids[0]))) is not None
+    assert await store.get_message(store.parse_id(str(ids[-1]) + "0") if store.name != "mongo"
+                                   else store.parse_id("0" * 24)) is None
+
+async def check_campaigns(store: MessageStore):
+    def campaign(campaign_id: str, minutes: int, status: str = "running", sent: int = 0) -> dict:
+        return {
+            "id": campaign_id, "name": campaign_id, "status": status, "sent": sent,
+            "created_at": T0 + timedelta(minutes=minutes), "finished_at": None,
+            "updated_at": T0 + timedelta(minutes=minutes), "recent_errors": [{"row": 2, "error": "x"}],
+            "preflight": {"rows": 10, "empty_fields": {"name": 1}}
+        }
+    
+    assert await store.get_campaign("c1") is None
+    assert await store.cancel_campaign("c1") is None
+    assert await store.list_campaigns(10) == []
+    
+    assert await store.save_campaign(campaign("c1", 1)) is False
+    assert await store.save_campaign(campaign("c2", 2, status="checked")) is False
+    stored = await store.get_campaign("c1")
+    assert stored == {**campaign("c1", 1), "cancel_requested": False}, stored
+    
+    # A save replaces the document but keeps a cancel request
+    assert (await store.cancel_campaign("c1"))["cancel_requested"] is True
+    assert await store.save_campaign(campaign("c1", 1, sent=5)) is True
+    stored = await store.get_campaign("c1")
+    assert stored["sent"] == 5 and stored["cancel_requested"] is True, stored
+    
+    assert [c["id"] for c in await store.list_campaigns(10)] == ["c2", "c1"]
+    assert [c["id"] for c in await store.list_campaigns(1)] == ["c2"]
+
+CHECKS = [
+    check_insert_skips_duplicates,
+    check_conversation_summary,
+    check_mark_read,
+    check_status_only_moves_forward,
+    check_thread_paging,
+    check_conversation_list_order,
+    check_search,
+    check_changes_since,
+    check_changes_since_concurrent_writers,
+    check_rebuild_conversations,
+    check_outbound_queue,
+    check_campaigns,
+]
+
+@asynccontextmanager
+async def memory_store():
+    from storage.memory import MemoryStore
+    yield MemoryStore()
+
+@asynccontextmanager
+async def sqlite_store():
+    from storage.sqlite import SQLiteStore
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteStore(os.path.join(directory, "inbox.db"))
+        await store.start()
+        try:
+            yield store
+        finally:
+            await store.close()
+
+@asynccontextmanager
+async def mongo_store():
+    from config import DB_NAME
+    from storage import mongo_client_options
+    from storage.mongo import MongoStore
+    store = MongoStore(TEST_MONGO_URI, f"{DB_NAME}_conformance", client_options=mongo_client_options())
+    await store.start()
+    try:
+        await store.reconcile_indexes()
+        yield store
+    finally:
+        await store.client.drop_database(store.db_name)
+        await store.close()
+
+BACKENDS = {"memory": memory_store, "sqlite": sqlite_store, "mongo": mongo_store}
+
+@pytest.mark.parametrize("check", CHECKS, ids=lambda check: check.__name__)
+@pytest.mark.parametrize("backend", [
+    "memory",
+    "sqlite",
+    pytest.param("mongo", marks=pytest.mark.skipif(not TEST_MONGO_URI, reason="TEST_MONGO_URI is not set"))
+])
+def test_conformance(backend, check):
+    async def run():
+        async with BACKENDS[backend]() as store:
+            await check(store)
+    asyncio.run(run())